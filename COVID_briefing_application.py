@@ -10,16 +10,147 @@ import time
 import sched
 import json
 import logging
-import requests
-import pyttsx3
-from uk_covid19 import Cov19API
+import threading
+import itertools
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from flask import Markup
-from flask import render_template
 from flask import Flask
 from flask import request
+from flask import Response
+from flask import jsonify
+from persistence import ConfigWriter
+from persistence import atomic_write_json
+from persistence import append_archive
+from storage import open_repository
+from storage import JSONRepository
+from storage import AlarmExistsError
+from upstream_cache import TTLCache
+from covid_data import CovidSeriesStore
+from covid_data import fetch_region_series
+from covid_data import UnknownRegionError
+from http_client import HTTPClient
+from speech import SpeechWorker
+from speech import ENGINE_FACTORIES
+from rendering import RenderCache
+from events import EventBroadcaster
+from leader import LeaderLock
+from leader import SoleLeader
+from circuit_breaker import CircuitBreaker
+from metrics import MetricsRegistry
+from logging_pipeline import start_logging
+from timer_wheel import TimerWheel
 
 app = Flask(__name__)
-alarm_schedule = sched.scheduler(time.time, time.sleep)
+#alarm and notification HTML, and the index page, rendered once per change
+render_cache = RenderCache(app.jinja_env)
+#changes pushed to open dashboards over /api/events
+event_broadcaster = EventBroadcaster()
+
+#timings and counts of the hot paths, served from /metrics (see metrics.py)
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram("briefing_request_seconds",
+                                    "Seconds taken to answer a request", ("handler",))
+refresh_seconds = metrics.histogram("briefing_refresh_upcoming_alarms_seconds",
+                                    "Seconds taken by refresh_upcoming_alarms")
+ring_seconds = metrics.histogram("briefing_ring_seconds",
+                                 "Seconds taken to ring a wave of alarms")
+alarms_rung = metrics.counter("briefing_alarms_rung_total", "Alarms rung")
+items_archived = metrics.counter("briefing_items_archived_total",
+                                 "Notifications and alarms moved to the archive", ("kind",))
+upstream_fetch_seconds = metrics.histogram("briefing_upstream_fetch_seconds",
+                                           "Seconds taken to fetch briefing content, cached or not",
+                                           ("source",))
+upstream_errors = metrics.counter("briefing_upstream_errors_total",
+                                  "Briefing content that failed or timed out",
+                                  ("source", "reason"))
+config_write_seconds = metrics.histogram("briefing_config_write_seconds",
+                                         "Seconds taken to write config.json")
+
+#set whenever something is added to alarm_schedule so the scheduler
+#thread re-checks its next deadline instead of sleeping through it
+scheduler_wakeup = threading.Event()
+scheduler_thread = None
+
+#longest the scheduler thread sleeps before checking whether other
+#processes have changed alarms, or whether it can take over as leader
+SCHEDULER_IDLE_SECONDS = 2
+
+NEWS_API_URL = 'http://newsapi.org/v2/top-headlines'
+WEATHER_API_URL = "http://api.openweathermap.org/data/2.5/weather"
+
+#times create_alarm tries for a free alarm ID when other requests take them first
+ALARM_ID_ATTEMPTS = 5
+
+#seconds each source is given in assemble_briefing before it is left out
+DEFAULT_FETCH_TIMEOUTS = {"covid" : 10, "weather" : 5, "news" : 5}
+
+#seconds upstream responses are reused for. COVID-19 figures for
+#days that have passed are kept until evicted, as they don't change
+DEFAULT_CACHE_TTLS = {"covid" : 3600, "weather" : 600, "news" : 600}
+
+#failures in a row after which a source isn't called, and seconds until a
+#call is let through to try it again (see circuit_breaker.py)
+DEFAULT_CIRCUIT_BREAKER = {"failure-threshold" : 5, "probe-interval" : 30}
+
+#added to briefing content served from an old response while its source is down
+STALE_NOTICE = "<i>(Last available, as the source is unavailable)</i>"
+
+#formats of /api/covid-cases, and rows sent together in each chunk of its response
+EXPORT_MIMETYPES = {"csv" : "text/csv", "ndjson" : "application/x-ndjson"}
+EXPORT_CHUNK_ROWS = 256
+
+#how many notifications and undismissed alarms are kept, and for how long,
+#before compact_history moves them to the archive. None is no limit
+DEFAULT_RETENTION = {"max-notifications" : 30, "max-undismissed-alarms" : 100,
+                     "max-age-days" : 30, "compact-interval" : 3600,
+                     "archive-path" : "archive.ndjson"}
+
+#alarm key -> (generation, event, title) for every alarm in alarm_schedule.
+#Alarms are queued once, and can be found/cancelled without scanning the queue
+scheduled_alarms = {}
+scheduler_lock = threading.Lock()
+schedule_generation = itertools.count()
+#superseded events left in the queue by schedule_alarm, which do
+#nothing when they fire
+scheduler_stats = {"stale_events" : 0, "prefetches" : 0}
+#alarm key -> (event, briefing request) for every alarm in prefetch_schedule
+scheduled_prefetches = {}
+
+#alarms are queued in a timer wheel, with a slot per minute (see timer_wheel.py),
+#or in sched's heap. Both are used through the sched.scheduler interface
+SCHEDULER_BACKENDS = {"timer-wheel" : TimerWheel, "sched" : sched.scheduler}
+
+#everything below is set up by create_app, from the config file
+startup_lock = threading.Lock()
+config_path = config_file = keys = settings = persistent_data = None
+log_listener = config_writer = welcome_message = None
+alarm_schedule = prefetch_schedule = None
+briefing_executor = prefetch_executor = fetch_timeouts = None
+ring_wave_seconds = prefetch_lead_seconds = retention = None
+upstream_http = upstream_cache = cache_ttls = covid_series = circuit_breakers = None
+speech_worker = repository = leader_lock = None
+
+#read from the objects that keep them when /metrics is requested
+metrics.callback("briefing_upstream_cache_total", "Upstream cache lookups by result",
+                 lambda: dict(upstream_cache.stats), "counter", ("result",))
+metrics.callback("briefing_render_cache_total", "Rendered page and fragment lookups by result",
+                 lambda: dict(render_cache.stats), "counter", ("result",))
+metrics.callback("briefing_circuit_open", "Whether calls to a source are stopped (1) or not (0)",
+                 lambda: {source : int(breaker.is_open)
+                          for source, breaker in circuit_breakers.items()},
+                 "gauge", ("source",))
+metrics.callback("briefing_covid_series_total", "COVID-19 series lookups and fetches",
+                 lambda: dict(covid_series.stats), "counter", ("operation",))
+metrics.callback("briefing_scheduler_queue_depth", "Alarm events in the scheduler queue",
+                 lambda: scheduler_queue_depth())
+metrics.callback("briefing_scheduler_events_total", "Stale scheduler events and prefetches",
+                 lambda: dict(scheduler_stats), "counter", ("event",))
+metrics.callback("briefing_event_subscribers", "Dashboards subscribed to /api/events",
+                 lambda: event_broadcaster.subscriber_count())
+
 
 def reset_persistent_data():
     """Resets config file to first-startup state
@@ -27,69 +158,223 @@ def reset_persistent_data():
     No Arguments
     """
     try:
-        with open("config.json", "r") as f:
-            config_file = json.load(f)
+        with open(config_path, "r") as f:
+            saved_config = json.load(f)
+
+        saved_config["persistent-data"]["ID-value"] = 0
+        saved_config["persistent-data"]["notifications"] = []
+        saved_config["persistent-data"]["undismissed_alarms"] = []
+        saved_config["persistent-data"]["upcoming_alarms"] = []
 
-        config_file["persistent-data"]["ID-value"] = 0
-        config_file["persistent-data"]["notifications"] = []
-        config_file["persistent-data"]["undismissed_alarms"] = []
-        config_file["persistent-data"]["upcoming_alarms"] = []
+        repository.reset()
 
-        with open("config.json", "w") as f:
-            json.dump(config_file, f, indent=4, sort_keys=True)
+        #pending changes would overwrite the reset
+        config_writer.discard()
+        atomic_write_json(config_path, saved_config)
         logging.info("Config file has been reset.")
     except Exception as raised_exception:
         logging.exception("Error in reset_config : "+str(raised_exception))
 
+def save_config():
+    """Marks config file as changed. config_writer writes it to disk
+    shortly after, together with any other changes made meanwhile
 
-#Opening config file
-with open("config.json", "r") as f:
-    config_file = json.load(f)
-keys = config_file["API-keys"]
-settings = config_file["settings"]
-persistent_data = config_file["persistent-data"]
-
-#logging can be in info mode for cleaner data
-FORMAT = "%(levelname)s: %(asctime)s %(message)s"
-
-if settings["debug-mode"] == "True":
-    logging.basicConfig(filename="program_log.log", format=FORMAT, level=logging.DEBUG)
-else:
-    logging.basicConfig(filename="program_log.log", format=FORMAT, level=logging.INFO)
+    No Arguments
+    """
+    config_writer.mark_dirty()
 
-logging.info("App has been initialized!")
 
-#Formats minutes for welcome notification
-if len(str(settings["daily-notification-min"])) == 1:
-    FORMATTED_MINS = "0"+str(settings["daily-notification-min"])
-else:
-    FORMATTED_MINS = str(settings["daily-notification-min"])
-welcome_message = {"title" : "Welcome to the COVID-19 Briefing and Alarm application!",
-"content" : Markup("Your location is set to : "+settings["covid19-region"]+"<br>"+
-                    "Daily infection rate notifications set to appear at "+
-                    str(settings["daily-notification-hour"])+":"+
-                    FORMATTED_MINS)}
+def create_app(path : str = "config.json", start : bool = False) -> Flask:
+    """Loads the config file, and sets up logging, saving, storage,
+    scheduling and upstream clients. Nothing is read, written or started
+    when the module is imported, only here. Returns the Flask app.
+    Does nothing more if called again, so WSGI servers
+    (e.g. gunicorn "COVID_briefing_application:create_app(start=True)")
+    and tests can all call it
 
-notifications = config_file["persistent-data"]["notifications"]
+    Keyword Arguments:
+    path -- Config file of settings, API keys and persistent data
+    start -- Whether to start the scheduler thread too, as servers should.
+             Tests leave it to be started when needed
+    """
 
-#If welcome notification hasn't been displayed, display it!
-if not welcome_message in notifications:
-    notifications.append(welcome_message)
-    config_file["persistent-data"]["notifications"] = notifications
+    global config_path, config_file, keys, settings, persistent_data, log_listener
+    global config_writer, welcome_message, alarm_schedule, prefetch_schedule
+    global briefing_executor, fetch_timeouts, ring_wave_seconds, prefetch_lead_seconds, retention
+    global prefetch_executor, upstream_http, upstream_cache, cache_ttls, covid_series
+    global circuit_breakers
+    global speech_worker, repository, leader_lock
+
+    with startup_lock:
+        if config_file is not None:
+            if start:
+                start_scheduler()
+            return app
+
+        #Opening config file
+        with open(path, "r") as f:
+            loaded_config = json.load(f)
+        config_path = path
+        keys = loaded_config["API-keys"]
+        settings = loaded_config["settings"]
+        persistent_data = loaded_config["persistent-data"]
+
+        #logging can be in info mode for cleaner data. Records are written to
+        #program_log.log by a background thread (see logging_pipeline.py)
+        if settings["debug-mode"] == "True":
+            log_listener = start_logging(settings.get("logging", {}), logging.DEBUG)
+        else:
+            log_listener = start_logging(settings.get("logging", {}), logging.INFO)
+        #atexit runs in reverse, so records logged by the final save are written out
+        atexit.register(log_listener.stop)
+
+        #writes happen in the background, and once more on shutdown
+        config_writer = ConfigWriter(path, loaded_config, settings.get("save-interval", 1.0),
+                                     after_write = config_write_seconds.observe)
+        atexit.register(config_writer.close)
+
+        logging.info("App has been initialized!")
+
+        #Formats minutes for welcome notification
+        if len(str(settings["daily-notification-min"])) == 1:
+            formatted_mins = "0"+str(settings["daily-notification-min"])
+        else:
+            formatted_mins = str(settings["daily-notification-min"])
+        welcome_message = {"title" : "Welcome to the COVID-19 Briefing and Alarm application!",
+        "content" : Markup("Your location is set to : "+settings["covid19-region"]+"<br>"+
+                            "Daily infection rate notifications set to appear at "+
+                            str(settings["daily-notification-hour"])+":"+
+                            formatted_mins)}
+
+        #see SCHEDULER_BACKENDS
+        scheduler_backend = SCHEDULER_BACKENDS[settings.get("scheduler-backend", "timer-wheel")]
+        alarm_schedule = scheduler_backend(time.time, time.sleep)
+        #briefing prefetches, run by the scheduler thread a little before their alarms
+        prefetch_schedule = scheduler_backend(time.time, time.sleep)
+
+        #upstream fetches for alarm rings run in these threads, so a briefing
+        #takes as long as its slowest source rather than all of them added up.
+        #Threads are only started when something is fetched
+        briefing_executor = ThreadPoolExecutor(max_workers = settings.get("fetch-workers", 8),
+                                               thread_name_prefix = "briefing-fetch")
+        fetch_timeouts = dict(DEFAULT_FETCH_TIMEOUTS, **settings.get("fetch-timeouts", {}))
+        #alarms due this many seconds after a ringing alarm ring with it
+        ring_wave_seconds = settings.get("ring-wave-seconds", 0)
+        #seconds before an alarm its briefing is fetched, so ringing only waits
+        #on cached content. Should be less than the weather and news cache-ttl
+        prefetch_lead_seconds = settings.get("prefetch-lead-seconds", 120)
+        #prefetches run here rather than in briefing_executor, as they wait on it
+        prefetch_executor = ThreadPoolExecutor(max_workers = 1,
+                                               thread_name_prefix = "briefing-prefetch")
+
+        #pooled connections, timeouts and retries for every upstream request
+        #(see http_client.py). requests is only loaded by the first request
+        http_settings = settings.get("http", {})
+        upstream_http = HTTPClient(connect_timeout = http_settings.get("connect-timeout", 3.05),
+                                   read_timeout = http_settings.get("read-timeout", 10),
+                                   retries = http_settings.get("retries", 2),
+                                   backoff = http_settings.get("backoff", 0.5),
+                                   pool_size = http_settings.get("pool-size", 10))
+
+        #shared by alarms and notifications ringing close together (see upstream_cache.py)
+        upstream_cache = TTLCache(settings.get("cache-size", 256))
+        cache_ttls = dict(DEFAULT_CACHE_TTLS, **settings.get("cache-ttl", {}))
+
+        #a source that keeps failing is left alone until it recovers, and
+        #its last good response is served meanwhile
+        breaker_settings = dict(DEFAULT_CIRCUIT_BREAKER, **settings.get("circuit-breaker", {}))
+        circuit_breakers = {source : CircuitBreaker(source, breaker_settings["failure-threshold"],
+                                                    breaker_settings["probe-interval"])
+                            for source in DEFAULT_CACHE_TTLS}
+
+        #each region's case figures are fetched in one request and answered
+        #from memory (see covid_data.py)
+        covid_series = CovidSeriesStore(functools.partial(circuit_breakers["covid"].call,
+                                                          fetch_region_series,
+                                                          client = upstream_http),
+                                        refresh_interval = cache_ttls["covid"],
+                                        folder = settings.get("covid-cache-folder", "covid_cache"),
+                                        max_regions = settings.get("covid-max-regions", 64))
+
+        #alarm titles are read out by one long-lived engine on its own thread,
+        #started by the first alarm to ring (see speech.py)
+        speech_worker = SpeechWorker(ENGINE_FACTORIES[settings.get("tts-engine", "pyttsx3")],
+                                     settings.get("tts-queue-size", 16))
+
+        #alarms and notifications, kept in config.json or an SQLite database (see storage.py)
+        repository = open_repository(settings, persistent_data, save_config)
+
+        if isinstance(repository, JSONRepository):
+            #alarm lists in config_file are rebuilt from the repository before each write
+            config_writer.before_write = repository.sync_to_data
+
+        #old notifications and alarms are archived by compact_history
+        retention = dict(DEFAULT_RETENTION, **settings.get("retention", {}))
+
+        #when several worker processes share the database, only the one
+        #holding this lock runs the scheduler, so alarms ring once.
+        #config.json isn't shared, so a process using it always runs its own
+        if isinstance(repository, JSONRepository):
+            leader_lock = SoleLeader()
+        else:
+            leader_lock = LeaderLock(settings.get("scheduler-lock-path", "scheduler.lock"))
+
+        #If welcome notification hasn't been displayed, display it!
+        if not any(notif["title"] == welcome_message["title"]
+                   and notif["content"] == welcome_message["content"]
+                   for notif in repository.notifications()):
+            repository.add_notification(welcome_message)
+
+        #set last, as it marks the app as created
+        config_file = loaded_config
+
+        #started with the app rather than by its first request, so alarms
+        #ring in a server that hasn't been visited yet
+        if start:
+            start_scheduler()
+
+    return app
+
+
+def fetch_upstream_json(source : str, url : str, params : dict) -> tuple:
+    """Returns (JSON response from url, whether it is stale), reusing a
+    recent response if there is one. If the request fails, or the
+    source's circuit is open, the last good response is returned as
+    stale. Without one, the exception is raised. Failed requests aren't cached
 
-    with open("config.json", "w") as f:
-        json.dump(config_file, f, indent=4, sort_keys=True)
+    Keyword Arguments:
+    source -- "news" or "weather", selects the cache time to live and circuit breaker
+    url -- URL to be requested, without a query string
+    params -- Query string parameters. They are escaped by the client, so
+              values given by users (e.g. an alarm's city) can't add parameters
+    """
 
-#once  upcoming alarm time appears, data is fetched
-upcoming_alarms = config_file["persistent-data"]["upcoming_alarms"]
-undismissed_alarms = config_file["persistent-data"]["undismissed_alarms"]
+    def fetch():
+        response = upstream_http.get(url, params = params)
+        response.raise_for_status()
+        return response.json()
 
+    key = (source, url, tuple(sorted(params.items())))
 
-def get_day_news(date : time) -> str:
+    try:
+        return (upstream_cache.get_or_fetch(key,
+                                            functools.partial(circuit_breakers[source].call, fetch),
+                                            cache_ttls[source]), False)
+    except Exception as raised_exception:
+        stale_response = upstream_cache.get_stale(key)
+        if stale_response is None:
+            raise
+        logging.warning("Serving stale " + source + " data : " + str(raised_exception))
+        upstream_errors.inc(source = source, reason = "stale")
+        return stale_response, True
+
+@upstream_fetch_seconds.time(source = "news")
+def get_day_news(date : time, country : str = None) -> str:
     """Returns formatted news string with headlines from the given date
 
     Keyword Arguments:
     date -- Date for which news articles are fetched
+    country -- Country code of headlines, defaults to news-country in settings
     """
 
     current_time = time.localtime()
@@ -100,13 +385,9 @@ def get_day_news(date : time) -> str:
         current_time.tm_mday == date.tm_mday):
 
         try:
-            base_url = 'http://newsapi.org/v2/top-headlines'
-            location = "?country=" + settings["news-country"]
-            api_key = "&apiKey="+keys["news"]
-
-            final_url = base_url + location + api_key
-
-            response = requests.get(final_url).json()
+            response, stale = fetch_upstream_json("news", NEWS_API_URL,
+                                                  {"country" : country or settings["news-country"],
+                                                   "apiKey" : keys["news"]})
 
             articles = response["articles"]
             formatted_text = "<b>Top news headlines :</b><br>"
@@ -115,23 +396,29 @@ def get_day_news(date : time) -> str:
             for i in range(3):
                 formatted_text = formatted_text + articles[i]["title"] + "<br>"
 
+            if stale:
+                formatted_text = formatted_text + STALE_NOTICE + "<br>"
+
             logging.info("Fetched day news for alarm ring.")
             return formatted_text
 
         except Exception as raised_exception:
             logging.exception("Failed to retrieve news data for given day : "+str(raised_exception))
+            upstream_errors.inc(source = "news", reason = "error")
             return "Error in retrieving data. Please check log for more information."
 
     logging.warning("Attempt to access historical data detected. Returning Unsupported.")
     return "Historical news data not supported!"
 
-def get_day_weather(date : time) -> str:
+@upstream_fetch_seconds.time(source = "weather")
+def get_day_weather(date : time, city : str = None) -> str:
     """Returns formatted string with current date's weather
     Will return "historical weather not supported" if date
     doesn't match current date (openweathermap doesn't support historical data)
 
     Keyword Arguments:
     date -- Date for which weather is fetched
+    city -- City of weather, defaults to weather-city in settings
     """
 
     current_time = time.localtime()
@@ -142,14 +429,9 @@ def get_day_weather(date : time) -> str:
             current_time.tm_mon == date.tm_mon and
             current_time.tm_mday == date.tm_mday):
 
-            base_url = "http://api.openweathermap.org/data/2.5/weather"
-            city = "?q=" + settings["weather-city"]
-            api_key = "&appid="+keys["weather"]
-
-            final_url = base_url + city + api_key
-
-            response = requests.get(final_url).json()
-
+            response, stale = fetch_upstream_json("weather", WEATHER_API_URL,
+                                                  {"q" : city or settings["weather-city"],
+                                                   "appid" : keys["weather"]})
 
             start = "<b>Weather :</b><br>Weather in " + response["name"] + " is "
             description = response["weather"][0]["description"]
@@ -157,12 +439,15 @@ def get_day_weather(date : time) -> str:
             formatted_temp = str(round(temp,1))
 
             weather_text = start + description + ", " + formatted_temp + "ºC"
+            if stale:
+                weather_text = weather_text + " " + STALE_NOTICE
 
             logging.info("Fetched day weather for alarm ring.")
             return weather_text
 
     except Exception as raised_exception:
         logging.exception("Failed to retrieve weather data for given day : "+str(raised_exception))
+        upstream_errors.inc(source = "weather", reason = "error")
         return "Error in retrieving data. Please check log for more information."
 
     logging.warning("Attempt to access historical data detected. Returning Unsupported.")
@@ -180,139 +465,118 @@ def get_day_weather(date : time) -> str:
 #Bristol : straight up 0 data
 #Glasgow : straight up 0 data
 #Edinburgh : straight up 0 data
-def get_day_infection_rate(date : time) -> str:
+@upstream_fetch_seconds.time(source = "covid")
+def get_day_infection_rate(date : time, region : str = None) -> str:
     """Returns formatted string with selected date's
-    COVID-19 infection rate compared to the previous week's
+    COVID-19 infection rate compared to the previous day's.
+    Figures come from the region's stored series, so only the first
+    request for a region (or for a newly published day) uses the API.
+    If the API is down, the latest figures held are given, marked as stale
 
     Keyword Arguments:
     date -- Date for which Infection rate is fetched
+    region -- Area name, defaults to covid19-region in settings
     """
 
-    formatted_text = ""
+    region = region or settings["covid19-region"]
+    stale = False
 
     try:
         datetime_date = time_to_datetime(date)
 
-        date_format = "%Y-%m-%d"
+        #figures are published the day after
+        figure_day = (datetime_date - datetime.timedelta(days = 1)).date()
 
-        current_date = (datetime_date - datetime.timedelta(days = 1)).strftime(date_format)
-        prev_date = (datetime_date - datetime.timedelta(days = 2)).strftime(date_format)
+        series = covid_series.series(region, figure_day)
 
-
-        data_structure = {
-            "date" : "date",
-            "newCasesByPublishDate" : "newCasesByPublishDate"
-        }
-
-        data_filter_current = ["areaName="+settings["covid19-region"],"date="+current_date]
-        data_filter_prev = ["areaName="+settings["covid19-region"],"date="+prev_date]
-
-        api_response_current = Cov19API(
-                        filters = data_filter_current,
-                        structure = data_structure)
-
-        api_response_prev = Cov19API(
-                        filters = data_filter_prev,
-                        structure = data_structure)
-
-        current_json = api_response_current.get_json()
-        prev_json = api_response_prev.get_json()
+    except UnknownRegionError:
+        logging.error("Failed to fetch COVID-19 infection data. Area unknown to API : "+region)
+        return ("COVID-19 infection data for " + region  +
+                " unavailable through PHE database for given date")
 
     except Exception as raised_exception:
-        logging.exception("Error in API Access : "+str(raised_exception))
-        formatted_text = "Error accessing API. Check log for more details."
+        series = covid_series.cached(region)
+        if series is None or series.last_day() is None:
+            logging.exception("Error in API Access : "+str(raised_exception))
+            upstream_errors.inc(source = "covid", reason = "error")
+            return "Error accessing API. Check log for more details."
 
+        #the held series doesn't reach figure_day, or it wouldn't have been fetched
+        logging.warning("Serving stale covid data : "+str(raised_exception))
+        upstream_errors.inc(source = "covid", reason = "stale")
+        figure_day = min(figure_day, series.last_day())
+        stale = True
 
-    #IF there's data display it, otherwise display discompatibility
-    if current_json["data"]:
+    cases = series.cases_on(figure_day)
 
-        try:
-            #using negative list values increases compatibility for edge cases
-            change_in_rate = (current_json["data"][-1]["newCasesByPublishDate"] -
-                                prev_json["data"][-1]["newCasesByPublishDate"])
-
-            date_format = "%d-%m-%Y"
-            formatted_date = (datetime_date - datetime.timedelta(days = 1)).strftime(date_format)
-
-            formatted_text = ("Daily COVID-19 case increase in " +
-                                settings["covid19-region"] +
-                                " was " +
-                                str(current_json["data"][-1]["newCasesByPublishDate"]) +
-                                " on " + formatted_date + ",")
-
-            if change_in_rate < 0:
-                formatted_text = (formatted_text + " down " +
-                                    str(abs(change_in_rate)) +
-                                    " from the previous day.")
-            else:
-                formatted_text = (formatted_text + " up " +
-                                    str(abs(change_in_rate)) +
-                                    " from the previous day.")
-            logging.info("Fetched COVID-19 data for "+formatted_date)
-        except Exception as raised_exception:
-            logging.exception("Error in COVID-19 data access : "+str(raised_exception))
-            formatted_text = "Error accessing data. Check log for more details."
-
-    elif formatted_text == "":
+    #IF there's data display it, otherwise display discompatibility
+    if cases is None:
         logging.error("Failed to fetch COVID-19 infection data. Date/Area unsupported by API.")
-        formatted_text = ("COVID-19 infection data for " + settings["covid19-region"]  +
-                            " unavailable through PHE database for given date")
-
+        return ("COVID-19 infection data for " + region  +
+                " unavailable through PHE database for given date")
+
+    formatted_date = figure_day.strftime("%d-%m-%Y")
+
+    formatted_text = ("Daily COVID-19 case increase in " +
+                        region +
+                        " was " +
+                        str(cases) +
+                        " on " + formatted_date + ",")
+
+    change_in_rate = series.change_on(figure_day)
+
+    if change_in_rate is None:
+        formatted_text = formatted_text[:-1] + "."
+    elif change_in_rate < 0:
+        formatted_text = (formatted_text + " down " +
+                            str(abs(change_in_rate)) +
+                            " from the previous day.")
+    else:
+        formatted_text = (formatted_text + " up " +
+                            str(abs(change_in_rate)) +
+                            " from the previous day.")
+
+    if stale:
+        formatted_text = formatted_text + " " + STALE_NOTICE
+
+    logging.info("Fetched COVID-19 data for "+formatted_date)
     return formatted_text
 
 
 #works with IDs
-def del_notif(notif_to_delete : str):
-    """Dismisses selected notification
+def del_notif(notif_to_delete : str) -> bool:
+    """Dismisses selected notification. Returns whether it existed
 
     Keyword Arguments:
     notif_to_delete -- Notification to be dismissed
     """
 
-    for notif in notifications:
-        if notif["title"] == notif_to_delete:
-            notif_index = notifications.index(notif)
-            notifications.pop(notif_index)
-
-            config_file["persistent-data"]["notifications"] = notifications
+    notif = repository.delete_notification(notif_to_delete)
 
-            with open("config.json", "w") as f:
-                json.dump(config_file, f, indent=4, sort_keys=True)
+    if notif is not None:
+        render_cache.forget("notification", notif["title"])
+        publish_change("notification", notif, "deleted")
+        logging.info("Deleted notification " + notif["title"])
 
-            logging.info("Deleted notification " + notif["title"])
-            break
+    return notif is not None
 
-def del_alarm(alarm_to_delete : str):
-    """Dismisses selected alarm
+def del_alarm(alarm_to_delete : str) -> bool:
+    """Dismisses selected alarm. Returns whether it existed
 
     Keyword Arguments:
     alarm_to_delete -- Alarm to be dismissed
     """
 
-    for alarm in undismissed_alarms:
-        if alarm["title"] == alarm_to_delete:
-            alarm_index = undismissed_alarms.index(alarm)
-            undismissed_alarms.pop(alarm_index)
-
-            config_file["persistent-data"]["undismissed_alarms"] = undismissed_alarms
-
-            with open("config.json", "w") as f:
-                json.dump(config_file, f, indent=4, sort_keys=True)
-
-            logging.info("Deleted alarm " + alarm["title"])
-            break
-    for alarm in upcoming_alarms:
-        if alarm["title"] == alarm_to_delete:
-            alarm_index = upcoming_alarms.index(alarm)
-            upcoming_alarms.pop(alarm_index)
+    deleted = repository.delete_alarm(alarm_to_delete)
 
-            config_file["persistent-data"]["upcoming_alarms"] = upcoming_alarms
+    for alarm in deleted:
+        unschedule_alarm(alarm_key(alarm))
+        render_cache.forget("alarm", alarm["title"])
+        publish_change("alarm", alarm, "deleted")
 
-            with open("config.json", "w") as f:
-                json.dump(config_file, f, indent=4, sort_keys=True)
+        logging.info("Deleted alarm " + alarm["title"])
 
-            logging.info("Deleted alarm " + alarm["title"])
-            break
+    return len(deleted) > 0
 
 
 
@@ -324,60 +588,81 @@ def set_alarm():
     """
 
     try:
-        alarm_time = request.args.get('alarm')
-        alarm_id = str(config_file["persistent-data"]["ID-value"])
-        alarm_name = request.args.get("two") + " (ID : " + alarm_id + ")"
-
-        new_alarm = {"title" : alarm_name, "content" : "", "time" : alarm_time}
-
-        
-        date_content = time.strftime("%H:%M %A, %d %B %Y", string_to_time(alarm_time))
-        date_content = "Upcoming: <b>" + date_content + "</b>"
+        create_alarm(request.args.get('alarm'),
+                     request.args.get("two"),
+                     bool(request.args.get("news")),
+                     bool(request.args.get("weather")),
+                     request.args.get("region"),
+                     request.args.get("city"),
+                     request.args.get("country"))
+    except Exception as raised_exception:
+        logging.exception("Error in adding alarm: "+str(raised_exception))
 
-        new_alarm["content"] = date_content + "<br>Alarm will notify of COVID-19 infection rate"
+def create_alarm(alarm_time : str, label : str, include_news : bool, include_weather : bool,
+                 region : str = None, city : str = None, country : str = None) -> dict:
+    """Creates an alarm and schedules it, or rings it straight away if
+    its time has passed. Returns the new alarm, or None if an alarm
+    with the same title has already rung and is undismissed
 
-        if request.args.get("weather") and request.args.get("news"):
-            new_alarm["content"] = new_alarm["content"] + ", weather and news"
-        elif request.args.get("news"):
-            new_alarm["content"] = new_alarm["content"] + "  news"
-        elif request.args.get("weather"):
-            new_alarm["content"] = new_alarm["content"] + " and weather"
+    Keyword Arguments:
+    alarm_time -- Time of alarm, e.g. 2020-12-04T08:00
+    label -- Title of alarm. Its ID is added to the end
+    include_news -- Whether the briefing includes news
+    include_weather -- Whether the briefing includes weather
+    region -- COVID-19 area of the briefing, defaults to covid19-region in settings
+    city -- Weather city of the briefing, defaults to weather-city in settings
+    country -- News country of the briefing, defaults to news-country in settings
+    """
 
-        #seems to work
-        current_time = datetime.datetime.now()
-        alarm_time_comparison = time_to_datetime(string_to_time(alarm_time))
+    alarm_struct_time = string_to_time(alarm_time)
 
-        alarm_already_added = False
+    #epoch timestamp is worked out once here, so scheduling never reparses alarm_time
+    new_alarm = {"title" : "", "content" : "", "time" : alarm_time, "id" : "",
+                "fire_at" : time.mktime(alarm_struct_time)}
 
-        #This loop avoids errors where alarms are added twice
-        for alarm in undismissed_alarms:
-            if alarm["title"] == alarm_name:
-                alarm_already_added = True
-                break
+    date_content = time.strftime("%H:%M %A, %d %B %Y", alarm_struct_time)
+    date_content = "Upcoming: <b>" + date_content + "</b>"
 
-        if current_time < alarm_time_comparison and alarm_already_added is False:
-            upcoming_alarms.append(new_alarm)
+    new_alarm["content"] = date_content + "<br>Alarm will notify of COVID-19 infection rate"
 
-            config_file["persistent-data"]["ID-value"] += 1
-            config_file["persistent-data"]["upcoming_alarms"] = upcoming_alarms
+    if include_weather and include_news:
+        new_alarm["content"] = new_alarm["content"] + ", weather and news"
+    elif include_news:
+        new_alarm["content"] = new_alarm["content"] + "  news"
+    elif include_weather:
+        new_alarm["content"] = new_alarm["content"] + " and weather"
 
-            with open("config.json", "w") as f:
-                json.dump(config_file, f, indent=4, sort_keys=True)
-            logging.info("Alarm added, "+alarm_time+", title "+new_alarm["title"])
+    #only stored when given, so other alarms follow changes to settings
+    for field, value in (("region", region), ("city", city), ("country", country)):
+        if value:
+            new_alarm[field] = value
 
+    for attempt in range(ALARM_ID_ATTEMPTS):
+        alarm_id = repository.current_alarm_id()
+        new_alarm["id"] = alarm_id
+        new_alarm["title"] = label + " (ID : " + alarm_id + ")"
 
-        elif alarm_already_added is False:
-            upcoming_alarms.append(new_alarm)
+        #This avoids errors where alarms are added twice
+        if repository.has_undismissed_alarm(new_alarm["title"]):
+            return None
 
-            config_file["persistent-data"]["ID-value"] += 1
+        try:
+            repository.add_alarm(new_alarm)
+            break
+        except AlarmExistsError:
+            #another request took this ID first, so try the next one
+            if attempt == ALARM_ID_ATTEMPTS - 1:
+                raise
 
-            with open("config.json", "w") as f:
-                json.dump(config_file, f, indent=4, sort_keys=True)
+    if time.time() < new_alarm["fire_at"]:
+        logging.info("Alarm added, "+alarm_time+", title "+new_alarm["title"])
+        publish_change("alarm", new_alarm, "upcoming")
+        schedule_alarm(new_alarm)
+    else:
+        logging.info("Alarm added, "+alarm_time+", title "+new_alarm["title"]+ ". Ringing immediately")
+        alarm_ring(new_alarm["title"])  #immediately rings it
 
-            logging.info("Alarm added, "+alarm_time+", title "+new_alarm["title"]+ ". Ringing immediately")
-            alarm_ring(new_alarm["title"])  #immediately rings it
-    except Exception as raised_exception:
-        logging.exception("Error in adding alarm: "+str(Exception))
+    return new_alarm
 
 def alarm_ring(title : str):
     """Moves upcoming alarms to undismissed alarms, runs tts
@@ -387,62 +672,174 @@ def alarm_ring(title : str):
     title -- Title of alarm to ring
     """
 
-    tts_engine = pyttsx3.init()
+    ring_alarms([title])
 
-    for checked_alarm in upcoming_alarms:
-        if checked_alarm["title"] == title:
-            alarm = checked_alarm
-            alarm_index = upcoming_alarms.index(checked_alarm)
-            upcoming_alarms.pop(alarm_index)
+@ring_seconds.time()
+def ring_alarms(titles : list):
+    """Rings several alarms as one wave. Content each briefing needs is
+    fetched once for the whole wave, so alarms sharing a region, city
+    or country share its fetch. The wave's alarms are taken from upcoming
+    alarms, and added to undismissed alarms, in one change each, so
+    storage is written twice per wave rather than twice per alarm
 
-            try:
-                tts_engine.say(alarm["title"])
-                tts_engine.runAndWait()
-            except RuntimeError:
-                logging.error("TTS Engine overloaded. Moving on.")
-            except Exception as raised_exception:
-                logging.exception("Error in TTS engine :"+str(raised_exception))
+    Keyword Arguments:
+    titles -- Titles of alarms to ring
+    """
 
+    alarms = repository.pop_upcoming_alarms(titles)
+    for alarm in alarms:
+        unschedule_alarm(alarm_key(alarm))
+        render_cache.forget("alarm", alarm["title"])
 
-            try:
-                weather_content = ""
-                news_content = ""
-                infection_content = ""
+        #spoken by speech_worker, so ringing doesn't wait for it
+        speech_worker.say(alarm["title"])
 
-                alarm_date = string_to_time(alarm["time"])
-                date_content = time.strftime("%H:%M %A, %d %B %Y", alarm_date)
-                date_content = "<b>" + date_content + "</b>"
+    briefing_requests = []
+    for alarm in list(alarms):
+        try:
+            #checks if content contains weather/news and fetches necessary data
+            briefing_requests.append(alarm_briefing_request(alarm))
+        except Exception as raised_exception:
+            logging.exception("Error in Alarm ring :"+str(raised_exception))
+            alarms.remove(alarm)
 
-                #checks if content contains weather/news and fetches necessary data
-                if "weather" in alarm["content"]:
-                    weather_content = get_day_weather(alarm_date)
-                if "news" in alarm["content"]:
-                    news_content = get_day_news(alarm_date)
+    if not alarms:
+        return
 
-                infection_content = get_day_infection_rate(alarm_date)
+    try:
+        briefings = fetch_briefings(briefing_requests)
+    except Exception as raised_exception:
+        logging.exception("Error in Alarm ring :"+str(raised_exception))
+        return
 
-                content = [date_content, infection_content, weather_content, news_content]
+    rung = []
+    for alarm, briefing_request, briefing in zip(alarms, briefing_requests, briefings):
+        try:
+            date_content = time.strftime("%H:%M %A, %d %B %Y", briefing_request["date"])
+            date_content = "<b>" + date_content + "</b>"
 
-                alarm["content"] = ""
-                #Markup makes flask not ignore newlines
-                for item in content:
-                    if item:
-                        alarm["content"] = alarm["content"] + item + "<br>"
+            content = [date_content, briefing["covid"], briefing["weather"], briefing["news"]]
 
-                alarm["content"] = Markup(alarm["content"])
+            #Markup makes flask not ignore newlines
+            alarm["content"] = Markup("".join(item + "<br>" for item in content if item))
+            rung.append(alarm)
+        except Exception as raised_exception:
+            logging.exception("Error in Alarm ring :"+str(raised_exception))
 
-                undismissed_alarms.append(alarm)
+    try:
+        repository.add_undismissed_alarms(rung)
+    except Exception as raised_exception:
+        logging.exception("Error in Alarm ring :"+str(raised_exception))
+        return
 
-                config_file["persistent-data"]["undismissed_alarms"] = undismissed_alarms
+    for alarm in rung:
+        publish_change("alarm", alarm, "undismissed")
+        logging.info("Alarm rang " + alarm["title"])
+    alarms_rung.inc(len(rung))
 
-                with open("config.json", "w") as f:
-                    json.dump(config_file, f, indent=4, sort_keys=True)
+def alarm_briefing_request(alarm : dict) -> dict:
+    """Returns what an alarm's briefing needs: its date, place and sources
 
-                logging.info("Alarm rang " + alarm["title"])
-            except Exception as raised_exception:
-                logging.exception("Error in Alarm ring :"+str(raised_exception))
+    Keyword Arguments:
+    alarm -- Alarm being rung
+    """
 
-            break
+    return {"date" : string_to_time(alarm["time"]),
+            "region" : alarm.get("region") or settings["covid19-region"],
+            "city" : alarm.get("city") or settings["weather-city"],
+            "country" : alarm.get("country") or settings["news-country"],
+            "weather" : "weather" in alarm["content"],
+            "news" : "news" in alarm["content"]}
+
+def assemble_briefing(date : time, include_weather : bool, include_news : bool,
+                      region : str = None, city : str = None, country : str = None) -> dict:
+    """Fetches COVID-19, weather and news content for a briefing at the
+    same time. Returns a dictionary with "covid", "weather" and "news" text.
+    Sources that aren't included are empty, and sources that take longer
+    than their fetch timeout are replaced with an error message
+
+    Keyword Arguments:
+    date -- Date of briefing
+    include_weather -- Whether weather should be fetched
+    include_news -- Whether news should be fetched
+    region -- COVID-19 area, defaults to covid19-region in settings
+    city -- Weather city, defaults to weather-city in settings
+    country -- News country, defaults to news-country in settings
+    """
+
+    return fetch_briefings([{"date" : date,
+                             "region" : region or settings["covid19-region"],
+                             "city" : city or settings["weather-city"],
+                             "country" : country or settings["news-country"],
+                             "weather" : include_weather,
+                             "news" : include_news}])[0]
+
+def briefing_sources(briefing_request : dict) -> dict:
+    """Returns {source : key} for the content a briefing needs. Briefings
+    needing the same content have the same key, e.g. ("weather", city, day)
+
+    Keyword Arguments:
+    briefing_request -- Briefing request (see alarm_briefing_request)
+    """
+
+    date = briefing_request["date"]
+    day = (date.tm_year, date.tm_mon, date.tm_mday)
+
+    sources = {"covid" : ("covid", briefing_request["region"], day)}
+    if briefing_request["weather"]:
+        sources["weather"] = ("weather", briefing_request["city"], day)
+    if briefing_request["news"]:
+        sources["news"] = ("news", briefing_request["country"], day)
+    return sources
+
+def fetch_briefings(briefing_requests : list) -> list:
+    """Fetches content for several briefings at the same time, each
+    distinct piece (a region's figures, a city's weather, a country's
+    news) once. Returns a briefing dictionary for each request, as
+    assemble_briefing does
+
+    Keyword Arguments:
+    briefing_requests -- Briefing requests (see alarm_briefing_request)
+    """
+
+    fetchers = {"covid" : get_day_infection_rate, "weather" : get_day_weather,
+                "news" : get_day_news}
+
+    start = time.monotonic()
+    futures = {}
+    for briefing_request in briefing_requests:
+        for source, key in briefing_sources(briefing_request).items():
+            if key not in futures:
+                futures[key] = briefing_executor.submit(fetchers[source],
+                                                        briefing_request["date"], key[1])
+
+    results = {}
+    for key, future in futures.items():
+        source = key[0]
+        #timeouts count from the start, as all sources run together
+        remaining = fetch_timeouts[source] - (time.monotonic() - start)
+        try:
+            results[key] = future.result(timeout = max(remaining, 0))
+        except FutureTimeoutError:
+            future.cancel()
+            logging.error("Timed out fetching " + source + " for briefing.")
+            upstream_errors.inc(source = source, reason = "timeout")
+            results[key] = "Timed out retrieving data. Please check log for more information."
+        except Exception as raised_exception:
+            logging.exception("Error fetching " + source + " for briefing : "+str(raised_exception))
+            upstream_errors.inc(source = source, reason = "error")
+            results[key] = "Error in retrieving data. Please check log for more information."
+
+    briefings = []
+    for briefing_request in briefing_requests:
+        briefing = {"covid" : "", "weather" : "", "news" : ""}
+        for source, key in briefing_sources(briefing_request).items():
+            briefing[source] = results[key]
+        briefings.append(briefing)
+
+    logging.debug("Fetched " + str(len(futures)) + " sources for " +
+                  str(len(briefing_requests)) + " briefings.")
+    return briefings
 
 def notification_ring(date : time):
     """Rings COVID-19 notification according to given
@@ -459,63 +856,442 @@ def notification_ring(date : time):
         notif = {"title":"COVID-19 Update "+date_content,"content":infection_content}
 
 
-        #this fragment checks if the notification has already been displayed
-        notif_displayed = False
-        for notif_checked in notifications:
-            if notif_checked["title"] == "COVID-19 Update "+date_content:
-                notif_displayed = True
-                break
+        #this checks if the notification has already been displayed
+        if not repository.has_notification(notif["title"]):
+            repository.add_notification(notif)
+            publish_change("notification", notif, "added")
+            logging.info("Notification sent")
+
+    except Exception as raised_exception:
+        logging.exception("Error in notification ring : "+str(raised_exception))
 
-        if not notif_displayed:
-            notifications.append(notif)
+def item_to_json(item : dict) -> dict:
+    """Returns a copy of an alarm or notification that can be sent as JSON
 
-            config_file["persistent-data"]["notifications"] = notifications
+    Keyword Arguments:
+    item -- Alarm or notification
+    """
 
-            with open("config.json", "w") as f:
-                json.dump(config_file, f, indent=4, sort_keys=True)
-            logging.info("Notification sent")
+    return dict(item, content = str(item["content"]))
+
+def publish_change(kind : str, item : dict, state : str):
+    """Pushes a changed alarm or notification, with its HTML fragment,
+    to open dashboards
+
+    Keyword Arguments:
+    kind -- "alarm" or "notification"
+    item -- Item that changed
+    state -- "upcoming", "undismissed", "added" or "deleted"
+    """
+
+    data = {"kind" : kind, "state" : state, "item" : item_to_json(item)}
+    if state != "deleted":
+        fragment_state = state if kind == "alarm" else ""
+        #rendered here, once, and reused by every later page render
+        data["html"] = str(render_cache.fragment(kind, item, fragment_state))
+
+    event_broadcaster.publish(kind, data, repository.version)
+
+def alarm_key(alarm : dict) -> str:
+    """Returns the key an alarm is scheduled under. Alarms saved before
+    IDs were stored are keyed by title, which also contains the ID
+
+    Keyword Arguments:
+    alarm -- Alarm to get key of
+    """
+
+    return str(alarm.get("id", alarm["title"]))
+
+def alarm_fire_time(alarm : dict) -> float:
+    """Returns epoch timestamp an alarm rings at. Alarms saved
+    before this was stored have it worked out (once) from their time string
+
+    Keyword Arguments:
+    alarm -- Alarm to get ring time of
+    """
+
+    if "fire_at" not in alarm:
+        alarm["fire_at"] = time.mktime(string_to_time(alarm["time"]))
+
+    return alarm["fire_at"]
+
+def schedule_alarm(alarm : dict):
+    """Queues alarm to ring at its time. If the alarm is already
+    queued, it is moved instead (the old event is left to expire,
+    so this is a single heap push)
+
+    Keyword Arguments:
+    alarm -- Alarm to schedule
+    """
+
+    key = alarm_key(alarm)
+    generation = next(schedule_generation)
+
+    with scheduler_lock:
+        if key in scheduled_alarms:
+            scheduler_stats["stale_events"] += 1
+
+        #absolute time, so alarms days or months ahead ring exactly on time
+        event = alarm_schedule.enterabs(alarm_fire_time(alarm), 1,
+                                        ring_scheduled_alarm, (key, generation))
+        scheduled_alarms[key] = (generation, event, alarm["title"])
+
+    schedule_prefetch(alarm)
+    scheduler_wakeup.set()
+
+def schedule_prefetch(alarm : dict):
+    """Queues a fetch of an alarm's briefing prefetch_lead_seconds before
+    it rings, replacing any queued before. If that time has passed, the
+    briefing is fetched now, in the background
+
+    Keyword Arguments:
+    alarm -- Alarm to prefetch for
+    """
 
+    if prefetch_lead_seconds <= 0:
+        return
+
+    key = alarm_key(alarm)
+    prefetch_at = alarm_fire_time(alarm) - prefetch_lead_seconds
+
+    try:
+        briefing_request = alarm_briefing_request(alarm)
     except Exception as raised_exception:
-        logging.exception("Error in notification ring : "+str(raised_exception))
+        logging.exception("Error in scheduling prefetch : "+str(raised_exception))
+        return
 
-def refresh_upcoming_alarms():
-    """Refreshes delay for alarms that are upcoming
+    with scheduler_lock:
+        cancel_prefetch(key)
+        if prefetch_at > time.time():
+            event = prefetch_schedule.enterabs(prefetch_at, 1, run_due_prefetches)
+            scheduled_prefetches[key] = (event, briefing_request)
+            return
+
+    prefetch_executor.submit(prefetch_briefings, [briefing_request])
+
+def cancel_prefetch(key : str):
+    """Cancels an alarm's queued prefetch, if it has one.
+    Must be called with scheduler_lock held
+
+    Keyword Arguments:
+    key -- Key of alarm (see alarm_key)
+    """
+
+    entry = scheduled_prefetches.pop(key, None)
+    if entry is not None:
+        try:
+            prefetch_schedule.cancel(entry[0])
+        except ValueError:
+            #already running, and will find nothing left to do
+            pass
+
+def run_due_prefetches():
+    """Starts fetching briefings of every alarm whose prefetch time has
+    come, in one batch so alarms at the same time share fetches
 
     No arguments
     """
 
+    current_time = time.time()
+    with scheduler_lock:
+        due = [key for key, entry in scheduled_prefetches.items()
+               if entry[0].time <= current_time]
+        briefing_requests = [scheduled_prefetches.pop(key)[1] for key in due]
+
+    if briefing_requests:
+        prefetch_executor.submit(prefetch_briefings, briefing_requests)
+
+def prefetch_briefings(briefing_requests : list):
+    """Fetches briefings so their content is cached when their alarms ring
+
+    Keyword Arguments:
+    briefing_requests -- Briefing requests (see alarm_briefing_request)
+    """
+
     try:
-        comp_time = datetime.datetime.now()
-        current_time = time.localtime()
+        fetch_briefings(briefing_requests)
+        with scheduler_lock:
+            scheduler_stats["prefetches"] += len(briefing_requests)
+        logging.info("Prefetched " + str(len(briefing_requests)) + " briefings.")
+    except Exception as raised_exception:
+        logging.exception("Error in prefetching briefings : "+str(raised_exception))
+
+def unschedule_alarm(key : str):
+    """Cancels the queued event of an alarm, if it has one
+
+    Keyword Arguments:
+    key -- Key of alarm to cancel (see alarm_key)
+    """
+
+    with scheduler_lock:
+        cancel_prefetch(key)
+        entry = scheduled_alarms.pop(key, None)
+        if entry is None:
+            return
+
+        try:
+            alarm_schedule.cancel(entry[1])
+        except ValueError:
+            #event has already left the queue and is about to run,
+            #where it will be treated as stale
+            scheduler_stats["stale_events"] += 1
+
+def ring_scheduled_alarm(key : str, generation : int):
+    """Rings a scheduled alarm, along with any others that are due,
+    unless its event has been cancelled or replaced since it was queued
+
+    Keyword Arguments:
+    key -- Key of alarm to ring (see alarm_key)
+    generation -- Generation of the event being run
+    """
+
+    with scheduler_lock:
+        entry = scheduled_alarms.get(key)
+        if entry is None or entry[0] != generation:
+            scheduler_stats["stale_events"] -= 1
+            return
+        scheduled_alarms.pop(key)
+
+        #other alarms due by now (or within ring-wave-seconds) ring in the
+        #same wave, so their briefings share fetches
+        wave_end = time.time() + ring_wave_seconds
+        titles = [entry[2]] + [other[2] for other in due_scheduled_alarms(wave_end)]
+
+    ring_alarms(titles)
+
+def due_scheduled_alarms(until : float) -> list:
+    """Returns scheduled_alarms entries of alarms due by until.
+    A timer wheel only looks at its slots up to until, rather than
+    every alarm. Must be called with scheduler_lock held
 
-        #basically calculates how long until it's time for the alarms to ring
-        #the list is looked through reversed to avoid errors when popping in
-        #alarm_ring
-        for alarm in reversed(upcoming_alarms):
-            alarm_time = string_to_time(alarm["time"])
+    Keyword Arguments:
+    until -- Latest ring time of alarms returned
+    """
+
+    if not isinstance(alarm_schedule, TimerWheel):
+        return [entry for entry in scheduled_alarms.values() if entry[1].time <= until]
 
-            alarm_time_comparison = time_to_datetime(alarm_time)
+    due = []
+    for event in alarm_schedule.events_until(until):
+        if event.action is not ring_scheduled_alarm:
+            continue
+        entry = scheduled_alarms.get(event.argument[0])
+        #superseded events are left to expire
+        if entry is not None and entry[0] == event.argument[1]:
+            due.append(entry)
+    return due
 
-            if comp_time < alarm_time_comparison:
-                #using abs helps with compatibility
-                hour_seconds = abs(alarm_time.tm_hour - current_time.tm_hour) * 3600
-                minute_seconds = abs(alarm_time.tm_min - current_time.tm_min) * 60
-                delay = hour_seconds + minute_seconds
+def scheduler_queue_depth() -> int:
+    """Returns number of alarm events held in alarm_schedule,
+    including superseded ones that have yet to expire
+
+    No arguments
+    """
+
+    with scheduler_lock:
+        return len(scheduled_alarms) + scheduler_stats["stale_events"]
+
+@refresh_seconds.time()
+def refresh_upcoming_alarms():
+    """Queues any upcoming alarms that aren't scheduled yet,
+    and rings those that are overdue
 
-                alarm_schedule.enter(int(delay), 1, alarm_ring, (alarm["title"],))
+    No arguments
+    """
+
+    try:
+        current_time = time.time()
+
+        for alarm in repository.upcoming_alarms():
+            if alarm_key(alarm) in scheduled_alarms:
+                continue
+
+            if current_time < alarm_fire_time(alarm):
+                schedule_alarm(alarm)
             else:
                 alarm_ring(alarm["title"])
 
-        #if it is the daily notif time it's displayed
-        if(current_time.tm_hour == settings["daily-notification-hour"] and
-            current_time.tm_min == settings["daily-notification-min"]):
-            notification_ring(time.localtime())
-
         logging.info("Alarms refreshed.")
 
     except Exception as raised_exception:
         logging.exception("Error in alarm refresh :"+str(raised_exception))
 
+def schedule_daily_notification():
+    """Schedules the next daily COVID-19 notification at the
+    time given in settings
+
+    No arguments
+    """
+
+    now = datetime.datetime.now()
+    next_ring = now.replace(hour = settings["daily-notification-hour"],
+                            minute = settings["daily-notification-min"],
+                            second = 0,
+                            microsecond = 0)
+
+    #today's notification time has passed, so the next one is tomorrow
+    if next_ring <= now:
+        next_ring = next_ring + datetime.timedelta(days = 1)
+
+    alarm_schedule.enterabs(next_ring.timestamp(), 2, daily_notification_ring)
+    logging.debug("Daily notification scheduled for "+str(next_ring))
+
+def daily_notification_ring():
+    """Rings the daily COVID-19 notification and schedules the next one
+
+    No arguments
+    """
+
+    notification_ring(time.localtime())
+    schedule_daily_notification()
+
+def compact_history():
+    """Moves notifications and undismissed alarms beyond the retention
+    limits (see DEFAULT_RETENTION) to the archive file, oldest first, so
+    the config file and the rendered page stay the same size over months
+
+    No arguments
+    """
+
+    try:
+        max_age_days = retention["max-age-days"]
+        oldest = None if max_age_days is None else time.time() - max_age_days * 86400
+
+        def archive(removed : dict):
+            archived_at = time.time()
+            append_archive(retention["archive-path"],
+                           [{"kind" : kind, "archived_at" : archived_at, "item" : item_to_json(item)}
+                            for kind, items in (("notification", removed["notifications"]),
+                                                ("alarm", removed["undismissed_alarms"]))
+                            for item in items])
+
+        removed = repository.compact(retention["max-notifications"],
+                                     retention["max-undismissed-alarms"], oldest, archive)
+
+        for kind, items in (("notification", removed["notifications"]),
+                            ("alarm", removed["undismissed_alarms"])):
+            for item in items:
+                render_cache.forget(kind, item["title"])
+                publish_change(kind, item, "deleted")
+            if items:
+                items_archived.inc(len(items), kind = kind)
+                logging.info("Archived " + str(len(items)) + " " + kind + "s.")
+
+    except Exception as raised_exception:
+        logging.exception("Error in compacting history : "+str(raised_exception))
+
+def schedule_compaction(delay : float):
+    """Schedules compact_history, which schedules itself again every
+    compact-interval seconds
+
+    Keyword Arguments:
+    delay -- Seconds until it runs
+    """
+
+    alarm_schedule.enter(delay, 3, compaction_ring)
+    scheduler_wakeup.set()
+
+def compaction_ring():
+    """Compacts history and schedules the next compaction
+
+    No arguments
+    """
+
+    compact_history()
+    schedule_compaction(retention["compact-interval"])
+
+def become_leader():
+    """Takes over the scheduler if no other process is running it.
+    Alarms left ringing by a previous leader are queued again, along
+    with stored alarms and the daily notification
+
+    No arguments
+    """
+
+    if leader_lock.is_leader or not leader_lock.try_acquire():
+        return
+
+    requeued = repository.requeue_ringing_alarms()
+    if requeued:
+        logging.info(str(requeued)+" interrupted alarms will ring again.")
+
+    refresh_upcoming_alarms()
+    schedule_daily_notification()
+    schedule_compaction(0)
+    logging.info("This process is running the scheduler.")
+
+def check_external_changes(data_version : int) -> int:
+    """Catches up with alarms and notifications changed by other
+    processes. The leader schedules new alarms, and open dashboards
+    are told to reload, as the changes weren't published here.
+    Returns the current data version
+
+    Keyword Arguments:
+    data_version -- Data version when this was last called
+    """
+
+    current_version = repository.data_version()
+    if current_version == data_version:
+        return current_version
+
+    if leader_lock.is_leader:
+        refresh_upcoming_alarms()
+    if event_broadcaster.subscriber_count():
+        event_broadcaster.publish("resync", {}, repository.version)
+
+    return current_version
+
+def run_scheduler():
+    """Runs alarm_schedule events as they become due, if this process
+    is the leader, and keeps up with changes made by other processes.
+    Sleeps until the next event, or until woken by scheduler_wakeup.
+    Runs forever, so should only be called from the scheduler thread
+
+    No arguments
+    """
+
+    data_version = repository.data_version()
+
+    while True:
+        next_delay = None
+
+        try:
+            become_leader()
+            data_version = check_external_changes(data_version)
+            if leader_lock.is_leader:
+                next_delay = alarm_schedule.run(blocking=False)
+                prefetch_delay = prefetch_schedule.run(blocking=False)
+                if next_delay is None or (prefetch_delay is not None and prefetch_delay < next_delay):
+                    next_delay = prefetch_delay
+        except Exception as raised_exception:
+            logging.exception("Error in scheduler : "+str(raised_exception))
+
+        if next_delay is None or next_delay > SCHEDULER_IDLE_SECONDS:
+            next_delay = SCHEDULER_IDLE_SECONDS
+
+        scheduler_wakeup.wait(next_delay)
+        scheduler_wakeup.clear()
+
+def start_scheduler():
+    """Starts the scheduler thread. Does nothing if it is already running
+
+    No arguments
+    """
+
+    global scheduler_thread
+
+    if scheduler_thread is not None and scheduler_thread.is_alive():
+        return
+
+    #queues stored alarms now, rather than when the thread first runs
+    become_leader()
+
+    scheduler_thread = threading.Thread(target = run_scheduler,
+                                        name = "alarm-scheduler",
+                                        daemon = True)
+    scheduler_thread.start()
+    logging.info("Scheduler thread started.")
+
 
 def string_to_time(time_string : str) -> time: #E.G 1231-02-20T21:03
     """Converts string to time object according to time format "%Y-%m-%dT%H:%M"
@@ -561,13 +1337,13 @@ def test_news_api():
     """Tests news api servers
     """
 
-    base_url = 'http://newsapi.org/v2/top-headlines'
+    base_url = NEWS_API_URL
     location = "?country=" + settings["news-country"]
     api_key = "&apiKey="+keys["news"]
 
     final_url = base_url + location + api_key
 
-    response = requests.get(final_url).json()
+    response = upstream_http.get(final_url).json()
 
     assert response["status"] == "ok"
 
@@ -575,13 +1351,13 @@ def test_weather_api():
     """Tests weather api servers
     """
 
-    base_url = "http://api.openweathermap.org/data/2.5/weather"
+    base_url = WEATHER_API_URL
     city = "?q=" + settings["weather-city"]
     api_key = "&appid="+keys["weather"]
 
     final_url = base_url + city + api_key
 
-    response = requests.get(final_url).json()
+    response = upstream_http.get(final_url).json()
 
     assert response["cod"] == 200
 
@@ -603,18 +1379,20 @@ def test_covid_api():
 
     data_filter_current = ["areaName="+settings["covid19-region"],"date="+current_date]
 
+    #imported here, as nothing else uses uk_covid19
+    from uk_covid19 import Cov19API
     response = Cov19API(filters = data_filter_current, structure = data_structure)
 
     assert response.get_json
 
 
 @app.route("/index")
+@request_seconds.time(handler = "index")
 def index():
     """Method that runs whenever site refreshes
 
     No Arguments
     """
-    alarm_schedule.run(blocking=False)
 
     if request.args.get("alarm_item"):
         del_alarm(request.args.get("alarm_item"))
@@ -623,25 +1401,192 @@ def index():
     if request.args.get("alarm"):   #code stil unfinalized
         set_alarm()
 
-    #for nice formatting
-    for notif in notifications:
-        notif["content"] = Markup(notif["content"])
+    #only rendered again when alarms or notifications have changed
+    body, etag = render_cache.render_page(repository,
+                                          title = "COVID-19 Briefing Application",
+                                          image = "icon.png")
 
-    refresh_upcoming_alarms()
+    #browsers revalidate on every refresh, and get a 304 if nothing changed
+    response = Response(body, mimetype = "text/html")
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route("/api/alarms", methods = ["GET"])
+def api_alarms():
+    """Returns upcoming and undismissed alarms as JSON
+
+    No Arguments
+    """
+
+    snapshot = repository.snapshot()
+    return jsonify(upcoming = [item_to_json(alarm) for alarm in snapshot["upcoming_alarms"]],
+                   undismissed = [item_to_json(alarm) for alarm in snapshot["undismissed_alarms"]])
+
+@app.route("/api/alarms", methods = ["POST"])
+def api_create_alarm():
+    """Creates an alarm from a JSON body with "time" (e.g. 2020-12-04T08:00),
+    "label", and optionally "news" and "weather" booleans and
+    "region", "city" and "country" for the briefing
+
+    No Arguments
+    """
+
+    data = request.get_json(silent = True) or {}
+
+    try:
+        time.strptime(data["time"], "%Y-%m-%dT%H:%M")
+        label = str(data["label"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error = "time (YYYY-MM-DDTHH:MM) and label are required"), 400
+
+    alarm = create_alarm(data["time"], label, bool(data.get("news")), bool(data.get("weather")),
+                         data.get("region"), data.get("city"), data.get("country"))
+    if alarm is None:
+        return jsonify(error = "Alarm has already rung and is undismissed"), 409
+    return jsonify(alarm = item_to_json(alarm)), 201
+
+@app.route("/api/alarms/<path:title>", methods = ["DELETE"])
+def api_delete_alarm(title : str):
+    """Dismisses an alarm
+
+    Keyword Arguments:
+    title -- Title of alarm
+    """
+
+    if not del_alarm(title):
+        return jsonify(error = "No such alarm"), 404
+    return jsonify(deleted = title)
+
+@app.route("/api/notifications", methods = ["GET"])
+def api_notifications():
+    """Returns undismissed notifications as JSON
+
+    No Arguments
+    """
+
+    return jsonify(notifications = [item_to_json(notif) for notif in repository.notifications()])
+
+@app.route("/api/notifications/<path:title>", methods = ["DELETE"])
+def api_delete_notification(title : str):
+    """Dismisses a notification
+
+    Keyword Arguments:
+    title -- Title of notification
+    """
+
+    if not del_notif(title):
+        return jsonify(error = "No such notification"), 404
+    return jsonify(deleted = title)
+
+@app.route("/api/events")
+def api_events():
+    """Server-Sent Events stream of alarms and notifications as they
+    are added, rung and dismissed (see events.py)
+
+    No Arguments
+    """
+
+    response = Response(event_broadcaster.stream(event_broadcaster.subscribe()),
+                        mimetype = "text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    #stops proxies such as nginx buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def export_case_rows(series, start : datetime.date, end : datetime.date,
+                     export_format : str):
+    """Yields a region's daily cases and their change from the day before,
+    from start to end, as CSV or NDJSON text, EXPORT_CHUNK_ROWS days at a
+    time. Only one chunk is held in memory, however long the range
+
+    Keyword Arguments:
+    series -- CovidSeries of the region
+    start -- First day
+    end -- Last day
+    export_format -- "csv" or "ndjson"
+    """
+
+    if export_format == "csv":
+        yield "date,cases,change\n"
+
+    rows = []
+    for day, cases, change in series.iter_range(start, end):
+        if export_format == "csv":
+            rows.append(day.isoformat() + "," + str(cases) + "," +
+                        ("" if change is None else str(change)) + "\n")
+        else:
+            rows.append(json.dumps({"region" : series.region, "date" : day.isoformat(),
+                                    "cases" : cases, "change" : change}) + "\n")
+        if len(rows) == EXPORT_CHUNK_ROWS:
+            yield "".join(rows)
+            rows = []
+
+    if rows:
+        yield "".join(rows)
+
+@app.route("/api/covid-cases")
+def api_covid_cases():
+    """Streams a region's daily COVID-19 cases and their change from the
+    day before over a range of days, from its stored series (see covid_data.py).
+    Query arguments: region (defaults to covid19-region in settings),
+    start and end (YYYY-MM-DD, default to the first and last days with
+    figures) and format ("csv", the default, or "ndjson")
+
+    No Arguments
+    """
+
+    region = request.args.get("region") or settings["covid19-region"]
+    export_format = request.args.get("format", "csv")
+
+    try:
+        start = request.args.get("start")
+        start = datetime.date.fromisoformat(start) if start else datetime.date.min
+        end = request.args.get("end")
+        end = datetime.date.fromisoformat(end) if end else None
+    except ValueError:
+        return jsonify(error = "start and end must be dates, YYYY-MM-DD"), 400
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify(error = "format must be csv or ndjson"), 400
+    if end is not None and end < start:
+        return jsonify(error = "end is before start"), 400
+
+    try:
+        #the series is only fetched if it doesn't reach end, at most once per cache-ttl
+        series = covid_series.series(region, end)
+    except UnknownRegionError:
+        return jsonify(error = "No COVID-19 figures for " + region), 404
+    except Exception as raised_exception:
+        series = covid_series.cached(region)
+        if series is None:
+            logging.exception("Error in COVID-19 export : "+str(raised_exception))
+            upstream_errors.inc(source = "covid", reason = "error")
+            return jsonify(error = "COVID-19 figures are unavailable"), 503
+        logging.warning("Exporting stale covid data : "+str(raised_exception))
+        upstream_errors.inc(source = "covid", reason = "stale")
+
+    if end is None:
+        end = series.last_day() or start
+
+    filename = "".join(c if c.isalnum() else "_" for c in region)
+    response = Response(export_case_rows(series, start, end, export_format),
+                        mimetype = EXPORT_MIMETYPES[export_format])
+    response.headers["Content-Disposition"] = ("attachment; filename=" + filename + "_cases." +
+                                               export_format)
+    return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Request timings, cache hits and misses, scheduler queue depth
+    and upstream errors of this process, in the Prometheus text format
+
+    No Arguments
+    """
 
-    #Joining all alarms for final display
-    all_alarms = []
-    all_alarms.extend(undismissed_alarms)
-    all_alarms.extend(upcoming_alarms)
-    for alarm in all_alarms:
-        alarm["content"] = Markup(alarm["content"])
+    return Response(metrics.render(), mimetype = "text/plain; version=0.0.4")
 
-    return render_template("template.html",
-                            title= "COVID-19 Briefing Application",
-                            notifications = notifications,
-                            alarms = all_alarms,
-                            image = "icon.png")
 
 
 if __name__ == '__main__':
+    create_app(start = True)
     app.run()
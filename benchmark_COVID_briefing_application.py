@@ -0,0 +1,419 @@
+"""Benchmarks for the COVID-19 application.
+
+Run with:
+    python benchmark_COVID_briefing_application.py [benchmark ...]
+
+Benchmarks are alarm-creation, index, api, ring, scheduler, import (all by default),
+see --help for their sizes. The app is run against a copy of config.json
+in a temporary folder, so saved alarms and API keys aren't touched, and
+news, weather and COVID-19 requests go to a fake upstream server (see
+fake_upstream.py), so no network is needed and results can be compared
+between runs. Latencies are reported as p50/p99 with throughput.
+
+ECM1400, Programming, CA3
+"""
+
+import os
+import sys
+import json
+import time
+import sched
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from fake_upstream import FakeUpstream
+from fake_upstream import use_fake_upstream
+from fake_upstream import parse_source_values
+from timer_wheel import TimerWheel
+
+PROJECT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_app():
+    """Imports the app from a temporary copy of the project's config file
+    and returns the module
+
+    No arguments
+    """
+
+    temp_folder = tempfile.mkdtemp(prefix="covid-briefing-benchmark-")
+    shutil.copy(os.path.join(PROJECT_FOLDER, "config.json"), temp_folder)
+    os.chdir(temp_folder)
+
+    #nothing is spoken, and alarms are only fetched for when they ring
+    with open("config.json", "r") as f:
+        config_file = json.load(f)
+    config_file["settings"]["tts-engine"] = "null"
+    config_file["settings"]["prefetch-lead-seconds"] = 0
+    with open("config.json", "w") as f:
+        json.dump(config_file, f, indent=4, sort_keys=True)
+    sys.path.insert(0, PROJECT_FOLDER)
+
+    import COVID_briefing_application
+    COVID_briefing_application.create_app()
+    return COVID_briefing_application
+
+
+def clear_alarms(application):
+    """Removes all upcoming alarms and their scheduled events
+
+    Keyword Arguments:
+    application -- App module
+    """
+
+    for alarm in application.repository.upcoming_alarms():
+        application.unschedule_alarm(application.alarm_key(alarm))
+    application.repository.reset()
+
+
+def create_alarms(application, count : int) -> float:
+    """Creates count alarms through set_alarm and returns seconds taken
+
+    Keyword Arguments:
+    application -- App module
+    count -- Number of alarms to create
+    """
+
+    start = time.perf_counter()
+    for i in range(count):
+        url = "/index?alarm=2500-01-01T08:00&two=benchmark"+str(i)
+        with application.app.test_request_context(url):
+            application.set_alarm()
+    return time.perf_counter() - start
+
+
+def benchmark_alarm_creation(application, count : int = 1000):
+    """Compares creating alarms when the whole config file is rewritten
+    on every change (old path) against write-behind saving (new path)
+
+    Keyword Arguments:
+    application -- App module
+    count -- Number of alarms to create
+    """
+
+    repository = application.repository
+    if not isinstance(repository, application.JSONRepository):
+        print("Alarm creation benchmark needs storage-backend json, skipping")
+        return
+    write_behind_save = repository.save
+
+    def write_every_change():
+        repository.sync_to_data()
+        with open("config.json", "w") as f:
+            json.dump(application.config_file, f, indent=4, sort_keys=True)
+
+    #old path
+    clear_alarms(application)
+    repository.save = write_every_change
+    old_seconds = create_alarms(application, count)
+
+    #new path, including the final write
+    clear_alarms(application)
+    repository.save = write_behind_save
+    writes_before = application.config_writer.writes
+    new_seconds = create_alarms(application, count)
+    request_seconds = new_seconds
+    flush_start = time.perf_counter()
+    application.config_writer.flush()
+    new_seconds += time.perf_counter() - flush_start
+    new_writes = application.config_writer.writes - writes_before
+
+    print("Creating", count, "alarms:")
+    print("  rewrite on every change : %8.3f s, %d writes" % (old_seconds, count))
+    print("  write-behind            : %8.3f s in requests, %8.3f s including final write, %d writes"
+          % (request_seconds, new_seconds, new_writes))
+
+    clear_alarms(application)
+
+
+def percentile(samples : list, share : float) -> float:
+    """Returns the nearest-rank percentile of samples
+
+    Keyword Arguments:
+    samples -- Measurements, in any order
+    share -- Percentile as a fraction, e.g. 0.99
+    """
+
+    ordered = sorted(samples)
+    rank = max(int(round(share * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def report(name : str, samples : list, seconds : float):
+    """Prints p50/p99 latency of samples and throughput
+
+    Keyword Arguments:
+    name -- What was measured
+    samples -- Seconds each operation took
+    seconds -- Wall clock seconds all operations took
+    """
+
+    if not samples:
+        print("  %-28s : no samples" % name)
+        return
+    print("  %-28s : p50 %8.2f ms, p99 %8.2f ms, %9.1f ops/s (%d ops)"
+          % (name, percentile(samples, 0.5) * 1000, percentile(samples, 0.99) * 1000,
+             len(samples) / seconds, len(samples)))
+
+
+def run_clients(application, clients : int, operations : list) -> tuple:
+    """Runs operations across several threads, each with its own test
+    client. Returns (latencies, wall clock seconds)
+
+    Keyword Arguments:
+    application -- App module
+    clients -- Number of threads
+    operations -- Functions taking a test client, each run once
+    """
+
+    latencies = []
+    lock = threading.Lock()
+    shares = [operations[i::clients] for i in range(clients)]
+
+    def client_thread(share):
+        client = application.app.test_client()
+        timings = []
+        for operation in share:
+            start = time.perf_counter()
+            operation(client)
+            timings.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(timings)
+
+    threads = [threading.Thread(target = client_thread, args = (share,)) for share in shares]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def benchmark_index(application, requests : int = 2000, clients : int = 8, alarms : int = 200):
+    """Measures /index with alarms shown, for fresh page loads and for
+    browsers revalidating with If-None-Match
+
+    Keyword Arguments:
+    application -- App module
+    requests -- Number of requests of each kind
+    clients -- Number of threads making requests
+    alarms -- Number of upcoming alarms on the page
+    """
+
+    clear_alarms(application)
+    create_alarms(application, alarms)
+    etag = application.app.test_client().get("/index").headers["ETag"]
+
+    print("/index with", alarms, "alarms,", clients, "clients:")
+    latencies, seconds = run_clients(application, clients,
+                                     [lambda client: client.get("/index")] * requests)
+    report("full page", latencies, seconds)
+    latencies, seconds = run_clients(application, clients,
+        [lambda client: client.get("/index", headers = {"If-None-Match" : etag})] * requests)
+    report("revalidated (304)", latencies, seconds)
+
+    clear_alarms(application)
+
+
+def benchmark_api(application, count : int = 1000, clients : int = 8):
+    """Measures creating alarms through POST /api/alarms, then deleting
+    them through DELETE /api/alarms/<title>
+
+    Keyword Arguments:
+    application -- App module
+    count -- Number of alarms
+    clients -- Number of threads making requests
+    """
+
+    clear_alarms(application)
+    titles = []
+    titles_lock = threading.Lock()
+
+    def create(client, i):
+        response = client.post("/api/alarms", json = {"time" : "2500-01-01T08:00",
+                                                      "label" : "api" + str(i),
+                                                      "news" : True, "weather" : True})
+        with titles_lock:
+            titles.append(response.get_json()["alarm"]["title"])
+
+    print("JSON API,", count, "alarms,", clients, "clients:")
+    latencies, seconds = run_clients(application, clients,
+        [lambda client, i = i: create(client, i) for i in range(count)])
+    report("create alarm", latencies, seconds)
+    latencies, seconds = run_clients(application, clients,
+        [lambda client, title = title: client.delete("/api/alarms/" + title) for title in titles])
+    report("delete alarm", latencies, seconds)
+
+    clear_alarms(application)
+
+
+def benchmark_ring(application, server : FakeUpstream, count : int = 500, places : int = 10):
+    """Measures ringing many alarms due at once, with briefings for
+    several regions, cities and countries and empty upstream caches
+
+    Keyword Arguments:
+    application -- App module
+    server -- Fake upstream the app is pointed at
+    count -- Number of alarms ringing
+    places -- Number of distinct regions, cities and countries
+    """
+
+    clear_alarms(application)
+    application.repository.reset()
+    application.upstream_cache.clear()
+    application.covid_series.clear()
+    alarm_time = time.strftime("%Y-%m-%dT%H:%M")
+
+    titles = []
+    for i in range(count):
+        place = str(i % places)
+        alarm = {"title" : "ring" + str(i) + " (ID : " + str(i) + ")", "id" : str(i),
+                 "time" : alarm_time, "fire_at" : time.time() + 3600,
+                 "content" : "Alarm will notify of COVID-19 infection rate, weather and news",
+                 "region" : "Region" + place, "city" : "City" + place, "country" : "c" + place}
+        application.repository.add_alarm(alarm)
+        titles.append(alarm["title"])
+
+    requests_before = len(server.requests)
+    start = time.perf_counter()
+    application.ring_alarms(titles)
+    seconds = time.perf_counter() - start
+
+    print("Ringing", count, "alarms over", places, "places:")
+    print("  %-28s : %8.3f s, %9.1f alarms/s, %d upstream requests"
+          % ("one wave", seconds, count / seconds, len(server.requests) - requests_before))
+
+    application.repository.reset()
+
+
+def benchmark_scheduler(count : int = 100000, cancels : int = 1000, days : int = 30):
+    """Compares sched.scheduler with TimerWheel holding count alarms at
+    whole minutes over days days: queueing them all, cancelling some
+    and firing them all. Doesn't need the app
+
+    Keyword Arguments:
+    count -- Number of alarms queued
+    cancels -- Number of alarms cancelled
+    days -- Days the alarms are spread over
+    """
+
+    randomiser = random.Random(0)
+    start_time = 1600000000 - 1600000000 % 60
+    times = [start_time + 60 * randomiser.randrange(days * 24 * 60) for _ in range(count)]
+    fired = []
+
+    print("Scheduling", count, "alarms over", days, "days:")
+    for name, backend in (("sched", sched.scheduler), ("timer wheel", TimerWheel)):
+        now = [start_time]
+        schedule = backend(lambda: now[0], lambda seconds: None)
+        fired.clear()
+
+        insert_start = time.perf_counter()
+        events = [schedule.enterabs(event_time, 1, fired.append, (i,))
+                  for i, event_time in enumerate(times)]
+        insert_seconds = time.perf_counter() - insert_start
+
+        cancel_start = time.perf_counter()
+        for event in randomiser.sample(events, cancels):
+            schedule.cancel(event)
+        cancel_seconds = time.perf_counter() - cancel_start
+
+        #every alarm is due, so a non-blocking run fires them all
+        now[0] = start_time + days * 24 * 3600
+        fire_start = time.perf_counter()
+        schedule.run(blocking = False)
+        fire_seconds = time.perf_counter() - fire_start
+        assert len(fired) == count - cancels
+
+        print("  %-12s : insert %6.2f us, cancel %8.2f us, fire %6.2f us per alarm"
+              % (name, insert_seconds / count * 1e6, cancel_seconds / cancels * 1e6,
+                 fire_seconds / len(fired) * 1e6))
+
+
+def benchmark_import(repeats : int = 5, top : int = 8):
+    """Measures importing the app in a fresh interpreter with
+    python -X importtime, and lists the slowest modules
+
+    Keyword Arguments:
+    repeats -- Number of imports timed
+    top -- Number of slowest modules listed
+    """
+
+    import subprocess
+
+    environment = dict(os.environ, PYTHONPATH = PROJECT_FOLDER)
+    totals = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                                 "import COVID_briefing_application"],
+                                cwd = tempfile.mkdtemp(prefix="covid-briefing-import-"),
+                                env = environment, capture_output = True, text = True)
+        #self time, cumulative time and name of every module imported
+        modules = []
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                self_us, cumulative_us, name = line[len("import time:"):].split("|")
+                if self_us.strip().isdigit():
+                    modules.append((int(cumulative_us), int(self_us), name.rstrip()))
+        totals.append(next(cumulative for cumulative, _, name in modules
+                           if name.strip() == "COVID_briefing_application"))
+
+    print("Importing the app (" + str(repeats) + " runs):")
+    print("  %-28s : p50 %8.2f ms, max %8.2f ms"
+          % ("import", percentile(totals, 0.5) / 1000, max(totals) / 1000))
+    print("  slowest modules of the last run (cumulative, self):")
+    for cumulative, self_us, name in sorted(modules, reverse = True)[:top]:
+        print("    %8.2f ms %8.2f ms %s" % (cumulative / 1000, self_us / 1000, name))
+
+
+BENCHMARKS = ("alarm-creation", "index", "api", "ring", "scheduler", "import")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmarks for the COVID-19 application")
+    parser.add_argument("benchmarks", nargs = "*", default = list(BENCHMARKS),
+                        help = ", ".join(BENCHMARKS))
+    parser.add_argument("--alarms", type = int, default = 1000,
+                        help = "alarms created by alarm-creation and api")
+    parser.add_argument("--requests", type = int, default = 2000, help = "requests made by index")
+    parser.add_argument("--clients", type = int, default = 8, help = "threads making requests")
+    parser.add_argument("--ring", type = int, default = 500, help = "alarms rung by ring")
+    parser.add_argument("--places", type = int, default = 10,
+                        help = "distinct regions, cities and countries rung by ring")
+    parser.add_argument("--scheduled", type = int, default = 100000,
+                        help = "alarms queued by scheduler")
+    parser.add_argument("--latency", nargs = "*", default = ["covid=0.05", "weather=0.05", "news=0.05"],
+                        metavar = "SOURCE=SECONDS", help = "fake upstream latency")
+    parser.add_argument("--errors", nargs = "*", default = [], metavar = "SOURCE=RATE",
+                        help = "share of fake upstream requests that fail")
+    arguments = parser.parse_args()
+    for name in arguments.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+
+    if "import" in arguments.benchmarks:
+        benchmark_import()
+    if "scheduler" in arguments.benchmarks:
+        benchmark_scheduler(arguments.scheduled)
+    if not set(arguments.benchmarks) - {"import", "scheduler"}:
+        sys.exit()
+
+    app_module = load_app()
+    upstream = FakeUpstream(latency = parse_source_values(arguments.latency),
+                            error_rates = parse_source_values(arguments.errors), seed = 0).start()
+    use_real_upstream = use_fake_upstream(app_module, upstream)
+
+    try:
+        if "alarm-creation" in arguments.benchmarks:
+            benchmark_alarm_creation(app_module, arguments.alarms)
+        if "index" in arguments.benchmarks:
+            benchmark_index(app_module, arguments.requests, arguments.clients)
+        if "api" in arguments.benchmarks:
+            benchmark_api(app_module, arguments.alarms, arguments.clients)
+        if "ring" in arguments.benchmarks:
+            benchmark_ring(app_module, upstream, arguments.ring, arguments.places)
+    finally:
+        use_real_upstream()
+        upstream.stop()
@@ -0,0 +1,165 @@
+"""Circuit breakers for the news, weather and COVID-19 APIs, so a source
+that is down fails straight away instead of every alarm waiting on it.
+
+After failure-threshold failures in a row a breaker opens: calls raise
+CircuitOpenError without reaching the source. Once probe-interval
+seconds have passed, the next call is let through as a trial (the
+breaker is half-open). If it succeeds the breaker closes, otherwise it
+opens for another probe-interval. Errors that say the request itself was
+wrong, e.g. a city the weather API doesn't know, aren't failures of the
+source, so they never open the breaker for other requests.
+
+ECM1400, Programming, CA3
+"""
+
+import time
+import logging
+import threading
+
+
+class CircuitOpenError(Exception):
+    """Raised by CircuitBreaker.call instead of calling a source
+    whose circuit is open
+    """
+
+
+def is_source_failure(raised_exception : Exception) -> bool:
+    """Returns whether an exception means the source is failing, rather
+    than the request being wrong. HTTP 4xx responses, except 429 Too Many
+    Requests, are the request's fault. Anything else, e.g. a 5xx response,
+    a timeout or a refused connection, is the source's
+
+    Keyword Arguments:
+    raised_exception -- Exception raised by a call to the source
+    """
+
+    #requests.HTTPError carries its response. Read without importing requests
+    status = getattr(getattr(raised_exception, "response", None), "status_code", None)
+    if status is None:
+        return True
+    return not (400 <= status < 500 and status != 429)
+
+
+class CircuitBreaker:
+    """Counts failures in a row of calls to one source, and stops
+    calling it once there are too many, until a trial call finds it
+    working again
+    """
+
+    def __init__(self, name : str, failure_threshold : int = 5, probe_interval : float = 30,
+                 is_failure = is_source_failure):
+        """Keyword Arguments:
+        name -- Source the breaker guards, e.g. "news"
+        failure_threshold -- Failures in a row that open the circuit
+        probe_interval -- Seconds the circuit stays open before a trial call
+        is_failure -- Called with an exception raised by a call, returns
+                      whether it counts as a failure of the source
+        """
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.is_failure = is_failure
+
+        self.failures = 0
+        self.is_open = False
+        self.opened_at = None
+        #whether a trial call is running while the circuit is open
+        self.trial_running = False
+        self.lock = threading.Lock()
+        self.stats = {"calls" : 0, "failures" : 0, "rejected" : 0, "opened" : 0, "trials" : 0}
+
+    @property
+    def state(self) -> str:
+        """"closed", "open", or "half-open" while a trial call runs"""
+
+        with self.lock:
+            if not self.is_open:
+                return "closed"
+            return "half-open" if self.trial_running else "open"
+
+    def call(self, function, *args, **kwargs):
+        """Returns function(*args, **kwargs). Raises CircuitOpenError
+        without calling it if the circuit is open, unless it is time for
+        a trial call. Passes on anything function raises
+
+        Keyword Arguments:
+        function -- Function calling the source
+        args -- Positional arguments of function
+        kwargs -- Keyword arguments of function
+        """
+
+        with self.lock:
+            trial = self.is_open
+            if trial:
+                if self.trial_running or time.monotonic() < self.opened_at + self.probe_interval:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(self.name + " is unavailable, not calling it until it recovers")
+                self.trial_running = True
+                self.stats["trials"] += 1
+            self.stats["calls"] += 1
+
+        try:
+            result = function(*args, **kwargs)
+        except Exception as raised_exception:
+            if self.is_failure(raised_exception):
+                self.record_failure(trial)
+            else:
+                #the source answered, so it is working
+                self.record_success(trial)
+            raise
+
+        self.record_success(trial)
+        return result
+
+    def record_success(self, trial : bool):
+        """Forgets past failures, and closes the circuit after a trial call
+
+        Keyword Arguments:
+        trial -- Whether the call was a trial call
+        """
+
+        with self.lock:
+            self.failures = 0
+            if not trial:
+                return
+            self.trial_running = False
+            self.is_open = False
+        logging.info("Circuit for " + self.name + " closed, as it has recovered.")
+
+    def record_failure(self, trial : bool):
+        """Counts a failure, and opens the circuit if there have been
+        failure_threshold in a row, or if a trial call failed
+
+        Keyword Arguments:
+        trial -- Whether the call was a trial call
+        """
+
+        with self.lock:
+            self.failures += 1
+            self.stats["failures"] += 1
+            if trial:
+                #stays open for another probe_interval
+                self.trial_running = False
+                self.opened_at = time.monotonic()
+                return
+            if self.is_open or self.failures < self.failure_threshold:
+                return
+            self.is_open = True
+            self.opened_at = time.monotonic()
+            self.stats["opened"] += 1
+
+        logging.warning("Circuit for " + self.name + " opened after " +
+                        str(self.failure_threshold) + " failures in a row.")
+
+    def reset(self):
+        """Closes the circuit and forgets past failures, e.g. when the
+        source's URL has changed
+
+        No arguments
+        """
+
+        with self.lock:
+            self.is_open = False
+            self.trial_running = False
+            self.failures = 0
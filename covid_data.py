@@ -0,0 +1,403 @@
+"""COVID-19 case figures from the PHE API, kept as a time series per region.
+
+A region's whole series is fetched in one request and stored as compact
+arrays, so any day's figure, and its change from the day before, is
+answered from memory. Series can also be saved to disk, so historical
+figures survive a restart without another request.
+
+ECM1400, Programming, CA3
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import datetime
+import threading
+from array import array
+from collections import OrderedDict
+
+PHE_API_URL = "https://api.coronavirus.data.gov.uk/v1/data"
+
+#most pages fetch_region_series requests for one series, in case the
+#API never signals the last page. A page holds up to 1000 days
+MAX_SERIES_PAGES = 20
+
+DATA_STRUCTURE = {
+    "date" : "date",
+    "newCasesByPublishDate" : "newCasesByPublishDate"
+}
+
+
+class UnknownRegionError(LookupError):
+    """Raised by CovidSeriesStore.series for an area the PHE API has
+    no figures for, e.g. a misspelt name
+    """
+
+
+class CovidSeries:
+    """Daily new case figures for one region. Days are stored as ordinals
+    (see datetime.date.toordinal) in ascending order, alongside their
+    figures, in two arrays of the same length.
+    """
+
+    def __init__(self, region : str, days : array, cases : array, fetched_at : float):
+        """Keyword Arguments:
+        region -- Area name, e.g. Exeter
+        days -- Ordinals of days that have figures, ascending
+        cases -- New cases on each day in days
+        fetched_at -- Epoch time the series was fetched
+        """
+
+        self.region = region
+        self.days = days
+        self.cases = cases
+        self.fetched_at = fetched_at
+
+    @classmethod
+    def from_api_data(cls, region : str, data : list, fetched_at : float = None):
+        """Builds a series from the "data" list of a PHE API response.
+        Days without a figure are left out, and where a day appears more
+        than once the last figure is used
+
+        Keyword Arguments:
+        region -- Area name
+        data -- List of {"date", "newCasesByPublishDate"} dictionaries
+        fetched_at -- Epoch time of the request, defaults to now
+        """
+
+        figures = {}
+        for row in data:
+            if row.get("newCasesByPublishDate") is None:
+                continue
+            day = datetime.date.fromisoformat(row["date"]).toordinal()
+            figures[day] = row["newCasesByPublishDate"]
+
+        ordered_days = sorted(figures)
+        return cls(region,
+                   array("l", ordered_days),
+                   array("l", [figures[day] for day in ordered_days]),
+                   time.time() if fetched_at is None else fetched_at)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def last_day(self) -> datetime.date:
+        """Returns the latest day with a figure, or None if the series is empty
+
+        No arguments
+        """
+
+        if not self.days:
+            return None
+        return datetime.date.fromordinal(self.days[-1])
+
+    def cases_on(self, day : datetime.date) -> int:
+        """Returns new cases on day, or None if there's no figure for it
+
+        Keyword Arguments:
+        day -- Day of figure
+        """
+
+        ordinal = day.toordinal()
+        index = bisect.bisect_left(self.days, ordinal)
+        if index < len(self.days) and self.days[index] == ordinal:
+            return self.cases[index]
+        return None
+
+    def change_on(self, day : datetime.date) -> int:
+        """Returns change in new cases from the day before, or None
+        if either day has no figure
+
+        Keyword Arguments:
+        day -- Day of figure
+        """
+
+        today = self.cases_on(day)
+        yesterday = self.cases_on(day - datetime.timedelta(days = 1))
+        if today is None or yesterday is None:
+            return None
+        return today - yesterday
+
+    def iter_range(self, start : datetime.date, end : datetime.date):
+        """Yields (day, cases, change) for each day with a figure
+        from start to end inclusive. change is None if the day before
+        has no figure
+
+        Keyword Arguments:
+        start -- First day
+        end -- Last day
+        """
+
+        index = bisect.bisect_left(self.days, start.toordinal())
+        end_ordinal = end.toordinal()
+
+        while index < len(self.days) and self.days[index] <= end_ordinal:
+            day = self.days[index]
+            change = None
+            if index > 0 and self.days[index - 1] == day - 1:
+                change = self.cases[index] - self.cases[index - 1]
+            yield datetime.date.fromordinal(day), self.cases[index], change
+            index += 1
+
+    def save(self, path : str):
+        """Saves series to a JSON file
+
+        Keyword Arguments:
+        path -- File to save to
+        """
+
+        data = {"region" : self.region, "fetched_at" : self.fetched_at,
+                "days" : self.days.tolist(), "cases" : self.cases.tolist()}
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path : str):
+        """Loads series saved with save
+
+        Keyword Arguments:
+        path -- File to load from
+        """
+
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["region"], array("l", data["days"]),
+                   array("l", data["cases"]), data["fetched_at"])
+
+
+def fetch_region_series(region : str, client = None) -> CovidSeries:
+    """Fetches a region's whole series from the PHE API in one query.
+    Results are paged, so pages are requested until one is empty
+    (204, or no data), one has no next page, or MAX_SERIES_PAGES are fetched
+
+    Keyword Arguments:
+    region -- Area name
+    client -- Anything with a requests-style get, e.g. http_client.HTTPClient.
+              Defaults to requests
+    """
+
+    if client is None:
+        import requests
+        client = requests
+
+    params = {"filters" : "areaName="+region,
+              "structure" : json.dumps(DATA_STRUCTURE, separators = (",", ":")),
+              "format" : "json",
+              "page" : 1}
+    data = []
+
+    while True:
+        response = client.get(PHE_API_URL, params = dict(params))
+        response.raise_for_status()
+        if response.status_code == 204:
+            break
+        body = response.json()
+        page_data = body.get("data") or []
+        data.extend(page_data)
+
+        pagination = body.get("pagination")
+        if not page_data or (pagination is not None and not pagination.get("next")):
+            break
+        if params["page"] >= MAX_SERIES_PAGES:
+            logging.warning("Stopped fetching COVID-19 series for "+region+" after "+
+                            str(MAX_SERIES_PAGES)+" pages")
+            break
+        params["page"] += 1
+
+    series = CovidSeries.from_api_data(region, data)
+    logging.info("Fetched COVID-19 series for "+region+", "+str(len(series))+" days")
+    return series
+
+
+class CovidSeriesStore:
+    """Series for each region, fetched when first needed. A series is
+    only fetched again when a day later than its last figure is asked
+    for and it is older than refresh_interval, as published figures
+    don't change. Concurrent requests for one region share a fetch.
+    At most max_regions series are held in memory, the least recently
+    used being dropped first. Areas the API has no figures for are
+    neither held nor saved, only remembered for refresh_interval.
+    """
+
+    def __init__(self, fetch_series = fetch_region_series,
+                 refresh_interval : float = 3600, folder : str = None,
+                 max_regions : int = 64):
+        """Keyword Arguments:
+        fetch_series -- Function taking a region and returning its CovidSeries
+        refresh_interval -- Least seconds between fetches of a region
+        folder -- Folder series are saved in, or None to keep them in memory only
+        max_regions -- Most series held in memory, and most unknown areas remembered
+        """
+
+        self.fetch_series = fetch_series
+        self.refresh_interval = refresh_interval
+        self.folder = folder
+        self.max_regions = max_regions
+        self.regions = OrderedDict()
+        #epoch time each area the API has no figures for was last asked about
+        self.unknown_regions = OrderedDict()
+        self.region_locks = {}
+        self.lock = threading.Lock()
+        self.stats = {"fetches" : 0, "lookups" : 0}
+
+    def series_path(self, region : str) -> str:
+        """Returns file a region's series is saved in
+
+        Keyword Arguments:
+        region -- Area name
+        """
+
+        safe_name = "".join(c if c.isalnum() else "_" for c in region)
+        return os.path.join(self.folder, safe_name + ".json")
+
+    def is_fresh(self, series : CovidSeries, needed_day : datetime.date) -> bool:
+        """Returns whether series can answer for needed_day without a fetch
+
+        Keyword Arguments:
+        series -- Series held for a region
+        needed_day -- Day being asked for, or None for any day
+        """
+
+        if series is None:
+            return False
+        last_day = series.last_day()
+        if needed_day is not None and last_day is not None and needed_day <= last_day:
+            return True
+        return time.time() - series.fetched_at < self.refresh_interval
+
+    def hold(self, region : str, series : CovidSeries):
+        """Holds series in memory as the most recently used, dropping the
+        least recently used series beyond max_regions. Must be called
+        with self.lock held
+
+        Keyword Arguments:
+        region -- Area name
+        series -- Series of region
+        """
+
+        self.regions[region] = series
+        self.regions.move_to_end(region)
+        while len(self.regions) > self.max_regions:
+            dropped_region = self.regions.popitem(last = False)[0]
+            self.region_locks.pop(dropped_region, None)
+
+    def is_unknown(self, region : str) -> bool:
+        """Returns whether the API had no figures for region within the
+        last refresh_interval. Must be called with self.lock held
+
+        Keyword Arguments:
+        region -- Area name
+        """
+
+        checked_at = self.unknown_regions.get(region)
+        if checked_at is None:
+            return False
+        if time.time() - checked_at < self.refresh_interval:
+            return True
+        del self.unknown_regions[region]
+        return False
+
+    def series(self, region : str, needed_day : datetime.date = None) -> CovidSeries:
+        """Returns series for region, fetching it if it is missing or
+        doesn't cover needed_day yet. Raises UnknownRegionError if the
+        API has no figures for region
+
+        Keyword Arguments:
+        region -- Area name
+        needed_day -- Day the caller wants a figure for
+        """
+
+        with self.lock:
+            self.stats["lookups"] += 1
+            if self.is_unknown(region):
+                raise UnknownRegionError("No COVID-19 figures for "+region)
+            series = self.regions.get(region)
+            if self.is_fresh(series, needed_day):
+                self.regions.move_to_end(region)
+                return series
+            region_lock = self.region_locks.setdefault(region, threading.Lock())
+
+        with region_lock:
+            #another thread may have fetched while this one waited
+            with self.lock:
+                if self.is_unknown(region):
+                    raise UnknownRegionError("No COVID-19 figures for "+region)
+                series = self.regions.get(region)
+            if self.is_fresh(series, needed_day):
+                return series
+
+            if series is None and self.folder and os.path.exists(self.series_path(region)):
+                try:
+                    series = CovidSeries.load(self.series_path(region))
+                except (OSError, ValueError, KeyError) as raised_exception:
+                    #e.g. a file cut short by a crash. It is replaced by the fetch below
+                    logging.exception("Error loading COVID-19 series : "+str(raised_exception))
+                else:
+                    #an empty series has nothing to answer from, so it is fetched again
+                    if len(series):
+                        with self.lock:
+                            self.hold(region, series)
+                        if self.is_fresh(series, needed_day):
+                            return series
+
+            series = self.fetch_series(region)
+
+            if not len(series):
+                #nothing to answer from, so the region isn't kept in memory or on disk
+                with self.lock:
+                    self.stats["fetches"] += 1
+                    self.regions.pop(region, None)
+                    self.region_locks.pop(region, None)
+                    self.unknown_regions[region] = time.time()
+                    self.unknown_regions.move_to_end(region)
+                    while len(self.unknown_regions) > self.max_regions:
+                        self.unknown_regions.popitem(last = False)
+                raise UnknownRegionError("No COVID-19 figures for "+region)
+
+            with self.lock:
+                self.hold(region, series)
+                self.stats["fetches"] += 1
+
+            if self.folder:
+                try:
+                    os.makedirs(self.folder, exist_ok = True)
+                    series.save(self.series_path(region))
+                except OSError as raised_exception:
+                    logging.exception("Error saving COVID-19 series : "+str(raised_exception))
+
+            return series
+
+    def cached(self, region : str) -> CovidSeries:
+        """Returns the series held for region, however old, without
+        fetching it, or None if there isn't one
+
+        Keyword Arguments:
+        region -- Area name
+        """
+
+        with self.lock:
+            series = self.regions.get(region)
+        if series is None and self.folder and os.path.exists(self.series_path(region)):
+            try:
+                series = CovidSeries.load(self.series_path(region))
+            except (OSError, ValueError, KeyError) as raised_exception:
+                logging.exception("Error loading COVID-19 series : "+str(raised_exception))
+        return series
+
+    def clear(self):
+        """Forgets all series held in memory
+
+        No arguments
+        """
+
+        with self.lock:
+            self.regions.clear()
+            self.unknown_regions.clear()
+            self.region_locks.clear()
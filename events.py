@@ -0,0 +1,153 @@
+"""Server-Sent Events for open dashboards.
+
+Alarms and notifications that are added, rung or dismissed are published
+to every connected browser as they happen, so pages update themselves
+instead of reloading every minute.
+
+ECM1400, Programming, CA3
+"""
+
+import json
+import queue
+import logging
+import threading
+
+#seconds between keep-alive comments, so proxies don't close idle streams
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    """Events waiting to be sent to one connected browser.
+    """
+
+    def __init__(self, max_pending : int):
+        """Keyword Arguments:
+        max_pending -- Most events waiting before the browser is told to resync
+        """
+
+        self.events = queue.Queue(max_pending)
+
+
+class EventBroadcaster:
+    """Publishes events to every subscribed browser. A browser too slow to
+    keep up has its waiting events replaced by one "resync" event, which
+    makes it reload the page, so publishing never blocks.
+    """
+
+    def __init__(self, max_pending : int = 100):
+        """Keyword Arguments:
+        max_pending -- Most events waiting for each browser
+        """
+
+        self.max_pending = max_pending
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.stats = {"published" : 0, "resyncs" : 0}
+
+    def subscribe(self) -> Subscription:
+        """Returns a new subscription that receives every event published after it
+
+        No arguments
+        """
+
+        subscription = Subscription(self.max_pending)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription : Subscription):
+        """Stops sending events to subscription
+
+        Keyword Arguments:
+        subscription -- Subscription returned by subscribe
+        """
+
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def subscriber_count(self) -> int:
+        """Returns number of connected browsers
+
+        No arguments
+        """
+
+        with self.lock:
+            return len(self.subscriptions)
+
+    def publish(self, event : str, data : dict, event_id = None):
+        """Sends an event to every subscription
+
+        Keyword Arguments:
+        event -- Event name, e.g. "alarm"
+        data -- JSON serializable event data
+        event_id -- ID browsers send back as Last-Event-ID when reconnecting
+        """
+
+        message = format_event(event, data, event_id)
+
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+            self.stats["published"] += 1
+
+        for subscription in subscriptions:
+            try:
+                subscription.events.put_nowait(message)
+            except queue.Full:
+                self.resync(subscription)
+
+    def resync(self, subscription : Subscription):
+        """Replaces a lagging subscription's waiting events with a "resync" event
+
+        Keyword Arguments:
+        subscription -- Subscription that is full
+        """
+
+        try:
+            while True:
+                subscription.events.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            subscription.events.put_nowait(format_event("resync", {}))
+        except queue.Full:
+            #filled again meanwhile, and whichever publish filled it resyncs it
+            pass
+        with self.lock:
+            self.stats["resyncs"] += 1
+        logging.warning("Event stream fell behind, browser told to resync")
+
+    def stream(self, subscription : Subscription, keepalive : float = KEEPALIVE_SECONDS):
+        """Generator of text/event-stream chunks for subscription. The
+        subscription is removed when the browser disconnects
+
+        Keyword Arguments:
+        subscription -- Subscription returned by subscribe
+        keepalive -- Seconds between keep-alive comments
+        """
+
+        try:
+            #tells the browser how long to wait before reconnecting
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield subscription.events.get(timeout = keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+
+def format_event(event : str, data : dict, event_id = None) -> str:
+    """Returns an event in text/event-stream format
+
+    Keyword Arguments:
+    event -- Event name
+    data -- JSON serializable event data
+    event_id -- Optional event ID
+    """
+
+    message = "event: " + event + "\n"
+    if event_id is not None:
+        message += "id: " + str(event_id) + "\n"
+    return message + "data: " + json.dumps(data) + "\n\n"
@@ -0,0 +1,293 @@
+"""Fake newsapi, openweathermap and PHE API server, for running the app
+and its tests and benchmarks offline.
+
+Each source can be given a latency and an error rate, so slow or
+failing upstreams can be reproduced on demand. Run on its own with:
+    python fake_upstream.py --port 8001 --latency weather=0.2 --errors news=0.1
+
+ECM1400, Programming, CA3
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+from urllib.parse import parse_qs
+
+SOURCES = ("news", "weather", "covid")
+
+
+def covid_days(today : datetime.date = None, days : int = 29) -> list:
+    """Returns PHE API "data" entries for the days before today.
+    There were 25 cases yesterday, 36 the day before, and so on
+
+    Keyword Arguments:
+    today -- Day the figures lead up to, defaults to today
+    days -- Number of days with figures
+    """
+
+    today = today or datetime.date.today()
+    return [{"date" : (today - datetime.timedelta(days = i)).isoformat(),
+             "newCasesByPublishDate" : 14 + 11 * i} for i in range(1, days + 1)]
+
+
+def source_body(source : str, query : dict) -> dict:
+    """Returns the response body a source answers with
+
+    Keyword Arguments:
+    source -- "news", "weather" or "covid"
+    query -- Parsed query string of the request
+    """
+
+    if source == "news":
+        return {"status" : "ok", "articles" : [{"title" : "headline"}] * 3}
+    if source == "weather":
+        #Exeter unless another city is asked for
+        city = query.get("q", ["Exeter"])[0].split(",")[0]
+        return {"cod" : 200, "name" : city,
+                "weather" : [{"description" : "clear sky"}], "main" : {"temp" : 283.15}}
+    return {"data" : covid_days()}
+
+
+def request_place(source : str, query : dict) -> str:
+    """Returns the city, country or area a request is for, or None
+
+    Keyword Arguments:
+    source -- "news", "weather" or "covid"
+    query -- Parsed query string of the request
+    """
+
+    if source == "weather":
+        return query.get("q", [""])[0].split(",")[0]
+    if source == "news":
+        return query.get("country", [None])[0]
+    for query_filter in query.get("filters", [""])[0].split(";"):
+        if query_filter.startswith("areaName="):
+            return query_filter[len("areaName="):]
+    return None
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """Answers like newsapi (/news), openweathermap (/weather) and the
+    PHE API (/covid), after the latency set for each source, failing
+    the share of requests set in its error rate
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        source = url.path.strip("/")
+        query = parse_qs(url.query)
+        server = self.server
+        server.record(self.path)
+
+        if source not in SOURCES:
+            self.send_body(404, {"message" : "unknown source"})
+            return
+
+        #as the real APIs answer for places they don't know
+        if request_place(source, query) in server.unknown_places:
+            if source == "covid":
+                self.send_body(204, None)
+            else:
+                self.send_body(404, {"cod" : "404", "message" : "city not found"})
+            return
+
+        #PHE results are paged, an empty page ends them
+        if source == "covid" and query.get("page", ["1"]) != ["1"]:
+            self.send_body(204, None)
+            return
+
+        time.sleep(server.latency_for(source))
+
+        if server.should_fail(source):
+            self.send_body(server.error_status, {"message" : "injected error"})
+            return
+
+        self.send_body(200, source_body(source, query))
+
+    def send_body(self, status : int, body):
+        """Sends a JSON response, or an empty one if body is None
+
+        Keyword Arguments:
+        status -- HTTP status code
+        body -- Object to send as JSON
+        """
+
+        payload = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Last-Modified", "Tue, 10 Nov 2020 15:00:00 GMT")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    """Fake upstream server on 127.0.0.1, served from a background thread.
+    Every path requested is kept in requests
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency : dict = None, error_rates : dict = None,
+                 jitter : float = 0, error_status : int = 500, port : int = 0,
+                 seed : int = None, unknown_places : set = ()):
+        """Keyword Arguments:
+        latency -- Seconds each source waits before answering, e.g. {"news" : 0.2}
+        error_rates -- Share of requests to each source that fail, from 0 to 1
+        jitter -- Up to this many seconds are added to each latency at random
+        error_status -- HTTP status of failed requests
+        port -- Port to listen on, 0 picks a free one
+        seed -- Seed for jitter and errors, so runs can be repeated
+        unknown_places -- Cities, countries and areas answered with 404
+                          (or 204 for the PHE API), as the real APIs do
+        """
+
+        super().__init__(("127.0.0.1", port), FakeUpstreamHandler)
+        self.latency = dict(latency or {})
+        self.error_rates = dict(error_rates or {})
+        self.jitter = jitter
+        self.error_status = error_status
+        self.unknown_places = set(unknown_places)
+        self.random = random.Random(seed)
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return "http://127.0.0.1:" + str(self.server_port)
+
+    def record(self, path : str):
+        with self.lock:
+            self.requests.append(path)
+
+    def latency_for(self, source : str) -> float:
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        return self.latency.get(source, 0) + extra
+
+    def should_fail(self, source : str) -> bool:
+        rate = self.error_rates.get(source, 0)
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def paths(self) -> list:
+        """Returns paths requested so far, without query strings
+
+        No arguments
+        """
+
+        with self.lock:
+            return [path.split("?")[0] for path in self.requests]
+
+    def start(self):
+        """Starts serving in a background thread. Returns the server
+
+        No arguments
+        """
+
+        self.thread = threading.Thread(target = self.serve_forever,
+                                       name = "fake-upstream", daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket
+
+        No arguments
+        """
+
+        self.shutdown()
+        self.server_close()
+
+
+def use_fake_upstream(application, server : FakeUpstream):
+    """Points the app's news, weather and COVID-19 requests at server,
+    with empty caches and closed circuits. Returns a function that
+    points them back
+
+    Keyword Arguments:
+    application -- COVID_briefing_application module
+    server -- Running FakeUpstream
+    """
+
+    import covid_data
+
+    originals = (application.NEWS_API_URL, application.WEATHER_API_URL,
+                 covid_data.PHE_API_URL, application.covid_series.folder)
+
+    application.upstream_cache.clear()
+    application.covid_series.clear()
+    for breaker in application.circuit_breakers.values():
+        breaker.reset()
+    #series saved by a real run would be used instead of the fake's figures
+    application.covid_series.folder = None
+    application.NEWS_API_URL = server.base_url + "/news"
+    application.WEATHER_API_URL = server.base_url + "/weather"
+    covid_data.PHE_API_URL = server.base_url + "/covid"
+
+    def restore():
+        (application.NEWS_API_URL, application.WEATHER_API_URL,
+         covid_data.PHE_API_URL, application.covid_series.folder) = originals
+        application.upstream_cache.clear()
+        application.covid_series.clear()
+        for breaker in application.circuit_breakers.values():
+            breaker.reset()
+
+    return restore
+
+
+def parse_source_values(pairs : list) -> dict:
+    """Turns ["news=0.2", "weather=1"] into {"news" : 0.2, "weather" : 1.0}
+
+    Keyword Arguments:
+    pairs -- source=value strings
+    """
+
+    values = {}
+    for pair in pairs or []:
+        source, value = pair.split("=", 1)
+        if source not in SOURCES:
+            raise ValueError("Unknown source " + source)
+        values[source] = float(value)
+    return values
+
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--port", type = int, default = 8001)
+    parser.add_argument("--latency", nargs = "*", default = [], metavar = "SOURCE=SECONDS")
+    parser.add_argument("--errors", nargs = "*", default = [], metavar = "SOURCE=RATE")
+    parser.add_argument("--jitter", type = float, default = 0)
+    parser.add_argument("--error-status", type = int, default = 500)
+    arguments = parser.parse_args(argv)
+
+    server = FakeUpstream(latency = parse_source_values(arguments.latency),
+                          error_rates = parse_source_values(arguments.errors),
+                          jitter = arguments.jitter, error_status = arguments.error_status,
+                          port = arguments.port)
+    print("Serving", ", ".join("/" + source for source in SOURCES), "on", server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+"""Shared HTTP client for requests to the news, weather and PHE APIs.
+
+Connections are pooled and kept alive between requests, every request
+has connect and read timeouts, and failed requests are retried a few
+times with exponential backoff. Latency and errors are counted per host.
+
+ECM1400, Programming, CA3
+"""
+
+import time
+import threading
+from urllib.parse import urlparse
+
+#statuses worth retrying, as they're usually temporary
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HTTPClient:
+    """requests.Session wrapper used for all upstream API calls.
+    requests is imported, and the session made, by the first request,
+    so creating a client is cheap
+    """
+
+    def __init__(self, connect_timeout : float = 3.05, read_timeout : float = 10,
+                 retries : int = 2, backoff : float = 0.5, pool_size : int = 10):
+        """Keyword Arguments:
+        connect_timeout -- Seconds allowed to connect to a host
+        read_timeout -- Seconds allowed between bytes of a response
+        retries -- Times a failed request is retried
+        backoff -- Backoff factor, retries wait backoff, 2*backoff, 4*backoff... seconds
+        pool_size -- Connections kept open to each host
+        """
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.session_instance = None
+
+        self.lock = threading.Lock()
+        self.host_stats = {}
+
+    @property
+    def session(self):
+        """requests.Session with pooled, retrying connections, made on first use"""
+
+        with self.lock:
+            if self.session_instance is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(total = self.retries,
+                              connect = self.retries,
+                              read = self.retries,
+                              status = self.retries,
+                              backoff_factor = self.backoff,
+                              status_forcelist = RETRY_STATUSES,
+                              allowed_methods = frozenset(["GET", "HEAD"]),
+                              raise_on_status = False)
+                adapter = HTTPAdapter(pool_connections = self.pool_size,
+                                      pool_maxsize = self.pool_size,
+                                      max_retries = retry)
+
+                self.session_instance = requests.Session()
+                self.session_instance.mount("http://", adapter)
+                self.session_instance.mount("https://", adapter)
+            return self.session_instance
+
+    def record(self, host : str, seconds : float, failed : bool):
+        """Adds a request to its host's counters
+
+        Keyword Arguments:
+        host -- Host requested
+        seconds -- Time taken, including retries
+        failed -- Whether the request raised or got an error status
+        """
+
+        with self.lock:
+            stats = self.host_stats.setdefault(host, {"requests" : 0, "errors" : 0,
+                                                      "total_seconds" : 0.0, "max_seconds" : 0.0})
+            stats["requests"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if failed:
+                stats["errors"] += 1
+
+    def get(self, url : str, params : dict = None, timeout = None) -> "requests.Response":
+        """Sends a GET request and returns the response. Raises
+        requests.RequestException if it can't be completed
+
+        Keyword Arguments:
+        url -- URL to be requested
+        params -- Query string parameters
+        timeout -- (connect, read) seconds, defaults to the client's timeouts
+        """
+
+        host = urlparse(url).netloc
+        start = time.perf_counter()
+        failed = True
+
+        try:
+            response = self.session.get(url, params = params,
+                                        timeout = timeout or self.timeout)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self.record(host, time.perf_counter() - start, failed)
+
+    def stats(self) -> dict:
+        """Returns a copy of the per-host counters, with average latency
+
+        No arguments
+        """
+
+        with self.lock:
+            result = {}
+            for host, stats in self.host_stats.items():
+                result[host] = dict(stats)
+                result[host]["average_seconds"] = stats["total_seconds"] / stats["requests"]
+            return result
+
+    def close(self):
+        """Closes pooled connections
+
+        No arguments
+        """
+
+        with self.lock:
+            if self.session_instance is not None:
+                self.session_instance.close()
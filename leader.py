@@ -0,0 +1,114 @@
+"""Leader election between processes serving the app.
+
+When the app runs under a WSGI server with several worker processes,
+only the process holding an exclusive lock on a shared file runs the
+alarm scheduler, so every alarm rings once. The operating system drops
+the lock when its process exits, and another process takes over.
+Storage that isn't shared between processes has nothing to elect a
+leader over, so SoleLeader always leads.
+
+ECM1400, Programming, CA3
+"""
+
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    #Windows
+    fcntl = None
+    import msvcrt
+
+
+class LeaderLock:
+    """Exclusive, non-blocking lock on a file, held until released
+    or the process exits.
+    """
+
+    def __init__(self, path : str):
+        """Keyword Arguments:
+        path -- Lock file, shared by every process of the app
+        """
+
+        self.path = path
+        self.file = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.file is not None
+
+    def try_acquire(self) -> bool:
+        """Takes the lock if no other process holds it.
+        Returns whether this process holds it
+
+        No arguments
+        """
+
+        if self.file is not None:
+            return True
+
+        lock_file = open(self.path, "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+
+        #for anyone wondering which process is running the scheduler
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+
+        self.file = lock_file
+        logging.info("Process "+str(os.getpid())+" holds "+self.path)
+        return True
+
+    def release(self):
+        """Gives up the lock, if held
+
+        No arguments
+        """
+
+        if self.file is None:
+            return
+
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+
+class SoleLeader:
+    """Leader of a process whose alarms aren't shared with any other,
+    e.g. when they are kept in config.json. It leads once asked to,
+    without a lock file, so the scheduler always runs
+    """
+
+    def __init__(self):
+        self.is_leader = False
+
+    def try_acquire(self) -> bool:
+        """Becomes leader. Returns True
+
+        No arguments
+        """
+
+        self.is_leader = True
+        return True
+
+    def release(self):
+        """Stops leading
+
+        No arguments
+        """
+
+        self.is_leader = False
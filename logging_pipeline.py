@@ -0,0 +1,172 @@
+"""Logging that never makes a request wait on the disk.
+
+Records are put on a bounded queue by the thread logging them and
+written to a size-rotated log file by a background listener thread.
+Frequent messages, such as "Alarms refreshed.", are sampled, and if the
+disk falls behind and the queue fills up, low priority records are
+dropped (and counted) instead of using more memory or blocking.
+
+ECM1400, Programming, CA3
+"""
+
+import json
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+
+FORMAT = "%(levelname)s: %(asctime)s %(message)s"
+
+#messages logged on every refresh, fetch or ring, sampled by default
+DEFAULT_SAMPLED_MESSAGES = ("Alarms refreshed.", "Fetched day news", "Fetched day weather",
+                            "Fetched COVID-19 data")
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record : logging.LogRecord) -> str:
+        entry = {"time" : self.formatTime(record), "level" : record.levelname,
+                 "logger" : record.name, "thread" : record.threadName,
+                 "message" : record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through the first record starting with each sampled message,
+    then at most one every interval seconds. The next one let through
+    says how many were left out. Warnings and errors are never sampled
+    """
+
+    def __init__(self, messages : tuple = DEFAULT_SAMPLED_MESSAGES, interval : float = 60):
+        """Keyword Arguments:
+        messages -- Starts of messages to sample
+        interval -- Seconds between records let through for each message
+        """
+
+        super().__init__()
+        self.messages = tuple(messages)
+        self.interval = interval
+        #message -> [time last let through, records left out since]
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record : logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.interval <= 0:
+            return True
+
+        message = str(record.msg)
+        sampled = next((start for start in self.messages if message.startswith(start)), None)
+        if sampled is None:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(sampled)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+            skipped = entry[1] if entry is not None else 0
+            self.seen[sampled] = [now, 0]
+
+        if skipped:
+            record.msg = message + " (" + str(skipped) + " similar messages not logged)"
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks. When the queue is full, records
+    are dropped and counted, and a warning with the count is queued
+    once there is room again
+    """
+
+    def __init__(self, log_queue : queue.Queue):
+        """Keyword Arguments:
+        log_queue -- Bounded queue the listener reads from
+        """
+
+        super().__init__(log_queue)
+        self.dropped = 0
+        #self.lock is the handler's own lock, held by handle() around enqueue
+        self.dropped_lock = threading.Lock()
+
+    def prepare(self, record : logging.LogRecord) -> logging.LogRecord:
+        """Merges arguments into the message and formats any traceback
+        now, as the record is written later from another thread
+
+        Keyword Arguments:
+        record -- Record being logged
+        """
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        prepared = logging.makeLogRecord(record.__dict__)
+        prepared.msg = record.getMessage()
+        prepared.args = None
+        prepared.exc_info = None
+        return prepared
+
+    def enqueue(self, record : logging.LogRecord):
+        with self.dropped_lock:
+            dropped = self.dropped
+        if dropped:
+            notice = logging.makeLogRecord({
+                "name" : "logging_pipeline", "levelno" : logging.WARNING,
+                "levelname" : "WARNING", "created" : record.created, "msecs" : record.msecs,
+                "msg" : str(dropped) + " log records dropped while the log file was behind"})
+            try:
+                self.queue.put_nowait(notice)
+                with self.dropped_lock:
+                    self.dropped -= dropped
+            except queue.Full:
+                pass
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+
+def start_logging(log_settings : dict, level : int = logging.INFO,
+                  logger : logging.Logger = None) -> logging.handlers.QueueListener:
+    """Sends records logged to logger (the root logger by default) through
+    a bounded queue to a rotating log file, written by a background thread.
+    Returns the started listener, whose stop() writes out queued records
+
+    Keyword Arguments:
+    log_settings -- "logging" section of settings, see README
+    level -- Lowest level logged
+    logger -- Logger to attach to
+    """
+
+    logger = logger or logging.getLogger()
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_settings.get("file", "program_log.log"),
+        maxBytes = log_settings.get("max-bytes", 5 * 1024 * 1024),
+        backupCount = log_settings.get("backup-count", 3),
+        encoding = "utf-8")
+    if log_settings.get("json", False):
+        file_handler.setFormatter(JSONFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(FORMAT))
+
+    log_queue = queue.Queue(maxsize = log_settings.get("queue-size", 10000))
+    queue_handler = BoundedQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(log_settings.get("sampled-messages",
+                                                            DEFAULT_SAMPLED_MESSAGES),
+                                           log_settings.get("sample-interval", 60)))
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler,
+                                              respect_handler_level = True)
+    listener.start()
+
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    return listener
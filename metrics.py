@@ -0,0 +1,272 @@
+"""Counters and latency histograms for the COVID-19 application,
+served in the Prometheus text format from /metrics.
+
+Metrics are kept in memory, per process, and cost a lock and a few
+additions to update, so they can be left on in the hot paths.
+
+ECM1400, Programming, CA3
+"""
+
+import time
+import bisect
+import functools
+import threading
+
+#seconds, from a cached page to a slow upstream
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape_label_value(value) -> str:
+    """Escapes a label value for the text format
+
+    Keyword Arguments:
+    value -- Label value
+    """
+
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels : dict) -> str:
+    """Returns labels as {name="value",...}, or "" if there are none
+
+    Keyword Arguments:
+    labels -- Label names and values
+    """
+
+    if not labels:
+        return ""
+    return "{" + ",".join(name + "=\"" + escape_label_value(value) + "\""
+                          for name, value in labels.items()) + "}"
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base of all metrics: a name, help text, and label names that
+    each sample must give values for
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name : str, help_text : str, labelnames : tuple = ()):
+        """Keyword Arguments:
+        name -- Metric name, e.g. briefing_alarms_rung_total
+        help_text -- One line description
+        labelnames -- Names of labels that samples are split by
+        """
+
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def label_key(self, labels : dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(self.name + " needs labels " + str(self.labelnames))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list:
+        """Returns (name suffix, labels, value) for each sample
+
+        No arguments
+        """
+
+        return []
+
+    def render(self) -> str:
+        lines = ["# HELP " + self.name + " " + self.help_text,
+                 "# TYPE " + self.name + " " + self.type_name]
+        for suffix, labels, value in self.samples():
+            lines.append(self.name + suffix + format_labels(labels) + " " + format_value(value))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Value that only goes up, e.g. number of upstream errors"""
+
+    type_name = "counter"
+
+    def __init__(self, name : str, help_text : str, labelnames : tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+
+    def inc(self, amount : float = 1, **labels):
+        """Adds amount to the counter
+
+        Keyword Arguments:
+        amount -- Amount to add
+        labels -- Values of the counter's labels
+        """
+
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self.label_key(labels), 0)
+
+    def samples(self) -> list:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [("", dict(zip(self.labelnames, key)), value) for key, value in values]
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. seconds a request took,
+    counted into cumulative buckets
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name : str, help_text : str, labelnames : tuple = (),
+                 buckets : tuple = DEFAULT_BUCKETS):
+        """Keyword Arguments:
+        name -- Metric name, e.g. briefing_request_seconds
+        help_text -- One line description
+        labelnames -- Names of labels that samples are split by
+        buckets -- Upper bounds of buckets, ascending
+        """
+
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        #label key -> [bucket counts..., sum, count]
+        self.series = {}
+
+    def observe(self, value : float, **labels):
+        """Records one value
+
+        Keyword Arguments:
+        value -- Observed value
+        labels -- Values of the histogram's labels
+        """
+
+        key = self.label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        with self.lock:
+            series = self.series.get(self.label_key(labels))
+            return 0 if series is None else series[-1]
+
+    def time(self, **labels):
+        """Decorator recording the seconds each call of a function takes,
+        including calls that raise
+
+        Keyword Arguments:
+        labels -- Values of the histogram's labels
+        """
+
+        self.label_key(labels)
+
+        def decorator(function):
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, **labels)
+            return timed
+        return decorator
+
+    def samples(self) -> list:
+        with self.lock:
+            series = sorted((key, list(values)) for key, values in self.series.items())
+
+        samples = []
+        for key, values in series:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),),
+                                           values[:-2] + [values[-1] - sum(values[:-2])]):
+                cumulative += bucket_count
+                samples.append(("_bucket", dict(labels, le = format_value(bound)), cumulative))
+            samples.append(("_sum", labels, values[-2]))
+            samples.append(("_count", labels, values[-1]))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """Metric read from elsewhere when rendered, e.g. a queue's depth or
+    a cache's hit count. The callback returns a number, or a dictionary
+    of {label values tuple : number}
+    """
+
+    def __init__(self, name : str, help_text : str, callback, type_name : str = "gauge",
+                 labelnames : tuple = ()):
+        """Keyword Arguments:
+        name -- Metric name
+        help_text -- One line description
+        callback -- Function taking no arguments returning the value(s)
+        type_name -- "gauge", or "counter" for values that only go up
+        labelnames -- Names of labels, if the callback returns a dictionary
+        """
+
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+        self.type_name = type_name
+
+    def samples(self) -> list:
+        values = self.callback()
+        if not isinstance(values, dict):
+            return [("", {}, values)]
+        return [("", dict(zip(self.labelnames, key if isinstance(key, tuple) else (key,))), value)
+                for key, value in sorted(values.items())]
+
+
+class MetricsRegistry:
+    """Metrics served together from one endpoint"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric : Metric) -> Metric:
+        """Adds a metric, and returns it
+
+        Keyword Arguments:
+        metric -- Metric to be added
+        """
+
+        with self.lock:
+            if any(existing.name == metric.name for existing in self.metrics):
+                raise ValueError("Metric " + metric.name + " is already registered")
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name : str, help_text : str, labelnames : tuple = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name : str, help_text : str, labelnames : tuple = (),
+                  buckets : tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name : str, help_text : str, callback, type_name : str = "gauge",
+                 labelnames : tuple = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help_text, callback, type_name, labelnames))
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text format
+
+        No arguments
+        """
+
+        with self.lock:
+            metrics = list(self.metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
@@ -0,0 +1,196 @@
+"""Write-behind persistence for the COVID-19 application's config file.
+Changes are marked as dirty and written out together by a background
+thread, so requests don't wait on the disk. Old notifications and alarms
+are moved out of it into an append-only archive.
+
+ECM1400, Programming, CA3
+"""
+
+import os
+import time
+import json
+import logging
+import tempfile
+import threading
+
+
+def atomic_write_json(path : str, data : dict):
+    """Writes data to path as JSON. The file is written to a temporary
+    file first and then renamed over path, so a crash mid-write leaves
+    the old file intact
+
+    Keyword Arguments:
+    path -- File to write to
+    data -- JSON-serializable data to be written
+    """
+
+    serialized = json.dumps(data, indent=4, sort_keys=True)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    file_descriptor, temp_path = tempfile.mkstemp(dir = directory,
+                                                  prefix = "." + os.path.basename(path) + ".",
+                                                  suffix = ".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w") as f:
+            f.write(serialized)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def append_archive(path : str, records : list):
+    """Appends records to path as JSON, one per line. The file is only
+    ever appended to, and is synced before returning, so records
+    removed from the config file afterwards are never lost
+
+    Keyword Arguments:
+    path -- Archive file
+    records -- Records to be written. Values JSON can't hold are
+               written as strings
+    """
+
+    lines = "".join(json.dumps(record, sort_keys=True, default=str) + "\n" for record in records)
+    with open(path, "a") as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ConfigWriter:
+    """Batches writes of a JSON document to disk.
+
+    mark_dirty() is cheap and can be called from any thread. The first
+    call starts a writer thread, which waits interval seconds for more
+    changes and then writes the document once with atomic_write_json.
+    An interval of 0 writes straight away, in the calling thread.
+    """
+
+    def __init__(self, path : str, data : dict, interval : float = 1.0, before_write = None,
+                 after_write = None):
+        """Keyword Arguments:
+        path -- File the document is saved to
+        data -- Document to save. It is read when the write happens, so
+                later changes to it are picked up
+        interval -- Seconds to wait after a change before writing
+        before_write -- Called with no arguments just before each write,
+                        e.g. to bring data up to date
+        after_write -- Called with the seconds taken after each successful
+                       write, e.g. to record them
+        """
+
+        self.path = path
+        self.data = data
+        self.interval = interval
+        self.before_write = before_write
+        self.after_write = after_write
+
+        self.writes = 0
+        self.dirty = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.thread = None
+
+    def mark_dirty(self):
+        """Records that the document has changed and needs saving
+
+        No arguments
+        """
+
+        if self.interval <= 0 or self.closed:
+            with self.condition:
+                self.dirty = True
+            self.flush()
+            return
+
+        with self.condition:
+            self.dirty = True
+            if self.thread is None and not self.closed:
+                self.thread = threading.Thread(target = self.run,
+                                               name = "config-writer",
+                                               daemon = True)
+                self.thread.start()
+            self.condition.notify()
+
+    def discard(self):
+        """Forgets any unsaved changes, e.g. after the file
+        has been rewritten by something else
+
+        No arguments
+        """
+
+        with self.condition:
+            self.dirty = False
+
+    def flush(self):
+        """Writes the document now if it has unsaved changes
+
+        No arguments
+        """
+
+        with self.write_lock:
+            with self.condition:
+                if not self.dirty:
+                    return
+                self.dirty = False
+
+            try:
+                start = time.perf_counter()
+                if self.before_write is not None:
+                    self.before_write()
+                atomic_write_json(self.path, self.data)
+                self.writes += 1
+                if self.after_write is not None:
+                    self.after_write(time.perf_counter() - start)
+            except RuntimeError as raised_exception:
+                #document was changed while being serialized, try again next time
+                logging.warning("Config changed during save, retrying : "+str(raised_exception))
+                with self.condition:
+                    self.dirty = True
+            except Exception as raised_exception:
+                logging.exception("Error in saving config : "+str(raised_exception))
+                with self.condition:
+                    self.dirty = True
+
+    def run(self):
+        """Writer thread loop. Waits for changes, lets them build up for
+        interval seconds, then saves them in one write
+
+        No arguments
+        """
+
+        while True:
+            with self.condition:
+                while not self.dirty and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                #debounce: anything changed during this wait goes in the same write
+                deadline = time.monotonic() + self.interval
+                remaining = self.interval
+                while remaining > 0 and not self.closed:
+                    self.condition.wait(remaining)
+                    remaining = deadline - time.monotonic()
+                if self.closed:
+                    return
+
+            self.flush()
+
+    def close(self):
+        """Stops the writer thread and saves any unsaved changes.
+        Registered with atexit so changes survive shutdown
+
+        No arguments
+        """
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+        if self.thread is not None:
+            self.thread.join()
+
+        self.flush()
@@ -0,0 +1,125 @@
+"""Cached HTML for the index page.
+
+Each alarm and notification is rendered to an HTML fragment once, and
+the page built from them is kept until the repository changes. Refreshes
+of an unchanged page are answered from memory, and browsers that already
+have it get a 304 Not Modified through its ETag.
+
+ECM1400, Programming, CA3
+"""
+
+import hashlib
+import threading
+from flask import Markup
+
+
+class RenderCache:
+    """Fragments for each alarm and notification, and the last page
+    rendered, tagged with the repository version it was rendered at.
+    """
+
+    def __init__(self, jinja_env, page_template : str = "template.html",
+                 item_template : str = "item.html"):
+        """Keyword Arguments:
+        jinja_env -- Jinja environment templates are loaded from (app.jinja_env)
+        page_template -- Template of the whole page
+        item_template -- Template of one alarm or notification
+        """
+
+        self.jinja_env = jinja_env
+        self.page_template = page_template
+        self.item_template = item_template
+        #(kind, state, title) -> (content, fragment)
+        self.fragments = {}
+        #(version, body, etag) of the last page rendered
+        self.page = None
+        self.lock = threading.Lock()
+        self.stats = {"page_hits" : 0, "page_renders" : 0,
+                      "fragment_hits" : 0, "fragment_renders" : 0}
+
+    def fragment(self, kind : str, item : dict, state : str = "") -> Markup:
+        """Returns HTML for an alarm or notification, rendering it only
+        if its content has changed since it was last rendered
+
+        Keyword Arguments:
+        kind -- "alarm" or "notification"
+        item -- Alarm or notification dictionary
+        state -- "upcoming" or "undismissed" for alarms
+        """
+
+        key = (kind, state, item["title"])
+        content = str(item["content"])
+
+        with self.lock:
+            cached = self.fragments.get(key)
+            if cached is not None and cached[0] == content:
+                self.stats["fragment_hits"] += 1
+                return cached[1]
+
+        dismiss_name = "alarm_item" if kind == "alarm" else "notif"
+        fragment = Markup(self.jinja_env.get_template(self.item_template).render(
+            item = {"title" : item["title"], "content" : Markup(content)},
+            kind = kind, state = state, dismiss_name = dismiss_name))
+
+        with self.lock:
+            self.fragments[key] = (content, fragment)
+            self.stats["fragment_renders"] += 1
+        return fragment
+
+    def forget(self, kind : str, title : str):
+        """Drops the fragment of a dismissed alarm or notification
+
+        Keyword Arguments:
+        kind -- "alarm" or "notification"
+        title -- Title of item
+        """
+
+        with self.lock:
+            for state in ("", "upcoming", "undismissed"):
+                self.fragments.pop((kind, state, title), None)
+
+    def render_page(self, repository, **context) -> tuple:
+        """Returns (body, etag) of the index page. The page is only
+        rendered again once repository.version has moved on
+
+        Keyword Arguments:
+        repository -- Repository alarms and notifications are read from
+        context -- Other variables the page template uses (title, image)
+        """
+
+        version = repository.version
+
+        with self.lock:
+            if self.page is not None and self.page[0] == version:
+                self.stats["page_hits"] += 1
+                return self.page[1], self.page[2]
+
+        #read in one go, so an alarm ringing meanwhile isn't shown twice
+        snapshot = repository.snapshot()
+        version = snapshot["version"]
+        alarms = ([self.fragment("alarm", alarm, "undismissed")
+                   for alarm in snapshot["undismissed_alarms"]] +
+                  [self.fragment("alarm", alarm, "upcoming")
+                   for alarm in snapshot["upcoming_alarms"]])
+        notifications = snapshot["notifications"]
+
+        body = self.jinja_env.get_template(self.page_template).render(
+            alarms = alarms,
+            notifications = [self.fragment("notification", notif) for notif in notifications],
+            **context)
+        etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+        with self.lock:
+            self.page = (version, body, etag)
+            self.stats["page_renders"] += 1
+        return body, etag
+
+    def clear(self):
+        """Forgets all fragments and the cached page
+
+        No arguments
+        """
+
+        with self.lock:
+            self.fragments.clear()
+            self.page = None
@@ -0,0 +1,167 @@
+"""Text to speech for alarm announcements.
+
+One engine is created and used by a single worker thread, which reads
+announcements from a bounded queue. Alarms add announcements and
+carry on straight away instead of waiting for them to be spoken.
+
+ECM1400, Programming, CA3
+"""
+
+import logging
+import threading
+from collections import deque
+
+
+class NullEngine:
+    """Engine that says nothing, for machines without speech support
+    """
+
+    def say(self, text : str):
+        pass
+
+    def runAndWait(self):
+        pass
+
+
+class RecordingEngine:
+    """Engine that remembers what it was asked to say instead of
+    speaking, for testing
+    """
+
+    def __init__(self):
+        self.spoken = []
+        self.pending = []
+
+    def say(self, text : str):
+        self.pending.append(text)
+
+    def runAndWait(self):
+        self.spoken.extend(self.pending)
+        self.pending = []
+
+
+def make_pyttsx3_engine():
+    """Returns a pyttsx3 engine, or a NullEngine if pyttsx3 can't
+    start (e.g. eSpeak isn't installed on Linux)
+
+    No arguments
+    """
+
+    try:
+        #imported here so pyttsx3 is only loaded when something is said
+        import pyttsx3
+        return pyttsx3.init()
+    except Exception as raised_exception:
+        logging.exception("TTS engine unavailable, alarms will be silent : "+str(raised_exception))
+        return NullEngine()
+
+
+ENGINE_FACTORIES = {
+    "pyttsx3" : make_pyttsx3_engine,
+    "null" : NullEngine,
+    "recording" : RecordingEngine,
+}
+
+
+class SpeechWorker:
+    """Speaks queued announcements one at a time on its own thread.
+
+    At most max_pending announcements wait to be spoken. An announcement
+    that is already waiting isn't queued again, and when the queue is
+    full the oldest waiting announcement is dropped.
+    """
+
+    def __init__(self, engine_factory = make_pyttsx3_engine, max_pending : int = 16):
+        """Keyword Arguments:
+        engine_factory -- Function returning the engine, called on the worker thread
+        max_pending -- Most announcements waiting to be spoken
+        """
+
+        self.engine_factory = engine_factory
+        self.engine = None
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.speaking = False
+        self.stats = {"spoken" : 0, "coalesced" : 0, "dropped" : 0, "errors" : 0}
+
+    def say(self, text : str):
+        """Queues text to be spoken, and returns without waiting
+
+        Keyword Arguments:
+        text -- Text to be spoken
+        """
+
+        with self.condition:
+            if text in self.pending:
+                self.stats["coalesced"] += 1
+                return
+
+            if len(self.pending) >= self.max_pending:
+                dropped = self.pending.popleft()
+                self.stats["dropped"] += 1
+                logging.warning("TTS queue full, dropped announcement " + dropped)
+
+            self.pending.append(text)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.run,
+                                               name = "speech-worker",
+                                               daemon = True)
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self):
+        """Worker thread loop. Creates the engine, then speaks
+        announcements as they are queued
+
+        No arguments
+        """
+
+        self.engine = self.engine_factory()
+
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                text = self.pending.popleft()
+                self.speaking = True
+
+            try:
+                self.engine.say(text)
+                self.engine.runAndWait()
+                self.stats["spoken"] += 1
+            except Exception as raised_exception:
+                self.stats["errors"] += 1
+                logging.exception("Error in TTS engine :"+str(raised_exception))
+            finally:
+                with self.condition:
+                    self.speaking = False
+                    self.condition.notify_all()
+
+    def wait_until_idle(self, timeout : float = None) -> bool:
+        """Waits until every queued announcement has been spoken.
+        Returns False if timeout ran out first
+
+        Keyword Arguments:
+        timeout -- Most seconds to wait, or None to wait forever
+        """
+
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.speaking,
+                                           timeout)
+
+    def stop(self):
+        """Stops the worker thread once it finishes what it's saying.
+        Announcements still queued aren't spoken
+
+        No arguments
+        """
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
@@ -0,0 +1,910 @@
+"""Storage for the COVID-19 application's alarms and notifications.
+
+Two repositories with the same methods are provided:
+JSONRepository keeps everything in config.json (the default), and
+SQLiteRepository keeps it in an indexed SQLite database, which keeps
+lookups fast as alarm and notification history grows. The database
+can be shared by several processes, e.g. WSGI server workers.
+
+ECM1400, Programming, CA3
+"""
+
+import time
+import sqlite3
+import logging
+import threading
+
+#optional alarm fields giving the place a briefing is for. Alarms
+#without them use the region, city and country in settings
+LOCATION_FIELDS = ("region", "city", "country")
+
+#fields holding when undismissed alarms rang and notifications were
+#added, used by compact to find the oldest
+RUNG_AT = "rung_at"
+ADDED_AT = "added_at"
+
+
+class AlarmExistsError(Exception):
+    """Raised by add_alarm when an alarm with the same ID or title
+    already exists, or its ID has already been handed out, e.g. because
+    another thread or process took the ID
+    """
+
+
+def numeric_alarm_id(alarm : dict):
+    """Returns the ID of an alarm as an int, or None if it has no
+    numeric ID
+
+    Keyword Arguments:
+    alarm -- Alarm dictionary
+    """
+
+    try:
+        return int(alarm["id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class JSONRepository:
+    """Alarms and notifications stored in the "persistent-data"
+    section of config.json.
+
+    In memory, they are kept in dictionaries indexed by title (and alarm
+    IDs in a set), guarded by a lock, so every change is O(1) and safe
+    from any thread. Readers get copies of the lists, taken under the
+    lock, so rendering never sees a half-made change and never waits for
+    an alarm that is ringing. The lists in config.json are rebuilt from
+    the dictionaries by sync_to_data, just before the file is written.
+    """
+
+    def __init__(self, persistent_data : dict, save):
+        """Keyword Arguments:
+        persistent_data -- "persistent-data" section of the config file
+        save -- Called after every change, to save the config file
+        """
+
+        self.data = persistent_data
+        self.save = save
+        #goes up on every change, so callers can tell when to re-render
+        self.version = 0
+        self.lock = threading.RLock()
+
+        self.upcoming = {alarm["title"] : alarm for alarm in persistent_data["upcoming_alarms"]}
+        self.undismissed = {alarm["title"] : alarm for alarm in persistent_data["undismissed_alarms"]}
+        self.notifs = {notif["title"] : notif for notif in persistent_data["notifications"]}
+        #items saved before they were timestamped count as new
+        loaded_at = time.time()
+        for alarm in self.undismissed.values():
+            alarm.setdefault(RUNG_AT, loaded_at)
+        for notif in self.notifs.values():
+            notif.setdefault(ADDED_AT, loaded_at)
+        self.alarm_ids = set()
+        for alarm in list(self.upcoming.values()) + list(self.undismissed.values()):
+            if "id" in alarm:
+                self.alarm_ids.add(str(alarm["id"]))
+
+    def sync_to_data(self):
+        """Copies alarms and notifications back into the lists of the
+        "persistent-data" section, so the config file can be written.
+        The lists are replaced rather than changed, so a write in progress
+        isn't affected by later changes
+
+        No arguments
+        """
+
+        with self.lock:
+            self.data["upcoming_alarms"] = list(self.upcoming.values())
+            self.data["undismissed_alarms"] = list(self.undismissed.values())
+            self.data["notifications"] = list(self.notifs.values())
+
+    def data_version(self) -> int:
+        """Returns a number that changes when another process changes
+        the data. config.json is only changed by this process, so it never does
+
+        No arguments
+        """
+
+        return 0
+
+    def requeue_ringing_alarms(self) -> int:
+        """Alarms are removed from config.json as they ring, so there
+        are none to move back. Returns 0
+
+        No arguments
+        """
+
+        return 0
+
+    def current_alarm_id(self) -> str:
+        """Returns the ID the next alarm added will have
+
+        No arguments
+        """
+
+        with self.lock:
+            return str(self.data["ID-value"])
+
+    def add_alarm(self, alarm : dict):
+        """Adds alarm to upcoming alarms, and moves on the alarm ID.
+        Raises AlarmExistsError if an alarm with its ID or title exists,
+        or its ID is below ID-value
+
+        Keyword Arguments:
+        alarm -- Alarm to be added
+        """
+
+        number = numeric_alarm_id(alarm)
+        with self.lock:
+            alarm_id = str(alarm["id"]) if "id" in alarm else None
+            #an ID below ID-value was handed out before, even if its alarm has gone since
+            if (alarm_id in self.alarm_ids or alarm["title"] in self.upcoming
+                    or alarm["title"] in self.undismissed
+                    or (number is not None and number < self.data["ID-value"])):
+                raise AlarmExistsError(alarm["title"])
+
+            self.upcoming[alarm["title"]] = alarm
+            if alarm_id is not None:
+                self.alarm_ids.add(alarm_id)
+            self.data["ID-value"] += 1
+            if number is not None:
+                self.data["ID-value"] = max(self.data["ID-value"], number + 1)
+            self.version += 1
+
+        #outside the lock, as saving may call sync_to_data from another thread
+        self.save()
+
+    def upcoming_alarms(self) -> list:
+        """Returns alarms that haven't rung yet
+
+        No arguments
+        """
+
+        with self.lock:
+            return list(self.upcoming.values())
+
+    def undismissed_alarms(self) -> list:
+        """Returns alarms that have rung but haven't been dismissed
+
+        No arguments
+        """
+
+        with self.lock:
+            return list(self.undismissed.values())
+
+    def snapshot(self) -> dict:
+        """Returns upcoming alarms, undismissed alarms and notifications
+        as they were at one moment, so an alarm that rings meanwhile
+        isn't listed twice
+
+        No arguments
+        """
+
+        with self.lock:
+            return {"upcoming_alarms" : list(self.upcoming.values()),
+                    "undismissed_alarms" : list(self.undismissed.values()),
+                    "notifications" : list(self.notifs.values()),
+                    "version" : self.version}
+
+    def has_undismissed_alarm(self, title : str) -> bool:
+        """Returns whether an alarm with this title has rung and is undismissed
+
+        Keyword Arguments:
+        title -- Title of alarm
+        """
+
+        with self.lock:
+            return title in self.undismissed
+
+    def pop_upcoming_alarm(self, title : str) -> dict:
+        """Removes an upcoming alarm so it can be rung,
+        and returns it (or None if there isn't one). Only one
+        caller gets the alarm, however many try at once
+
+        Keyword Arguments:
+        title -- Title of alarm
+        """
+
+        popped = self.pop_upcoming_alarms([title])
+        return popped[0] if popped else None
+
+    def pop_upcoming_alarms(self, titles : list) -> list:
+        """Removes the upcoming alarms with these titles so they can be
+        rung, as one change saved once, and returns them. Titles without
+        an upcoming alarm are skipped
+
+        Keyword Arguments:
+        titles -- Titles of alarms
+        """
+
+        with self.lock:
+            popped = []
+            for title in titles:
+                alarm = self.upcoming.pop(title, None)
+                if alarm is None:
+                    continue
+                if "id" in alarm:
+                    self.alarm_ids.discard(str(alarm["id"]))
+                popped.append(alarm)
+            if not popped:
+                return popped
+            self.version += 1
+
+        self.save()
+        return popped
+
+    def add_undismissed_alarm(self, alarm : dict):
+        """Adds an alarm that has rung to undismissed alarms
+
+        Keyword Arguments:
+        alarm -- Alarm that has rung
+        """
+
+        self.add_undismissed_alarms([alarm])
+
+    def add_undismissed_alarms(self, alarms : list):
+        """Adds alarms that have rung to undismissed alarms,
+        as one change saved once
+
+        Keyword Arguments:
+        alarms -- Alarms that have rung
+        """
+
+        if not alarms:
+            return
+
+        rung_at = time.time()
+        with self.lock:
+            for alarm in alarms:
+                alarm[RUNG_AT] = rung_at
+                self.undismissed[alarm["title"]] = alarm
+                if "id" in alarm:
+                    self.alarm_ids.add(str(alarm["id"]))
+            self.version += 1
+
+        self.save()
+
+    def delete_alarm(self, title : str) -> list:
+        """Deletes the undismissed and upcoming alarms with this title,
+        and returns the deleted alarms
+
+        Keyword Arguments:
+        title -- Title of alarm
+        """
+
+        with self.lock:
+            deleted = []
+            for alarms in (self.undismissed, self.upcoming):
+                alarm = alarms.pop(title, None)
+                if alarm is not None:
+                    deleted.append(alarm)
+                    if "id" in alarm:
+                        self.alarm_ids.discard(str(alarm["id"]))
+
+            if deleted:
+                self.version += 1
+
+        if deleted:
+            self.save()
+        return deleted
+
+    def notifications(self) -> list:
+        """Returns undismissed notifications
+
+        No arguments
+        """
+
+        with self.lock:
+            return list(self.notifs.values())
+
+    def has_notification(self, title : str) -> bool:
+        """Returns whether a notification with this title is undismissed
+
+        Keyword Arguments:
+        title -- Title of notification
+        """
+
+        with self.lock:
+            return title in self.notifs
+
+    def add_notification(self, notif : dict):
+        """Adds a notification
+
+        Keyword Arguments:
+        notif -- Notification to be added
+        """
+
+        #copied, as the caller's notification may be published or compared later
+        notif = dict(notif, **{ADDED_AT : time.time()})
+        with self.lock:
+            self.notifs[notif["title"]] = notif
+            self.version += 1
+
+        self.save()
+
+    def delete_notification(self, title : str) -> dict:
+        """Deletes the notification with this title, and returns it
+        (or None if there isn't one)
+
+        Keyword Arguments:
+        title -- Title of notification
+        """
+
+        with self.lock:
+            notif = self.notifs.pop(title, None)
+            if notif is not None:
+                self.version += 1
+
+        if notif is not None:
+            self.save()
+        return notif
+
+    @staticmethod
+    def oldest_items(items : dict, field : str, max_count : int, oldest : float) -> list:
+        """Returns the items beyond the newest max_count, and those
+        timestamped before oldest, oldest first
+
+        Keyword Arguments:
+        items -- Items indexed by title
+        field -- Field of the items holding their timestamp
+        max_count -- Most items kept, or None for no limit
+        oldest -- Earliest timestamp kept, or None for no limit
+        """
+
+        by_age = sorted(items.values(), key = lambda item: item.get(field, 0), reverse = True)
+        kept = by_age if max_count is None else by_age[:max_count]
+        if oldest is not None:
+            kept = [item for item in kept if item.get(field, 0) >= oldest]
+        kept_titles = {item["title"] for item in kept}
+        return [item for item in reversed(by_age) if item["title"] not in kept_titles]
+
+    def compact(self, max_notifications : int = None, max_undismissed_alarms : int = None,
+                oldest : float = None, archive = None) -> dict:
+        """Removes the oldest notifications and undismissed alarms beyond
+        the given limits. Returns {"notifications" : [...],
+        "undismissed_alarms" : [...]} of the items removed
+
+        Keyword Arguments:
+        max_notifications -- Most notifications kept, or None for no limit
+        max_undismissed_alarms -- Most undismissed alarms kept, or None for no limit
+        oldest -- Items added or rung before this epoch time are removed, or None
+        archive -- Called with the removed items before they are removed.
+                   If it raises, nothing is removed
+        """
+
+        with self.lock:
+            removed = {"notifications" : self.oldest_items(self.notifs, ADDED_AT,
+                                                           max_notifications, oldest),
+                       "undismissed_alarms" : self.oldest_items(self.undismissed, RUNG_AT,
+                                                                max_undismissed_alarms, oldest)}
+            if not (removed["notifications"] or removed["undismissed_alarms"]):
+                return removed
+
+            if archive is not None:
+                archive(removed)
+            for notif in removed["notifications"]:
+                del self.notifs[notif["title"]]
+            for alarm in removed["undismissed_alarms"]:
+                del self.undismissed[alarm["title"]]
+                if "id" in alarm:
+                    self.alarm_ids.discard(str(alarm["id"]))
+            self.version += 1
+
+        self.save()
+        return removed
+
+    def reset(self):
+        """Deletes all alarms and notifications, and resets the alarm ID.
+        The caller is responsible for saving the reset config file
+
+        No arguments
+        """
+
+        with self.lock:
+            self.version += 1
+            self.data["ID-value"] = 0
+            self.upcoming.clear()
+            self.undismissed.clear()
+            self.notifs.clear()
+            self.alarm_ids.clear()
+            self.sync_to_data()
+
+
+class SQLiteRepository:
+    """Alarms and notifications stored in an SQLite database.
+    Alarms are indexed by ID, title, and by state and ring time,
+    so no operation has to look through the whole history.
+
+    The database is in WAL mode, so processes sharing it can read while
+    another writes, and every change moves on a version counter kept in
+    the database, so each process can tell when the data has changed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS alarms (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL UNIQUE,
+            content TEXT NOT NULL,
+            time TEXT NOT NULL,
+            fire_at REAL,
+            rung_at REAL,
+            state TEXT NOT NULL,
+            region TEXT,
+            city TEXT,
+            country TEXT
+        );
+        CREATE INDEX IF NOT EXISTS alarms_by_state_fire_at ON alarms (state, fire_at);
+        CREATE INDEX IF NOT EXISTS alarms_by_state_rung_at ON alarms (state, rung_at);
+
+        CREATE TABLE IF NOT EXISTS notifications (
+            position INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL UNIQUE,
+            content TEXT NOT NULL,
+            added_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS notifications_by_added_at ON notifications (added_at);
+
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path : str, initial_data : dict = None, busy_timeout : float = 5.0):
+        """Keyword Arguments:
+        path -- Database file
+        initial_data -- "persistent-data" section of the config file. It is
+                        copied into the database if the database is new
+        busy_timeout -- Seconds to wait for another process's write to finish
+        """
+
+        self.path = path
+        self.lock = threading.RLock()
+        #waits up to busy_timeout seconds for other processes' writes to finish
+        self.connection = sqlite3.connect(path, timeout = busy_timeout,
+                                          check_same_thread = False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+
+        with self.lock, self.connection:
+            self.add_missing_columns()
+            self.connection.executescript(self.SCHEMA)
+            is_new = self.connection.execute(
+                "SELECT 1 FROM counters WHERE name = 'ID-value'").fetchone() is None
+            if is_new:
+                self.connection.execute("INSERT OR IGNORE INTO counters VALUES ('ID-value', 0)")
+            self.connection.execute("INSERT OR IGNORE INTO counters VALUES ('version', 0)")
+
+        if is_new and initial_data:
+            self.import_data(initial_data)
+
+    def import_data(self, persistent_data : dict):
+        """Copies alarms and notifications from the
+        "persistent-data" section of a config file
+
+        Keyword Arguments:
+        persistent_data -- Data to be copied
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE counters SET value = ? WHERE name = 'ID-value'",
+                                    (persistent_data.get("ID-value", 0),))
+            for alarm in persistent_data.get("upcoming_alarms", []):
+                self.insert_alarm(alarm, "upcoming")
+            for alarm in persistent_data.get("undismissed_alarms", []):
+                self.insert_alarm(alarm, "undismissed")
+            for notif in persistent_data.get("notifications", []):
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO notifications (title, content, added_at) "
+                    "VALUES (?, ?, ?)", (notif["title"], str(notif["content"]), time.time()))
+            self.bump_version()
+
+        logging.info("Imported persistent data into "+self.path)
+
+    def add_missing_columns(self):
+        """Adds columns introduced since the database was created.
+        Must be called with the lock held
+
+        No arguments
+        """
+
+        columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(alarms)")]
+        for field in LOCATION_FIELDS:
+            if columns and field not in columns:
+                self.connection.execute("ALTER TABLE alarms ADD COLUMN " + field + " TEXT")
+
+        columns = [row["name"] for row in
+                   self.connection.execute("PRAGMA table_info(notifications)")]
+        if columns and ADDED_AT not in columns:
+            #notifications added before this count as new
+            self.connection.execute("ALTER TABLE notifications ADD COLUMN added_at REAL")
+            self.connection.execute("UPDATE notifications SET added_at = ?", (time.time(),))
+
+    def bump_version(self):
+        """Moves on the version counter. Must be called with the lock
+        held, inside the transaction making the change
+
+        No arguments
+        """
+
+        self.connection.execute("UPDATE counters SET value = value + 1 WHERE name = 'version'")
+
+    @property
+    def version(self) -> int:
+        """Number of changes made to the database, by any process
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM counters WHERE name = 'version'").fetchone()
+        return row["value"]
+
+    def data_version(self) -> int:
+        """Returns a number that changes when another process changes
+        the data (SQLite's data_version)
+
+        No arguments
+        """
+
+        with self.lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def insert_alarm(self, alarm : dict, state : str, replace : bool = True):
+        """Inserts alarm with the given state. Must be called with the
+        lock held, inside a transaction
+
+        Keyword Arguments:
+        alarm -- Alarm to be inserted
+        state -- "upcoming" or "undismissed"
+        replace -- Whether an alarm with the same ID is replaced. If not,
+                   sqlite3.IntegrityError is raised instead
+        """
+
+        rung_at = time.time() if state == "undismissed" else None
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        self.connection.execute(
+            verb + " INTO alarms (id, title, content, time, fire_at, rung_at, state, "
+            "region, city, country) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(alarm.get("id", alarm["title"])), alarm["title"], str(alarm["content"]),
+             alarm.get("time", ""), alarm.get("fire_at"), rung_at, state,
+             alarm.get("region"), alarm.get("city"), alarm.get("country")))
+
+    @staticmethod
+    def alarm_from_row(row : sqlite3.Row) -> dict:
+        """Converts an alarms table row to an alarm dictionary
+
+        Keyword Arguments:
+        row -- Row to be converted
+        """
+
+        alarm = {"id" : row["id"], "title" : row["title"],
+                "content" : row["content"], "time" : row["time"]}
+        if row["fire_at"] is not None:
+            alarm["fire_at"] = row["fire_at"]
+        for field in LOCATION_FIELDS:
+            if row[field] is not None:
+                alarm[field] = row[field]
+        return alarm
+
+    def requeue_ringing_alarms(self) -> int:
+        """Moves alarms that were ringing when the scheduler's process
+        stopped back to upcoming, so they ring again. Returns how many
+        were moved. Should only be called by the process taking over the
+        scheduler, as other processes may be ringing alarms right now
+
+        No arguments
+        """
+
+        with self.lock, self.connection:
+            moved = self.connection.execute(
+                "UPDATE alarms SET state = 'upcoming' WHERE state = 'ringing'").rowcount
+            if moved:
+                self.bump_version()
+        return moved
+
+    def current_alarm_id(self) -> str:
+        """Returns the ID the next alarm added will have
+
+        No arguments
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM counters WHERE name = 'ID-value'").fetchone()
+        return str(row["value"])
+
+    def add_alarm(self, alarm : dict):
+        """Adds alarm to upcoming alarms, and moves on the alarm ID.
+        Raises AlarmExistsError if an alarm with its ID or title exists,
+        or its ID is below ID-value, e.g. because another process has
+        just taken the ID
+
+        Keyword Arguments:
+        alarm -- Alarm to be added
+        """
+
+        number = numeric_alarm_id(alarm)
+        try:
+            with self.lock, self.connection:
+                if number is None:
+                    self.connection.execute(
+                        "UPDATE counters SET value = value + 1 WHERE name = 'ID-value'")
+                else:
+                    #an ID below ID-value was handed out before, even if its alarm has gone since
+                    claimed = self.connection.execute(
+                        "UPDATE counters SET value = max(value + 1, ?) "
+                        "WHERE name = 'ID-value' AND value <= ?", (number + 1, number))
+                    if claimed.rowcount == 0:
+                        raise sqlite3.IntegrityError("alarm ID already handed out")
+                self.insert_alarm(alarm, "upcoming", replace = False)
+                self.bump_version()
+        except sqlite3.IntegrityError:
+            raise AlarmExistsError(alarm["title"])
+
+    def upcoming_alarms(self) -> list:
+        """Returns alarms that haven't rung yet, soonest first
+
+        No arguments
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM alarms WHERE state = 'upcoming' ORDER BY fire_at").fetchall()
+        return [self.alarm_from_row(row) for row in rows]
+
+    def undismissed_alarms(self) -> list:
+        """Returns alarms that have rung but haven't been dismissed
+
+        No arguments
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM alarms WHERE state = 'undismissed' ORDER BY rung_at").fetchall()
+        return [self.alarm_from_row(row) for row in rows]
+
+    def snapshot(self) -> dict:
+        """Returns upcoming alarms, undismissed alarms and notifications
+        as they were at one moment, read in one transaction so changes
+        made meanwhile, by any process, aren't half included
+
+        No arguments
+        """
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                snapshot = {"upcoming_alarms" : self.upcoming_alarms(),
+                            "undismissed_alarms" : self.undismissed_alarms(),
+                            "notifications" : self.notifications(),
+                            "version" : self.version}
+            finally:
+                self.connection.execute("COMMIT")
+        return snapshot
+
+    def has_undismissed_alarm(self, title : str) -> bool:
+        """Returns whether an alarm with this title has rung and is undismissed
+
+        Keyword Arguments:
+        title -- Title of alarm
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM alarms WHERE title = ? AND state = 'undismissed'",
+                (title,)).fetchone()
+        return row is not None
+
+    def pop_upcoming_alarm(self, title : str) -> dict:
+        """Marks an upcoming alarm as ringing so it can be rung,
+        and returns it (or None if there isn't one)
+
+        Keyword Arguments:
+        title -- Title of alarm
+        """
+
+        popped = self.pop_upcoming_alarms([title])
+        return popped[0] if popped else None
+
+    def pop_upcoming_alarms(self, titles : list) -> list:
+        """Marks the upcoming alarms with these titles as ringing so they
+        can be rung, in one transaction, and returns them. Titles without
+        an upcoming alarm are skipped
+
+        Keyword Arguments:
+        titles -- Titles of alarms
+        """
+
+        with self.lock, self.connection:
+            #takes the write lock before reading, so two processes can't both claim an alarm
+            self.connection.execute("BEGIN IMMEDIATE")
+            rows = []
+            for title in titles:
+                row = self.connection.execute(
+                    "SELECT * FROM alarms WHERE title = ? AND state = 'upcoming'",
+                    (title,)).fetchone()
+                if row is not None:
+                    rows.append(row)
+            if rows:
+                self.connection.executemany("UPDATE alarms SET state = 'ringing' WHERE id = ?",
+                                            [(row["id"],) for row in rows])
+                self.bump_version()
+        return [self.alarm_from_row(row) for row in rows]
+
+    def add_undismissed_alarm(self, alarm : dict):
+        """Adds an alarm that has rung to undismissed alarms
+
+        Keyword Arguments:
+        alarm -- Alarm that has rung
+        """
+
+        self.add_undismissed_alarms([alarm])
+
+    def add_undismissed_alarms(self, alarms : list):
+        """Adds alarms that have rung to undismissed alarms, in one transaction
+
+        Keyword Arguments:
+        alarms -- Alarms that have rung
+        """
+
+        if not alarms:
+            return
+
+        with self.lock, self.connection:
+            for alarm in alarms:
+                self.insert_alarm(alarm, "undismissed")
+            self.bump_version()
+
+    def delete_alarm(self, title : str) -> list:
+        """Deletes the alarm with this title, and returns the deleted alarms
+
+        Keyword Arguments:
+        title -- Title of alarm
+        """
+
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT * FROM alarms WHERE title = ? AND state IN ('upcoming', 'undismissed')",
+                (title,)).fetchall()
+            self.connection.execute(
+                "DELETE FROM alarms WHERE title = ? AND state IN ('upcoming', 'undismissed')",
+                (title,))
+            if rows:
+                self.bump_version()
+        return [self.alarm_from_row(row) for row in rows]
+
+    def notifications(self) -> list:
+        """Returns undismissed notifications, oldest first
+
+        No arguments
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT title, content FROM notifications ORDER BY position").fetchall()
+        return [{"title" : row["title"], "content" : row["content"]} for row in rows]
+
+    def has_notification(self, title : str) -> bool:
+        """Returns whether a notification with this title is undismissed
+
+        Keyword Arguments:
+        title -- Title of notification
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM notifications WHERE title = ?", (title,)).fetchone()
+        return row is not None
+
+    def add_notification(self, notif : dict):
+        """Adds a notification
+
+        Keyword Arguments:
+        notif -- Notification to be added
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO notifications (title, content, added_at) VALUES (?, ?, ?)",
+                (notif["title"], str(notif["content"]), time.time()))
+            self.bump_version()
+
+    def delete_notification(self, title : str) -> dict:
+        """Deletes the notification with this title, and returns it
+        (or None if there isn't one)
+
+        Keyword Arguments:
+        title -- Title of notification
+        """
+
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT title, content FROM notifications WHERE title = ?", (title,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("DELETE FROM notifications WHERE title = ?", (title,))
+            self.bump_version()
+        return {"title" : row["title"], "content" : row["content"]}
+
+    def compact(self, max_notifications : int = None, max_undismissed_alarms : int = None,
+                oldest : float = None, archive = None) -> dict:
+        """Removes the oldest notifications and undismissed alarms beyond
+        the given limits, in one transaction. Returns {"notifications" : [...],
+        "undismissed_alarms" : [...]} of the items removed
+
+        Keyword Arguments:
+        max_notifications -- Most notifications kept, or None for no limit
+        max_undismissed_alarms -- Most undismissed alarms kept, or None for no limit
+        oldest -- Items added or rung before this epoch time are removed, or None
+        archive -- Called with the removed items before the transaction is
+                   committed. If it raises, nothing is removed
+        """
+
+        #a negative LIMIT is no limit. Comparisons with NULL are never true
+        with self.lock, self.connection:
+            notif_rows = self.connection.execute(
+                "SELECT position, title, content FROM notifications WHERE added_at < ? "
+                "OR position NOT IN (SELECT position FROM notifications "
+                "ORDER BY added_at DESC, position DESC LIMIT ?) ORDER BY position",
+                (oldest, -1 if max_notifications is None else max_notifications)).fetchall()
+            alarm_rows = self.connection.execute(
+                "SELECT * FROM alarms WHERE state = 'undismissed' AND (rung_at < ? "
+                "OR id NOT IN (SELECT id FROM alarms WHERE state = 'undismissed' "
+                "ORDER BY rung_at DESC LIMIT ?)) ORDER BY rung_at",
+                (oldest, -1 if max_undismissed_alarms is None else max_undismissed_alarms)).fetchall()
+
+            removed = {"notifications" : [{"title" : row["title"], "content" : row["content"]}
+                                          for row in notif_rows],
+                       "undismissed_alarms" : [self.alarm_from_row(row) for row in alarm_rows]}
+            if not (notif_rows or alarm_rows):
+                return removed
+
+            if archive is not None:
+                archive(removed)
+            self.connection.executemany("DELETE FROM notifications WHERE position = ?",
+                                        [(row["position"],) for row in notif_rows])
+            self.connection.executemany("DELETE FROM alarms WHERE id = ?",
+                                        [(row["id"],) for row in alarm_rows])
+            self.bump_version()
+        return removed
+
+    def reset(self):
+        """Deletes all alarms and notifications, and resets the alarm ID
+
+        No arguments
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM alarms")
+            self.connection.execute("DELETE FROM notifications")
+            self.connection.execute("UPDATE counters SET value = 0 WHERE name = 'ID-value'")
+            self.bump_version()
+
+    def close(self):
+        """Closes the database connection
+
+        No arguments
+        """
+
+        with self.lock:
+            self.connection.close()
+
+
+def open_repository(settings : dict, persistent_data : dict, save):
+    """Returns the repository selected by the "storage-backend" setting
+
+    Keyword Arguments:
+    settings -- "settings" section of the config file
+    persistent_data -- "persistent-data" section of the config file
+    save -- Saves the config file (used by the JSON repository)
+    """
+
+    backend = settings.get("storage-backend", "json")
+
+    if backend == "sqlite":
+        return SQLiteRepository(settings.get("database-path", "briefing.db"), persistent_data,
+                                settings.get("database-busy-timeout", 5.0))
+    if backend != "json":
+        logging.error("Unknown storage-backend "+str(backend)+". Using json.")
+
+    return JSONRepository(persistent_data, save)
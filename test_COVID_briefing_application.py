@@ -1,6 +1,16 @@
 import json
 import COVID_briefing_application
 import time
+import datetime
+import threading
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from urllib.parse import parse_qs
+from fake_upstream import FakeUpstream
+from fake_upstream import use_fake_upstream
 from COVID_briefing_application import get_day_news
 from COVID_briefing_application import get_day_weather
 from COVID_briefing_application import get_day_infection_rate
@@ -12,16 +22,56 @@ from COVID_briefing_application import reset_persistent_data
 from COVID_briefing_application import alarm_ring
 from COVID_briefing_application import notification_ring
 from COVID_briefing_application import refresh_upcoming_alarms
+from COVID_briefing_application import schedule_daily_notification
+from COVID_briefing_application import start_scheduler
+from COVID_briefing_application import schedule_alarm
+from COVID_briefing_application import scheduler_queue_depth
+from COVID_briefing_application import alarm_fire_time
+from COVID_briefing_application import assemble_briefing
+from COVID_briefing_application import fetch_briefings
 from COVID_briefing_application import test_news_api
 from COVID_briefing_application import test_weather_api
 from COVID_briefing_application import test_covid_api
 
+#the app runs on a copy of config.json, with its files in a temporary
+#folder, so the tests never change the project's own
+TEST_FOLDER = tempfile.mkdtemp(prefix = "covid-briefing-test-")
+TEST_CONFIG_PATH = os.path.join(TEST_FOLDER, "config.json")
+shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"),
+            TEST_CONFIG_PATH)
+
+with open(TEST_CONFIG_PATH, "r") as f:
+    test_config = json.load(f)
+test_settings = test_config["settings"]
+test_settings["covid-cache-folder"] = os.path.join(TEST_FOLDER, "covid_cache")
+test_settings["database-path"] = os.path.join(TEST_FOLDER, "briefing.db")
+test_settings["scheduler-lock-path"] = os.path.join(TEST_FOLDER, "scheduler.lock")
+test_settings.setdefault("logging", {})["file"] = os.path.join(TEST_FOLDER, "program_log.log")
+test_settings.setdefault("retention", {})["archive-path"] = os.path.join(TEST_FOLDER, "archive.ndjson")
+with open(TEST_CONFIG_PATH, "w") as f:
+    json.dump(test_config, f, indent = 4, sort_keys = True)
+
+COVID_briefing_application.create_app(TEST_CONFIG_PATH)
+
+def start_stub_upstream(latency : dict):
+    """Starts fake upstream server and points the app at it.
+    Returns the server and a function that restores the real URLs
+    """
+    server = FakeUpstream(latency = latency).start()
+    use_real_upstream = use_fake_upstream(COVID_briefing_application, server)
+
+    def restore():
+        use_real_upstream()
+        server.stop()
+
+    return server, restore
+
 def test_reset_persistent_data():
     """Tests reset_persistent_data method
     """
     reset_persistent_data()
 
-    with open("config.json", "r") as f:
+    with open(TEST_CONFIG_PATH, "r") as f:
         config_file = json.load(f)
 
     assert config_file["persistent-data"]["ID-value"] == 0
@@ -30,42 +80,60 @@ def test_reset_persistent_data():
     assert config_file["persistent-data"]["upcoming_alarms"] == []
 
 def test_get_day_news():
-    """Tests get_day_news method
+    """Tests get_day_news method, against the fake upstream server
     """
     time_string = "2001-11-11T19:23"
     time_format = "%Y-%m-%dT%H:%M"
     old_date = time.strptime(time_string, time_format)
     current_date = time.localtime()
 
-    assert (get_day_news(current_date)
-            .startswith("<b>Top news headlines :</b><br>") == True)
+    server, restore = start_stub_upstream({})
+    try:
+        assert (get_day_news(current_date)
+                .startswith("<b>Top news headlines :</b><br>") == True)
 
-    assert (get_day_news(old_date) == "Historical news data not supported!")
+        assert (get_day_news(old_date) == "Historical news data not supported!")
+    finally:
+        restore()
 
 def test_get_day_weather():
-    """Tests get_day_weather method
+    """Tests get_day_weather method, against the fake upstream server
     """
     time_string = "2001-11-11T19:23"
     time_format = "%Y-%m-%dT%H:%M"
     old_date = time.strptime(time_string, time_format)
     current_date = time.localtime()
 
-    assert (get_day_weather(current_date).startswith(
-            "<b>Weather :</b><br>Weather in ") == True)
+    server, restore = start_stub_upstream({})
+    try:
+        assert (get_day_weather(current_date).startswith(
+                "<b>Weather :</b><br>Weather in ") == True)
 
-    assert (get_day_weather(old_date) == "Historical weather not supported!")
+        assert (get_day_weather(old_date) == "Historical weather not supported!")
+    finally:
+        restore()
 
 def test_get_day_infection_rate():
-    """Tests get_day_infection_rate method
+    """Tests get_day_infection_rate method, against the fake upstream
+    server, which has 25 cases yesterday and 36 the day before
     """
     time_string = "2020-11-11T19:23"
     time_format = "%Y-%m-%dT%H:%M"
     old_date = time.strptime(time_string, time_format)
     current_date = time.localtime()
+    yesterday = (datetime.date.today() - datetime.timedelta(days = 1)).strftime("%d-%m-%Y")
+
+    server, restore = start_stub_upstream({})
+    try:
+        assert (get_day_infection_rate(current_date) ==
+        "Daily COVID-19 case increase in Exeter was 25 on " + yesterday +
+        ", down 11 from the previous day.")
 
-    assert (get_day_infection_rate(old_date) ==
-    "Daily COVID-19 case increase in Exeter was 25 on 10-11-2020, down 11 from the previous day.")
-    assert (get_day_infection_rate)
+        #before the fake's figures start
+        assert (get_day_infection_rate(old_date) ==
+        "COVID-19 infection data for Exeter unavailable through PHE database for given date")
+    finally:
+        restore()
 
 def test_del_notif():
     """Tests del_notif method
@@ -76,12 +144,15 @@ def test_del_notif():
     test_notif2 = {"title":"test_notif2","content":"content"}
     test_notif3 = {"title":"test_notif3","content":"content"}
 
-    COVID_briefing_application.notifications = [test_notif1,test_notif2,test_notif3]
+    repository = COVID_briefing_application.repository
+    repository.reset()
+    for notif in [test_notif1,test_notif2,test_notif3]:
+        repository.add_notification(notif)
 
     del_notif("test_notif2")
 
-    assert len(COVID_briefing_application.notifications) == 2
-    assert test_notif2 not in COVID_briefing_application.notifications
+    assert len(repository.notifications()) == 2
+    assert test_notif2 not in repository.notifications()
 
     reset_persistent_data()   
 
@@ -94,12 +165,15 @@ def test_del_alarm():
     test_alarm2 = {"title":"test_alarm2","content":"content"}
     test_alarm3 = {"title":"test_alarm3","content":"content"}
 
-    COVID_briefing_application.undismissed_alarms = [test_alarm1,test_alarm2,test_alarm3]
+    repository = COVID_briefing_application.repository
+    repository.reset()
+    for alarm in [test_alarm1,test_alarm2,test_alarm3]:
+        repository.add_undismissed_alarm(alarm)
 
     del_alarm("test_alarm2")
 
-    assert len(COVID_briefing_application.undismissed_alarms) == 2
-    assert test_alarm2 not in COVID_briefing_application.undismissed_alarms
+    assert len(repository.undismissed_alarms()) == 2
+    assert test_alarm2 not in repository.undismissed_alarms()
 
     reset_persistent_data()
 
@@ -114,15 +188,17 @@ def test_alarm_ring():
     test_alarm2 = {"title":"test_alarm2","content":"content"}
     test_alarm3 = {"title":"test_alarm3","content":"content"}
 
-    COVID_briefing_application.upcoming_alarms = [test_alarm1,test_alarm2,test_alarm3]
-    COVID_briefing_application.undismissed_alarms = []
+    repository = COVID_briefing_application.repository
+    repository.reset()
+    for alarm in [test_alarm1,test_alarm2,test_alarm3]:
+        repository.add_alarm(alarm)
 
     alarm_ring("test_alarm2")
 
-    assert len(COVID_briefing_application.upcoming_alarms) == 2
-    assert test_alarm2 not in COVID_briefing_application.upcoming_alarms
+    assert len(repository.upcoming_alarms()) == 2
+    assert test_alarm2 not in repository.upcoming_alarms()
 
-    for alarm in COVID_briefing_application.undismissed_alarms:
+    for alarm in repository.undismissed_alarms():
         assert alarm["title"] == "test_alarm2"
         assert alarm["content"] == ""
 
@@ -139,11 +215,41 @@ def test_notification_ring():
     test_notif2 = {"title":"test_notif2","content":"content"}
     test_notif3 = {"title":"test_notif3","content":"content"}
 
-    COVID_briefing_application.notifications = [test_notif1,test_notif2,test_notif3]
+    repository = COVID_briefing_application.repository
+    repository.reset()
+    for notif in [test_notif1,test_notif2,test_notif3]:
+        repository.add_notification(notif)
 
     notification_ring(notification_time)
 
-    assert len(COVID_briefing_application.notifications) == 4
+    assert len(repository.notifications()) == 4
+
+    reset_persistent_data()
+
+def test_compact_history(tmp_path):
+    """Tests that notifications beyond the retention limits are
+    archived and removed
+    """
+    repository = COVID_briefing_application.repository
+    retention = COVID_briefing_application.retention
+    original = dict(retention)
+    repository.reset()
+    for i in range(3):
+        repository.add_notification({"title" : "test_notif" + str(i), "content" : "content"})
+        time.sleep(0.01)
+
+    retention.update({"max-notifications" : 1, "archive-path" : str(tmp_path / "archive.ndjson")})
+    try:
+        COVID_briefing_application.compact_history()
+    finally:
+        retention.clear()
+        retention.update(original)
+
+    assert [notif["title"] for notif in repository.notifications()] == ["test_notif2"]
+    with open(str(tmp_path / "archive.ndjson"), "r") as f:
+        archived = [json.loads(line) for line in f]
+    assert [entry["item"]["title"] for entry in archived] == ["test_notif0", "test_notif1"]
+    assert archived[0]["kind"] == "notification"
 
     reset_persistent_data()
 
@@ -154,16 +260,71 @@ def test_refresh_upcoming_alarms():
     test_alarm2 = {"title":"test_alarm2","content":"content","time":"2500-02-20T21:03"}
     test_alarm3 = {"title":"test_alarm3","content":"content","time":"3000-02-20T21:03"}
 
-    COVID_briefing_application.upcoming_alarms = [test_alarm1,test_alarm2,test_alarm3]
-    COVID_briefing_application.undismissed_alarms = []
+    repository = COVID_briefing_application.repository
+    repository.reset()
+    for alarm in [test_alarm1,test_alarm2,test_alarm3]:
+        repository.add_alarm(alarm)
 
     refresh_upcoming_alarms()
 
-    assert len(COVID_briefing_application.undismissed_alarms) == 1
+    assert len(repository.undismissed_alarms()) == 1
     assert len(COVID_briefing_application.alarm_schedule.queue) == 2
 
     reset_persistent_data()
 
+def test_schedule_alarm():
+    """Tests that alarms are queued once and cancelled on deletion
+    """
+    test_alarm1 = {"title":"test_alarm1","content":"content","time":"2500-02-20T21:03","id":"1"}
+    test_alarm2 = {"title":"test_alarm2","content":"content","time":"3000-02-20T21:03","id":"2"}
+
+    repository = COVID_briefing_application.repository
+    repository.reset()
+    for alarm in [test_alarm1,test_alarm2]:
+        repository.add_alarm(alarm)
+    alarm_schedule = COVID_briefing_application.alarm_schedule
+
+    start_depth = scheduler_queue_depth()
+    start_queue = len(alarm_schedule.queue)
+
+    for _ in range(1000):
+        refresh_upcoming_alarms()
+
+    assert scheduler_queue_depth() == start_depth + 2
+    assert len(alarm_schedule.queue) == start_queue + 2
+
+    #rescheduling leaves one stale event behind, which does nothing
+    schedule_alarm(test_alarm1)
+    assert scheduler_queue_depth() == start_depth + 3
+
+    del_alarm("test_alarm2")
+    assert "2" not in COVID_briefing_application.scheduled_alarms
+    assert len(alarm_schedule.queue) == start_queue + 2
+
+    for event in alarm_schedule.queue:
+        alarm_schedule.cancel(event)
+    COVID_briefing_application.scheduled_alarms.clear()
+    COVID_briefing_application.scheduler_stats["stale_events"] = 0
+
+    reset_persistent_data()
+
+def test_alarm_fire_time():
+    """Tests alarms far ahead are queued for their exact time
+    """
+    next_week = time.localtime(time.time() + 7*24*3600)
+    alarm_time = time.strftime("%Y-%m-%dT%H:%M", next_week)
+    test_alarm = {"title":"test_alarm","content":"content","time":alarm_time,"id":"week"}
+
+    expected = time.mktime(time.strptime(alarm_time, "%Y-%m-%dT%H:%M"))
+    assert alarm_fire_time(test_alarm) == expected
+    assert test_alarm["fire_at"] == expected
+
+    schedule_alarm(test_alarm)
+    event = COVID_briefing_application.scheduled_alarms["week"][1]
+    assert event.time == expected
+
+    COVID_briefing_application.unschedule_alarm("week")
+
 def test_string_to_time():
     """Tests string_to_time method
     """
@@ -181,19 +342,480 @@ def test_time_to_datetime():
     assert time_to_datetime(conversion_time)
 
 def test_API_servers():
-    """Tests api servers
+    """Tests the real api servers
     """
-    current_date = time.localtime()
-
-    assert (get_day_infection_rate(current_date)
-            .startswith("Daily COVID-19 case increase in "))
-    
-    assert (get_day_weather(current_date).startswith(
-            "<b>Weather :</b><br>Weather in ") == True)
-
-    assert (get_day_news(current_date)
-            .startswith("<b>Top news headlines :</b><br>") == True)
-
     test_news_api()
     test_weather_api()
     test_covid_api()
+
+def test_schedule_daily_notification():
+    """Tests schedule_daily_notification method
+    """
+    alarm_schedule = COVID_briefing_application.alarm_schedule
+
+    schedule_daily_notification()
+
+    event = alarm_schedule.queue[-1]
+    assert time.time() < event.time <= time.time() + 24*3600
+
+    alarm_schedule.cancel(event)
+
+def test_start_scheduler():
+    """Tests that the scheduler thread fires events without a request
+    """
+    alarm_schedule = COVID_briefing_application.alarm_schedule
+    COVID_briefing_application.repository.reset()
+
+    start_scheduler()
+
+    fired = threading.Event()
+    alarm_schedule.enter(0.2, 1, fired.set)
+    COVID_briefing_application.scheduler_wakeup.set()
+
+    assert fired.wait(5)
+    assert COVID_briefing_application.scheduler_thread.is_alive()
+
+    for event in alarm_schedule.queue:
+        alarm_schedule.cancel(event)
+    COVID_briefing_application.scheduled_alarms.clear()
+
+def test_json_storage_runs_its_own_scheduler(tmp_path):
+    """Tests a process keeping alarms in config.json runs the scheduler
+    without taking part in leader election, as nothing is shared
+    """
+    application = COVID_briefing_application
+    assert isinstance(application.repository, application.JSONRepository)
+    assert isinstance(application.leader_lock, application.SoleLeader)
+
+    #another process holding the lock file doesn't stop it
+    other = application.LeaderLock(str(tmp_path / "scheduler.lock"))
+    assert other.try_acquire()
+    application.become_leader()
+    assert application.leader_lock.is_leader
+    other.release()
+
+def test_assemble_briefing_parallel():
+    """Tests that sources are fetched at the same time
+    """
+    server, restore = start_stub_upstream({"news" : 0.5, "weather" : 0.5, "covid" : 0.5})
+
+    try:
+        start = time.monotonic()
+        briefing = assemble_briefing(time.localtime(), True, True)
+        elapsed = time.monotonic() - start
+    finally:
+        restore()
+
+    #one after another this would be at least 1.5 seconds
+    assert elapsed < 1.2
+    assert briefing["news"].startswith("<b>Top news headlines :</b><br>")
+    assert briefing["weather"].startswith("<b>Weather :</b><br>Weather in Exeter")
+    assert briefing["covid"].startswith("Daily COVID-19 case increase in ")
+    assert briefing["covid"].endswith(" was 25 on " +
+        (datetime.date.today() - datetime.timedelta(days = 1)).strftime("%d-%m-%Y") +
+        ", down 11 from the previous day.")
+
+def test_assemble_briefing_timeout():
+    """Tests that a slow source only costs its own timeout
+    """
+    server, restore = start_stub_upstream({"news" : 3})
+    timeouts = COVID_briefing_application.fetch_timeouts
+    original_timeout = timeouts["news"]
+    timeouts["news"] = 0.5
+
+    try:
+        start = time.monotonic()
+        briefing = assemble_briefing(time.localtime(), True, True)
+        elapsed = time.monotonic() - start
+    finally:
+        timeouts["news"] = original_timeout
+        restore()
+
+    assert elapsed < 2
+    assert briefing["news"].startswith("Timed out")
+    assert briefing["weather"].startswith("<b>Weather :</b><br>Weather in Exeter")
+
+def test_briefing_fetches_are_cached():
+    """Tests that briefings close together share upstream responses
+    """
+    server, restore = start_stub_upstream({})
+
+    try:
+        first = assemble_briefing(time.localtime(), True, True)
+        requests_after_first = len(server.requests)
+        second = assemble_briefing(time.localtime(), True, True)
+    finally:
+        restore()
+
+    assert first == second
+    assert requests_after_first > 0
+    assert len(server.requests) == requests_after_first
+
+def test_stale_briefings_while_sources_are_down():
+    """Tests that the last good content is served, marked as stale,
+    while sources fail, and that open circuits stop requests
+    """
+    server, restore = start_stub_upstream({})
+    breakers = COVID_briefing_application.circuit_breakers
+    thresholds = {source : breaker.failure_threshold for source, breaker in breakers.items()}
+
+    try:
+        fresh = assemble_briefing(time.localtime(), True, True)
+
+        #every source now fails, and cached content has expired
+        server.error_rates = {"news" : 1, "weather" : 1, "covid" : 1}
+        #not one of the statuses the HTTP client retries
+        server.error_status = 501
+        for breaker in breakers.values():
+            breaker.failure_threshold = 1
+        with COVID_briefing_application.upstream_cache.lock:
+            for key, entry in list(COVID_briefing_application.upstream_cache.entries.items()):
+                COVID_briefing_application.upstream_cache.entries[key] = (0, entry[1])
+        for series in COVID_briefing_application.covid_series.regions.values():
+            series.fetched_at = 0
+
+        tomorrow = time.localtime(time.time() + 24 * 3600)
+        stale = assemble_briefing(time.localtime(), True, True)
+        covid = get_day_infection_rate(tomorrow)
+        requests_while_open = len(server.requests)
+        again = assemble_briefing(time.localtime(), True, True)
+    finally:
+        for source, breaker in breakers.items():
+            breaker.failure_threshold = thresholds[source]
+        restore()
+
+    stale_notice = COVID_briefing_application.STALE_NOTICE
+    assert stale_notice not in fresh["news"]
+    assert stale["news"].startswith(fresh["news"]) and stale_notice in stale["news"]
+    assert stale["weather"].startswith(fresh["weather"]) and stale_notice in stale["weather"]
+    assert covid.startswith("Daily COVID-19 case increase in ") and stale_notice in covid
+    assert again == stale
+    assert len(server.requests) == requests_while_open
+    assert all(breaker.state == "closed" for breaker in breakers.values())
+
+def test_unknown_city_does_not_open_circuit():
+    """Tests alarms for a city the weather API doesn't know don't stop
+    weather being fetched for other cities
+    """
+    server, restore = start_stub_upstream({})
+    server.unknown_places.add("Atlantis")
+
+    try:
+        for i in range(6):
+            assert get_day_weather(time.localtime(), "Atlantis").startswith("Error in retrieving data")
+        exeter = get_day_weather(time.localtime(), "Exeter,uk")
+        state = COVID_briefing_application.circuit_breakers["weather"].state
+    finally:
+        restore()
+
+    assert exeter.startswith("<b>Weather :</b><br>Weather in Exeter is ")
+    assert state == "closed"
+
+def test_upstream_query_is_escaped():
+    """Tests cities and countries given with alarms can't add or
+    replace parameters of upstream requests
+    """
+    server, restore = start_stub_upstream({})
+
+    try:
+        weather = get_day_weather(time.localtime(), "Paris&appid=ATTACKER#")
+        get_day_news(time.localtime(), "fr&q=anything")
+    finally:
+        restore()
+
+    queries = {path.split("?")[0] : parse_qs(path.split("?", 1)[1]) for path in server.requests}
+    keys = COVID_briefing_application.keys
+    assert queries["/weather"] == {"q" : ["Paris&appid=ATTACKER#"], "appid" : [keys["weather"]]}
+    assert queries["/news"] == {"country" : ["fr&q=anything"], "apiKey" : [keys["news"]]}
+    assert "Weather in Paris&appid=ATTACKER#" in weather
+
+def test_historical_infection_rates_use_series():
+    """Tests that figures for many days come from one series request
+    """
+    server, restore = start_stub_upstream({})
+
+    try:
+        texts = [get_day_infection_rate(time.localtime(time.time() - days * 24 * 3600))
+                for days in range(20)]
+    finally:
+        restore()
+
+    assert all(text.startswith("Daily COVID-19 case increase in ") for text in texts)
+    #one page of data, then the empty page that ends it
+    assert len(server.requests) == 2
+
+def test_fetch_briefings_batches_by_place():
+    """Tests that briefings in one wave fetch each region, city and country once
+    """
+    server, restore = start_stub_upstream({})
+    today = time.localtime()
+    exeter = {"date" : today, "region" : "Exeter", "city" : "Exeter,uk",
+              "country" : "gb", "weather" : True, "news" : True}
+    kent = {"date" : today, "region" : "Kent", "city" : "Paris",
+            "country" : "fr", "weather" : True, "news" : False}
+    kent_covid_only = dict(kent, weather = False)
+
+    try:
+        briefings = fetch_briefings([exeter, kent, exeter, kent_covid_only])
+    finally:
+        restore()
+
+    assert briefings[0] == briefings[2]
+    assert "in Kent" in briefings[1]["covid"]
+    assert briefings[1]["news"] == ""
+    assert briefings[3]["weather"] == ""
+
+    paths = sorted(server.paths())
+    #a series (two pages) for each region, weather for each city, news for one country
+    assert paths == ["/covid"] * 4 + ["/news"] + ["/weather"] * 2
+
+def test_scheduled_alarms_ring_in_waves():
+    """Tests that an alarm firing rings other due alarms with it
+    """
+    application = COVID_briefing_application
+    application.repository.reset()
+    server, restore = start_stub_upstream({})
+    due = time.time() + 3600
+    alarms = [{"title" : "wave" + str(i) + " (ID : " + str(i) + ")", "id" : str(i),
+               "content" : "content", "time" : time.strftime("%Y-%m-%dT%H:%M", time.localtime(due)),
+               "fire_at" : due} for i in range(3)]
+
+    try:
+        for alarm in alarms:
+            application.repository.add_alarm(alarm)
+            schedule_alarm(alarm)
+        #the last alarm is outside the wave
+        application.unschedule_alarm("2")
+        alarms[2]["fire_at"] = due + 3600
+        schedule_alarm(alarms[2])
+
+        #the first two are an hour away, so the wave has to reach that far
+        original_wave_seconds = application.ring_wave_seconds
+        application.ring_wave_seconds = 3660
+        try:
+            generation = application.scheduled_alarms["0"][0]
+            application.ring_scheduled_alarm("0", generation)
+        finally:
+            application.ring_wave_seconds = original_wave_seconds
+    finally:
+        restore()
+
+    rung = sorted(alarm["title"] for alarm in application.repository.undismissed_alarms())
+    assert rung == ["wave0 (ID : 0)", "wave1 (ID : 1)"]
+    assert [alarm["title"] for alarm in application.repository.upcoming_alarms()] == ["wave2 (ID : 2)"]
+    assert "1" not in application.scheduled_alarms
+
+    application.unschedule_alarm("2")
+    reset_persistent_data()
+
+def test_alarms_are_prefetched():
+    """Tests that an alarm's briefing is fetched before it rings,
+    so ringing makes no upstream requests
+    """
+    application = COVID_briefing_application
+    application.repository.reset()
+    server, restore = start_stub_upstream({})
+    fire_at = time.time() + 60
+    alarm = {"title" : "prefetch (ID : 0)", "id" : "0", "fire_at" : fire_at,
+             "content" : "Alarm will notify of COVID-19 infection rate, weather and news",
+             "time" : time.strftime("%Y-%m-%dT%H:%M", time.localtime(fire_at))}
+    prefetches = application.scheduler_stats["prefetches"]
+
+    try:
+        application.repository.add_alarm(alarm)
+        #within prefetch_lead_seconds, so fetched straight away
+        schedule_alarm(alarm)
+        deadline = time.monotonic() + 5
+        while application.scheduler_stats["prefetches"] == prefetches and time.monotonic() < deadline:
+            time.sleep(0.05)
+        requests_before_ring = len(server.requests)
+
+        alarm_ring(alarm["title"])
+    finally:
+        restore()
+
+    assert application.scheduler_stats["prefetches"] == prefetches + 1
+    assert requests_before_ring > 0
+    assert len(server.requests) == requests_before_ring
+    content = application.repository.undismissed_alarms()[0]["content"]
+    assert "Weather in Exeter" in content and "headline" in content
+
+    reset_persistent_data()
+
+def test_index_etag():
+    """Tests unchanged pages are answered with 304 Not Modified
+    """
+    repository = COVID_briefing_application.repository
+    repository.reset()
+    repository.add_notification({"title" : "etag_test", "content" : "<b>content</b>"})
+
+    client = COVID_briefing_application.app.test_client()
+    response = client.get("/index")
+    assert response.status_code == 200
+    assert b"<b>content</b>" in response.data
+    etag = response.headers["ETag"]
+
+    response = client.get("/index", headers = {"If-None-Match" : etag})
+    assert response.status_code == 304
+
+    del_notif("etag_test")
+    response = client.get("/index", headers = {"If-None-Match" : etag})
+    assert response.status_code == 200
+    assert b"etag_test" not in response.data
+
+    reset_persistent_data()
+
+def test_json_api():
+    """Tests alarms and notifications can be created, listed and
+    dismissed through the JSON API, and changes are published
+    """
+    application = COVID_briefing_application
+    application.repository.reset()
+    subscription = application.event_broadcaster.subscribe()
+    client = application.app.test_client()
+
+    response = client.post("/api/alarms", json = {"time" : "2500-01-01T08:00",
+                                                  "label" : "api_test", "news" : True})
+    assert response.status_code == 201
+    title = response.get_json()["alarm"]["title"]
+    assert title.startswith("api_test")
+    assert client.post("/api/alarms", json = {"label" : "no time"}).status_code == 400
+
+    alarms = client.get("/api/alarms").get_json()
+    assert [alarm["title"] for alarm in alarms["upcoming"]] == [title]
+    assert alarms["undismissed"] == []
+
+    application.repository.add_notification({"title" : "api_notif", "content" : "content"})
+    assert client.get("/api/notifications").get_json()["notifications"][0]["title"] == "api_notif"
+    assert client.delete("/api/notifications/api_notif").status_code == 200
+    assert client.delete("/api/notifications/api_notif").status_code == 404
+
+    assert client.delete("/api/alarms/" + title).status_code == 200
+    assert client.get("/api/alarms").get_json()["upcoming"] == []
+
+    events = []
+    while not subscription.events.empty():
+        events.append(subscription.events.get_nowait())
+    application.event_broadcaster.unsubscribe(subscription)
+
+    changes = [json.loads(event.split("data: ")[1]) for event in events]
+    assert [(change["kind"], change["state"]) for change in changes] == [
+        ("alarm", "upcoming"), ("notification", "deleted"), ("alarm", "deleted")]
+    assert "api_test" in changes[0]["html"]
+
+    reset_persistent_data()
+
+def test_covid_cases_export():
+    """Tests a region's daily cases are streamed as CSV and NDJSON
+    over a range of days, from one series request
+    """
+    server, restore = start_stub_upstream({})
+    client = COVID_briefing_application.app.test_client()
+    today = datetime.date.today()
+    start = (today - datetime.timedelta(days = 5)).isoformat()
+    end = (today - datetime.timedelta(days = 2)).isoformat()
+
+    try:
+        csv_response = client.get("/api/covid-cases?region=Exeter&start=" + start + "&end=" + end)
+        ndjson_response = client.get("/api/covid-cases?region=Exeter&format=ndjson")
+        bad_date = client.get("/api/covid-cases?start=yesterday")
+        bad_format = client.get("/api/covid-cases?format=xml")
+    finally:
+        restore()
+
+    assert csv_response.mimetype == "text/csv"
+    assert csv_response.is_streamed
+    assert csv_response.get_data(as_text = True).splitlines() == [
+        "date,cases,change",
+        start + ",69,-11",
+        (today - datetime.timedelta(days = 4)).isoformat() + ",58,-11",
+        (today - datetime.timedelta(days = 3)).isoformat() + ",47,-11",
+        end + ",36,-11"]
+
+    rows = [json.loads(line) for line in ndjson_response.get_data(as_text = True).splitlines()]
+    assert len(rows) == 29
+    assert rows[0]["change"] is None
+    assert rows[-1] == {"region" : "Exeter", "date" : (today - datetime.timedelta(days = 1)).isoformat(),
+                        "cases" : 25, "change" : -11}
+
+    assert bad_date.status_code == 400
+    assert bad_format.status_code == 400
+    #one page of data, then the empty page that ends it
+    assert len(server.requests) == 2
+
+def test_unknown_region():
+    """Tests an area the PHE API has no figures for is answered as
+    unavailable, without being held
+    """
+    server, restore = start_stub_upstream({})
+    server.unknown_places.add("Atlantis")
+    client = COVID_briefing_application.app.test_client()
+
+    try:
+        export = client.get("/api/covid-cases?region=Atlantis")
+        infection_rate = get_day_infection_rate(time.localtime(), "Atlantis")
+    finally:
+        restore()
+
+    assert export.status_code == 404
+    assert infection_rate == ("COVID-19 infection data for Atlantis" +
+                              " unavailable through PHE database for given date")
+    assert "Atlantis" not in COVID_briefing_application.covid_series.regions
+    #the second lookup knew the area was unknown
+    assert len(server.requests) == 1
+
+def test_metrics_endpoint():
+    """Tests /metrics reports request timings, cache and scheduler figures
+    """
+    client = COVID_briefing_application.app.test_client()
+    client.get("/index")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text = True)
+
+    assert 'briefing_request_seconds_count{handler="index"}' in text
+    assert 'briefing_render_cache_total{result="page_hits"}' in text
+    assert "briefing_scheduler_queue_depth " in text
+    assert "# TYPE briefing_upstream_errors_total counter" in text
+
+def test_import_is_lazy(tmp_path):
+    """Tests importing the app reads and writes no files and leaves the
+    heavy dependencies to be loaded when first used
+    """
+    project_folder = os.path.dirname(os.path.abspath(COVID_briefing_application.__file__))
+    environment = dict(os.environ, PYTHONPATH = project_folder)
+
+    #no config.json in tmp_path, so importing fails if it is read
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import COVID_briefing_application"],
+                            cwd = str(tmp_path), env = environment,
+                            capture_output = True, text = True)
+    assert result.returncode == 0, result.stderr
+
+    imported = set(line.split("|")[-1].strip() for line in result.stderr.splitlines()
+                   if line.startswith("import time:"))
+    assert "COVID_briefing_application" in imported
+    for module in ("requests", "urllib3", "pyttsx3", "uk_covid19"):
+        assert module not in imported
+    assert os.listdir(str(tmp_path)) == []
+
+def test_create_app_starts_scheduler(tmp_path):
+    """Tests create_app(start=True), as a WSGI server calls it, starts
+    the scheduler before any request is served
+    """
+    project_folder = os.path.dirname(os.path.abspath(COVID_briefing_application.__file__))
+    environment = dict(os.environ, PYTHONPATH = project_folder)
+    shutil.copy(TEST_CONFIG_PATH, str(tmp_path / "config.json"))
+
+    result = subprocess.run([sys.executable, "-c",
+                             "import COVID_briefing_application as application\n"
+                             "application.create_app()\n"
+                             "assert application.scheduler_thread is None\n"
+                             "application.create_app(start = True)\n"
+                             "assert application.scheduler_thread.is_alive()\n"
+                             "assert not application.app.before_first_request_funcs\n"],
+                            cwd = str(tmp_path), env = environment,
+                            capture_output = True, text = True)
+    assert result.returncode == 0, result.stderr
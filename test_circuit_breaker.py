@@ -0,0 +1,102 @@
+import time
+from circuit_breaker import CircuitBreaker
+from circuit_breaker import CircuitOpenError
+from circuit_breaker import is_source_failure
+
+class FakeHTTPError(Exception):
+    """Stands in for requests.HTTPError, which carries its response
+    """
+
+    def __init__(self, status_code : int):
+        super().__init__(str(status_code))
+        self.response = type("Response", (), {"status_code" : status_code})()
+
+def test_circuit_opens_and_recovers():
+    """Tests calls fail fast once the threshold is reached, and that a
+    trial call after probe_interval closes the circuit when the source
+    works again
+    """
+    breaker = CircuitBreaker("news", failure_threshold = 2, probe_interval = 0.05)
+    source = {"up" : False, "calls" : 0}
+
+    def fetch():
+        source["calls"] += 1
+        if not source["up"]:
+            raise ConnectionError("down")
+        return "headlines"
+
+    for i in range(2):
+        try:
+            breaker.call(fetch)
+            assert False
+        except ConnectionError:
+            pass
+    assert breaker.state == "open"
+
+    calls = source["calls"]
+    try:
+        breaker.call(fetch)
+        assert False
+    except CircuitOpenError:
+        pass
+    assert source["calls"] == calls
+    assert breaker.stats["rejected"] == 1
+
+    #a failed trial keeps it open for another interval
+    time.sleep(0.06)
+    try:
+        breaker.call(fetch)
+        assert False
+    except ConnectionError:
+        pass
+    assert breaker.state == "open"
+    assert source["calls"] == calls + 1
+
+    source["up"] = True
+    time.sleep(0.06)
+    assert breaker.call(fetch) == "headlines"
+    assert breaker.state == "closed"
+    assert breaker.stats["trials"] == 2
+
+def test_success_resets_failures():
+    """Tests only failures in a row open the circuit
+    """
+    breaker = CircuitBreaker("weather", failure_threshold = 2)
+
+    def fail():
+        raise ValueError("bad")
+
+    for i in range(3):
+        try:
+            breaker.call(fail)
+        except ValueError:
+            pass
+        assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+    breaker.failures = 1
+    breaker.reset()
+    assert breaker.failures == 0
+
+def test_client_errors_are_not_failures():
+    """Tests 4xx responses (other than 429) don't open the circuit,
+    as the source answered
+    """
+    assert not is_source_failure(FakeHTTPError(404))
+    assert not is_source_failure(FakeHTTPError(401))
+    assert is_source_failure(FakeHTTPError(429))
+    assert is_source_failure(FakeHTTPError(503))
+    assert is_source_failure(TimeoutError())
+
+    breaker = CircuitBreaker("weather", failure_threshold = 2)
+
+    def not_found():
+        raise FakeHTTPError(404)
+
+    for i in range(5):
+        try:
+            breaker.call(not_found)
+        except FakeHTTPError:
+            pass
+    assert breaker.state == "closed"
+    assert breaker.call(lambda: "Exeter") == "Exeter"
@@ -0,0 +1,169 @@
+import os
+import datetime
+from covid_data import CovidSeries
+from covid_data import CovidSeriesStore
+from covid_data import fetch_region_series
+from covid_data import MAX_SERIES_PAGES
+from covid_data import UnknownRegionError
+
+API_DATA = [
+    {"date" : "2020-11-10", "newCasesByPublishDate" : 25},
+    {"date" : "2020-11-09", "newCasesByPublishDate" : 36},
+    {"date" : "2020-11-09", "newCasesByPublishDate" : None},
+    {"date" : "2020-11-07", "newCasesByPublishDate" : 12},
+]
+
+def test_covid_series():
+    """Tests figures and changes are answered from a series
+    """
+    series = CovidSeries.from_api_data("Exeter", API_DATA)
+
+    assert len(series) == 3
+    assert series.last_day() == datetime.date(2020, 11, 10)
+    assert series.cases_on(datetime.date(2020, 11, 10)) == 25
+    assert series.cases_on(datetime.date(2020, 11, 8)) is None
+    assert series.change_on(datetime.date(2020, 11, 10)) == -11
+    assert series.change_on(datetime.date(2020, 11, 9)) is None
+
+    rows = list(series.iter_range(datetime.date(2020, 11, 1), datetime.date(2020, 11, 9)))
+    assert rows == [(datetime.date(2020, 11, 7), 12, None),
+                    (datetime.date(2020, 11, 9), 36, None)]
+
+def test_covid_series_save_load(tmp_path):
+    """Tests a saved series loads back the same
+    """
+    path = str(tmp_path / "Exeter.json")
+    series = CovidSeries.from_api_data("Exeter", API_DATA)
+    series.save(path)
+
+    loaded = CovidSeries.load(path)
+    assert list(loaded.days) == list(series.days)
+    assert list(loaded.cases) == list(series.cases)
+    assert loaded.fetched_at == series.fetched_at
+
+def test_covid_series_store(tmp_path):
+    """Tests that a series is only fetched again for days it doesn't cover
+    """
+    fetches = []
+
+    def fetch(region):
+        fetches.append(region)
+        return CovidSeries.from_api_data(region, API_DATA)
+
+    store = CovidSeriesStore(fetch, refresh_interval = 3600, folder = str(tmp_path))
+
+    store.series("Exeter", datetime.date(2020, 11, 10))
+    store.series("Exeter", datetime.date(2020, 11, 1))
+    assert fetches == ["Exeter"]
+
+    #not published yet, but fetched recently
+    store.series("Exeter", datetime.date(2020, 11, 11))
+    assert fetches == ["Exeter"]
+
+    store.refresh_interval = 0
+    store.series("Exeter", datetime.date(2020, 11, 11))
+    assert fetches == ["Exeter", "Exeter"]
+
+    #loaded from disk after a restart
+    restarted = CovidSeriesStore(fetch, refresh_interval = 3600, folder = str(tmp_path))
+    assert restarted.series("Exeter", datetime.date(2020, 11, 10)).cases_on(
+        datetime.date(2020, 11, 10)) == 25
+    assert fetches == ["Exeter", "Exeter"]
+
+def test_covid_series_store_unreadable_file(tmp_path):
+    """Tests a series file cut short is fetched again rather than
+    failing every lookup
+    """
+    fetches = []
+
+    def fetch(region):
+        fetches.append(region)
+        return CovidSeries.from_api_data(region, API_DATA)
+
+    store = CovidSeriesStore(fetch, refresh_interval = 3600, folder = str(tmp_path))
+    with open(store.series_path("Exeter"), "w") as f:
+        f.write('{"region" : "Exe')
+
+    assert store.series("Exeter", datetime.date(2020, 11, 10)).cases_on(
+        datetime.date(2020, 11, 10)) == 25
+    assert fetches == ["Exeter"]
+
+    restarted = CovidSeriesStore(fetch, refresh_interval = 3600, folder = str(tmp_path))
+    assert len(restarted.series("Exeter", datetime.date(2020, 11, 10))) == 3
+    assert fetches == ["Exeter"]
+
+def test_covid_series_store_bounded(tmp_path):
+    """Tests only max_regions series are held, the least recently used
+    being dropped, and areas without figures are neither held nor saved
+    """
+    fetches = []
+
+    def fetch(region):
+        fetches.append(region)
+        return CovidSeries.from_api_data(region, [] if region == "Atlantis" else API_DATA)
+
+    store = CovidSeriesStore(fetch, refresh_interval = 3600, folder = str(tmp_path),
+                             max_regions = 2)
+    day = datetime.date(2020, 11, 10)
+
+    store.series("Exeter", day)
+    store.series("Leeds", day)
+    store.series("Exeter", day)
+    store.series("York", day)
+    assert list(store.regions) == ["Exeter", "York"]
+    assert set(store.region_locks) <= {"Exeter", "York"}
+
+    for attempt in range(3):
+        try:
+            store.series("Atlantis", day)
+            assert False, "Atlantis has no figures"
+        except UnknownRegionError:
+            pass
+    #remembered as unknown until refresh_interval has passed
+    assert fetches.count("Atlantis") == 1
+    assert "Atlantis" not in store.regions
+    assert "Atlantis" not in store.region_locks
+    assert not os.path.exists(store.series_path("Atlantis"))
+
+class PagedClient:
+    """Answers PHE API requests with the page bodies given, in order,
+    and the last body for every later page
+    """
+
+    def __init__(self, bodies : list):
+        self.bodies = bodies
+        self.pages = []
+
+    def get(self, url : str, params : dict = None):
+        self.pages.append(params["page"])
+        return PagedResponse(self.bodies[min(len(self.pages), len(self.bodies)) - 1])
+
+class PagedResponse:
+    status_code = 200
+
+    def __init__(self, body : dict):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self) -> dict:
+        return self.body
+
+def test_fetch_region_series_stops_paging():
+    """Tests paging stops at an empty page, a page without a next
+    page, or the page limit, as well as at a 204
+    """
+    rows = API_DATA[:2]
+
+    client = PagedClient([{"data" : rows}, {"data" : []}])
+    assert len(fetch_region_series("Exeter", client)) == 2
+    assert client.pages == [1, 2]
+
+    client = PagedClient([{"data" : rows, "pagination" : {"current" : 1, "next" : None}}])
+    assert len(fetch_region_series("Exeter", client)) == 2
+    assert client.pages == [1]
+
+    client = PagedClient([{"data" : rows, "pagination" : {"next" : "/v1/data?page=2"}}])
+    assert len(fetch_region_series("Exeter", client)) == 2
+    assert client.pages == list(range(1, MAX_SERIES_PAGES + 1))
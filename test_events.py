@@ -0,0 +1,43 @@
+import json
+from events import EventBroadcaster
+from events import format_event
+
+def test_format_event():
+    """Tests events are formatted as text/event-stream
+    """
+    assert format_event("alarm", {"a" : 1}, 3) == 'event: alarm\nid: 3\ndata: {"a": 1}\n\n'
+    assert format_event("resync", {}) == "event: resync\ndata: {}\n\n"
+
+def test_publish_and_stream():
+    """Tests published events reach every subscription, in order
+    """
+    broadcaster = EventBroadcaster()
+    first = broadcaster.subscribe()
+    second = broadcaster.subscribe()
+    assert broadcaster.subscriber_count() == 2
+
+    broadcaster.publish("alarm", {"n" : 1})
+    broadcaster.publish("alarm", {"n" : 2})
+
+    stream = broadcaster.stream(first, keepalive = 0.01)
+    assert next(stream).startswith("retry:")
+    assert json.loads(next(stream).split("data: ")[1]) == {"n" : 1}
+    assert json.loads(next(stream).split("data: ")[1]) == {"n" : 2}
+    assert next(stream) == ": keepalive\n\n"
+    assert second.events.qsize() == 2
+
+    stream.close()
+    assert broadcaster.subscriber_count() == 1
+
+def test_lagging_subscription_resyncs():
+    """Tests a full subscription is told to resync instead of blocking publishers
+    """
+    broadcaster = EventBroadcaster(max_pending = 2)
+    subscription = broadcaster.subscribe()
+
+    for n in range(3):
+        broadcaster.publish("notification", {"n" : n})
+
+    assert subscription.events.qsize() == 1
+    assert subscription.events.get_nowait().startswith("event: resync")
+    assert broadcaster.stats["resyncs"] == 1
@@ -0,0 +1,57 @@
+import time
+import requests
+from fake_upstream import FakeUpstream
+from fake_upstream import parse_source_values
+
+def test_fake_upstream_answers_like_sources():
+    """Tests each source answers with the fields the app reads
+    """
+    server = FakeUpstream().start()
+    try:
+        news = requests.get(server.base_url + "/news", params = {"country" : "gb"}).json()
+        weather = requests.get(server.base_url + "/weather", params = {"q" : "Paris,fr"}).json()
+        covid = requests.get(server.base_url + "/covid", params = {"page" : 1}).json()
+        next_page = requests.get(server.base_url + "/covid", params = {"page" : 2})
+    finally:
+        server.stop()
+
+    assert news["status"] == "ok" and len(news["articles"]) == 3
+    assert weather["name"] == "Paris"
+    assert covid["data"][0]["newCasesByPublishDate"] == 25
+    assert next_page.status_code == 204
+    assert server.paths() == ["/news", "/weather", "/covid", "/covid"]
+
+def test_fake_upstream_latency_and_errors():
+    """Tests latency and injected errors are applied per source
+    """
+    server = FakeUpstream(latency = {"weather" : 0.3}, error_rates = {"news" : 1}).start()
+    try:
+        start = time.monotonic()
+        weather = requests.get(server.base_url + "/weather")
+        elapsed = time.monotonic() - start
+        news = requests.get(server.base_url + "/news")
+    finally:
+        server.stop()
+
+    assert weather.status_code == 200
+    assert elapsed >= 0.3
+    assert news.status_code == 500
+
+def test_fake_upstream_unknown_places():
+    """Tests places the real APIs don't know are answered as they would be
+    """
+    server = FakeUpstream(unknown_places = {"Atlantis"}).start()
+    try:
+        weather = requests.get(server.base_url + "/weather", params = {"q" : "Atlantis,uk"})
+        covid = requests.get(server.base_url + "/covid", params = {"filters" : "areaName=Atlantis",
+                                                                   "page" : 1})
+    finally:
+        server.stop()
+
+    assert weather.status_code == 404
+    assert covid.status_code == 204
+
+def test_parse_source_values():
+    """Tests command line source=value pairs are parsed
+    """
+    assert parse_source_values(["news=0.2", "covid=1"]) == {"news" : 0.2, "covid" : 1.0}
@@ -0,0 +1,104 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import requests
+from http_client import HTTPClient
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Fails the first server.failures requests with 503,
+    and sleeps server.delay seconds before answering
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.server.ports.add(self.client_address[1])
+        time.sleep(self.server.delay)
+
+        if self.server.requests <= self.server.failures:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_server(failures : int = 0, delay : float = 0):
+    """Starts a FlakyHandler server, returns it and its URL
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    server.requests = 0
+    server.failures = failures
+    server.delay = delay
+    server.ports = set()
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server, "http://127.0.0.1:" + str(server.server_port) + "/"
+
+def test_http_client_retries():
+    """Tests that temporary failures are retried with backoff
+    """
+    server, url = start_server(failures = 2)
+    client = HTTPClient(retries = 2, backoff = 0.01)
+
+    response = client.get(url)
+
+    assert response.json() == {"status" : "ok"}
+    assert server.requests == 3
+    server.shutdown()
+
+def test_http_client_gives_up():
+    """Tests that retries are bounded, and errors are counted
+    """
+    server, url = start_server(failures = 10)
+    client = HTTPClient(retries = 1, backoff = 0.01)
+
+    response = client.get(url)
+
+    assert response.status_code == 503
+    assert server.requests == 2
+    host = url.split("/")[2]
+    assert client.stats()[host]["errors"] == 1
+    server.shutdown()
+
+def test_http_client_timeout():
+    """Tests that a hung upstream times out instead of blocking
+    """
+    server, url = start_server(delay = 2)
+    client = HTTPClient(read_timeout = 0.2, retries = 0)
+
+    start = time.monotonic()
+    try:
+        client.get(url)
+        assert False
+    except requests.RequestException:
+        pass
+
+    assert time.monotonic() - start < 1.5
+    server.shutdown()
+
+def test_http_client_keep_alive():
+    """Tests that connections are reused and latency is recorded
+    """
+    server, url = start_server()
+    client = HTTPClient()
+
+    for _ in range(5):
+        client.get(url)
+
+    assert len(server.ports) == 1
+    host = url.split("/")[2]
+    stats = client.stats()[host]
+    assert stats["requests"] == 5
+    assert stats["errors"] == 0
+    assert stats["average_seconds"] > 0
+    server.shutdown()
@@ -0,0 +1,30 @@
+from leader import LeaderLock
+from leader import SoleLeader
+
+def test_leader_lock(tmp_path):
+    """Tests only one holder of the lock file is leader at a time
+    """
+    path = str(tmp_path / "scheduler.lock")
+    first = LeaderLock(path)
+    second = LeaderLock(path)
+
+    assert first.try_acquire()
+    assert first.is_leader
+    assert not second.try_acquire()
+    assert not second.is_leader
+
+    first.release()
+    assert not first.is_leader
+    assert second.try_acquire()
+    second.release()
+
+def test_sole_leader():
+    """Tests a process with unshared storage always leads, even while
+    another holds the lock file
+    """
+    leader = SoleLeader()
+    assert not leader.is_leader
+    assert leader.try_acquire()
+    assert leader.is_leader
+    leader.release()
+    assert not leader.is_leader
@@ -0,0 +1,66 @@
+import json
+import queue
+import logging
+from logging_pipeline import start_logging
+from logging_pipeline import SamplingFilter
+from logging_pipeline import BoundedQueueHandler
+
+def make_record(message : str, level : int = logging.INFO) -> logging.LogRecord:
+    return logging.makeLogRecord({"msg" : message, "levelno" : level,
+                                  "levelname" : logging.getLevelName(level)})
+
+def test_start_logging_writes_json(tmp_path):
+    """Tests records reach the log file from the listener thread, as JSON
+    """
+    path = str(tmp_path / "program_log.log")
+    logger = logging.getLogger("test_logging_pipeline.json")
+    logger.propagate = False
+    listener = start_logging({"file" : path, "json" : True}, logging.INFO, logger)
+
+    logger.info("Alarm rang %s", "morning")
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        logger.exception("Error in Alarm ring")
+    listener.stop()
+
+    with open(path, "r") as f:
+        entries = [json.loads(line) for line in f]
+    assert entries[0]["message"] == "Alarm rang morning"
+    assert entries[1]["level"] == "ERROR"
+    assert "ValueError: bad" in entries[1]["exception"]
+
+def test_sampling_filter():
+    """Tests frequent messages are let through once per interval,
+    and warnings never sampled
+    """
+    sampling = SamplingFilter(("Alarms refreshed.",), interval = 60)
+
+    assert sampling.filter(make_record("Alarms refreshed."))
+    assert not sampling.filter(make_record("Alarms refreshed."))
+    assert sampling.filter(make_record("Alarm rang"))
+    assert sampling.filter(make_record("Alarms refreshed.", logging.WARNING))
+
+    sampling.seen["Alarms refreshed."][0] -= 60
+    record = make_record("Alarms refreshed.")
+    assert sampling.filter(record)
+    assert record.msg == "Alarms refreshed. (1 similar messages not logged)"
+
+def test_full_queue_drops_records():
+    """Tests a full queue drops records without blocking, and
+    reports how many were dropped once there is room
+    """
+    log_queue = queue.Queue(maxsize = 2)
+    handler = BoundedQueueHandler(log_queue)
+
+    for i in range(5):
+        handler.handle(make_record("record " + str(i)))
+    assert handler.dropped == 3
+
+    log_queue.get_nowait()
+    log_queue.get_nowait()
+    handler.handle(make_record("after"))
+
+    assert handler.dropped == 0
+    assert log_queue.get_nowait().getMessage() == "3 log records dropped while the log file was behind"
+    assert log_queue.get_nowait().getMessage() == "after"
@@ -0,0 +1,49 @@
+from metrics import MetricsRegistry
+
+def test_counter_and_callback_render():
+    """Tests counters and callback metrics are rendered with their labels
+    """
+    registry = MetricsRegistry()
+    errors = registry.counter("errors_total", "Errors", ("source",))
+    errors.inc(source = "news")
+    errors.inc(2, source = "news")
+    errors.inc(source = "weather \"x\"")
+    registry.callback("queue_depth", "Queue depth", lambda: 7)
+
+    text = registry.render()
+    assert "# TYPE errors_total counter" in text
+    assert 'errors_total{source="news"} 3' in text
+    assert 'errors_total{source="weather \\"x\\""} 1' in text
+    assert "# TYPE queue_depth gauge\nqueue_depth 7" in text
+    assert errors.value(source = "news") == 3
+
+def test_histogram_buckets():
+    """Tests histogram buckets are cumulative, with sum and count
+    """
+    registry = MetricsRegistry()
+    seconds = registry.histogram("request_seconds", "Seconds", ("handler",), buckets = (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        seconds.observe(value, handler = "index")
+
+    text = registry.render()
+    assert 'request_seconds_bucket{handler="index",le="0.1"} 2' in text
+    assert 'request_seconds_bucket{handler="index",le="1"} 3' in text
+    assert 'request_seconds_bucket{handler="index",le="+Inf"} 4' in text
+    assert 'request_seconds_sum{handler="index"} 3.65' in text
+    assert 'request_seconds_count{handler="index"} 4' in text
+
+def test_histogram_time():
+    """Tests timed functions are observed, including when they raise
+    """
+    registry = MetricsRegistry()
+    seconds = registry.histogram("call_seconds", "Seconds")
+
+    @seconds.time()
+    def fail():
+        raise ValueError()
+
+    try:
+        fail()
+    except ValueError:
+        pass
+    assert seconds.count() == 1
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+from persistence import ConfigWriter
+from persistence import atomic_write_json
+from persistence import append_archive
+
+def test_atomic_write_json(tmp_path):
+    """Tests atomic_write_json method
+    """
+    path = str(tmp_path / "config.json")
+
+    atomic_write_json(path, {"a" : 1})
+    atomic_write_json(path, {"a" : 2})
+
+    with open(path, "r") as f:
+        assert json.load(f) == {"a" : 2}
+
+    #temporary file has been renamed, not left behind
+    assert os.listdir(str(tmp_path)) == ["config.json"]
+
+def test_config_writer_batches_writes(tmp_path):
+    """Tests that many changes made close together are saved in one write
+    """
+    path = str(tmp_path / "config.json")
+    data = {"alarms" : []}
+    writer = ConfigWriter(path, data, interval = 0.2)
+
+    for i in range(1000):
+        data["alarms"].append(i)
+        writer.mark_dirty()
+
+    assert not os.path.exists(path)
+
+    time.sleep(1)
+
+    assert writer.writes == 1
+    with open(path, "r") as f:
+        assert len(json.load(f)["alarms"]) == 1000
+
+    writer.close()
+
+def test_config_writer_close(tmp_path):
+    """Tests that unsaved changes are written on close
+    """
+    path = str(tmp_path / "config.json")
+    data = {"value" : 0}
+    writer = ConfigWriter(path, data, interval = 60)
+
+    data["value"] = 1
+    writer.mark_dirty()
+    writer.close()
+
+    with open(path, "r") as f:
+        assert json.load(f)["value"] == 1
+
+def test_config_writer_discard(tmp_path):
+    """Tests that discarded changes aren't written
+    """
+    path = str(tmp_path / "config.json")
+    writer = ConfigWriter(path, {"value" : 0}, interval = 60)
+
+    writer.mark_dirty()
+    writer.discard()
+    writer.close()
+
+    assert not os.path.exists(path)
+
+def test_config_writer_before_write(tmp_path):
+    """Tests before_write is called to bring the document up to date before writing
+    """
+    path = str(tmp_path / "config.json")
+    data = {"alarms" : []}
+    writer = ConfigWriter(path, data, interval = 0,
+                          before_write = lambda: data.update(alarms = ["synced"]))
+
+    writer.mark_dirty()
+
+    with open(path, "r") as f:
+        assert json.load(f) == {"alarms" : ["synced"]}
+
+def test_config_writer_after_write(tmp_path):
+    """Tests after_write is given the seconds each write took
+    """
+    path = str(tmp_path / "config.json")
+    timings = []
+    writer = ConfigWriter(path, {"alarms" : []}, interval = 0, after_write = timings.append)
+
+    writer.mark_dirty()
+    writer.mark_dirty()
+
+    assert len(timings) == 2
+    assert all(seconds >= 0 for seconds in timings)
+
+def test_append_archive(tmp_path):
+    """Tests that archived records are appended, one JSON object per line
+    """
+    path = str(tmp_path / "archive.ndjson")
+    append_archive(path, [{"title" : "first"}])
+    append_archive(path, [{"title" : "second"}, {"title" : "third"}])
+
+    with open(path, "r") as f:
+        titles = [json.loads(line)["title"] for line in f]
+    assert titles == ["first", "second", "third"]
@@ -0,0 +1,45 @@
+from flask import Flask
+from rendering import RenderCache
+from storage import JSONRepository
+
+def make_cache() -> tuple:
+    """Returns a RenderCache using the app's templates, and an empty repository
+    """
+    repository = JSONRepository({"ID-value" : 0, "notifications" : [],
+                                 "undismissed_alarms" : [], "upcoming_alarms" : []},
+                                lambda: None)
+    return RenderCache(Flask(__name__).jinja_env), repository
+
+def test_fragment_rendered_once():
+    """Tests fragments are reused until an item's content changes
+    """
+    cache, repository = make_cache()
+    alarm = {"title" : "alarm <1>", "content" : "<b>bold</b>"}
+
+    fragment = cache.fragment("alarm", alarm)
+    assert "alarm &lt;1&gt;" in fragment
+    assert "<b>bold</b>" in fragment
+    assert 'name=alarm_item' in fragment
+    assert cache.fragment("alarm", alarm) is fragment
+
+    alarm["content"] = "changed"
+    assert "changed" in cache.fragment("alarm", alarm)
+    assert cache.stats["fragment_renders"] == 2
+    assert 'name=notif' in cache.fragment("notification", alarm)
+
+def test_page_rendered_once_per_version():
+    """Tests the page is only rendered again after the repository changes
+    """
+    cache, repository = make_cache()
+    repository.add_notification({"title" : "notif", "content" : "hello"})
+
+    body, etag = cache.render_page(repository, title = "title", image = "icon.png")
+    assert "hello" in body
+    assert cache.render_page(repository, title = "title", image = "icon.png") == (body, etag)
+    assert cache.stats["page_renders"] == 1
+
+    repository.add_alarm({"title" : "alarm", "content" : "upcoming", "id" : "0"})
+    new_body, new_etag = cache.render_page(repository, title = "title", image = "icon.png")
+    assert "upcoming" in new_body
+    assert new_etag != etag
+    assert cache.stats["page_renders"] == 2
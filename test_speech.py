@@ -0,0 +1,61 @@
+import time
+import threading
+from speech import SpeechWorker
+from speech import RecordingEngine
+from speech import NullEngine
+
+def test_speech_worker_speaks():
+    """Tests that queued announcements are spoken by one engine
+    """
+    engines = []
+
+    def factory():
+        engines.append(RecordingEngine())
+        return engines[-1]
+
+    worker = SpeechWorker(factory)
+    worker.say("alarm 1")
+    worker.say("alarm 2")
+
+    assert worker.wait_until_idle(5)
+    assert len(engines) == 1
+    assert engines[0].spoken == ["alarm 1", "alarm 2"]
+    worker.stop()
+
+class SlowEngine(NullEngine):
+    """Engine that takes a while to say anything, until released
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def runAndWait(self):
+        self.release.wait(5)
+
+def test_speech_worker_backpressure():
+    """Tests that say doesn't wait, and that announcements are
+    coalesced or dropped when they pile up
+    """
+    engine = SlowEngine()
+    worker = SpeechWorker(lambda: engine, max_pending = 2)
+
+    start = time.monotonic()
+    worker.say("speaking")
+    #wait for the worker to start on the first announcement
+    while worker.pending:
+        time.sleep(0.01)
+
+    worker.say("alarm 1")
+    worker.say("alarm 1")
+    worker.say("alarm 2")
+    worker.say("alarm 3")
+    assert time.monotonic() - start < 1
+
+    assert list(worker.pending) == ["alarm 2", "alarm 3"]
+    assert worker.stats["coalesced"] == 1
+    assert worker.stats["dropped"] == 1
+
+    engine.release.set()
+    assert worker.wait_until_idle(5)
+    assert worker.stats["spoken"] == 3
+    worker.stop()
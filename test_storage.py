@@ -0,0 +1,314 @@
+import time
+import threading
+from storage import AlarmExistsError
+from storage import JSONRepository
+from storage import SQLiteRepository
+from storage import open_repository
+
+def empty_data() -> dict:
+    """Returns an empty "persistent-data" section
+    """
+    return {"ID-value" : 0, "notifications" : [],
+            "undismissed_alarms" : [], "upcoming_alarms" : []}
+
+def check_repository(repository):
+    """Runs the same checks against any repository
+    """
+    alarm1 = {"title" : "alarm1 (ID : 0)", "content" : "content", "id" : "0",
+              "time" : "2500-02-20T21:03", "fire_at" : 16725.0}
+    alarm2 = {"title" : "alarm2 (ID : 1)", "content" : "content", "id" : "1",
+              "time" : "2400-02-20T21:03", "fire_at" : 1.0}
+
+    assert repository.current_alarm_id() == "0"
+    repository.add_alarm(alarm1)
+    repository.add_alarm(alarm2)
+    assert repository.current_alarm_id() == "2"
+    assert len(repository.upcoming_alarms()) == 2
+
+    rung = repository.pop_upcoming_alarm("alarm1 (ID : 0)")
+    assert rung["title"] == "alarm1 (ID : 0)"
+    assert repository.pop_upcoming_alarm("alarm1 (ID : 0)") is None
+
+    rung["content"] = "rang"
+    repository.add_undismissed_alarm(rung)
+    assert repository.has_undismissed_alarm("alarm1 (ID : 0)")
+    assert repository.undismissed_alarms()[0]["content"] == "rang"
+
+    deleted = repository.delete_alarm("alarm1 (ID : 0)")
+    assert [alarm["title"] for alarm in deleted] == ["alarm1 (ID : 0)"]
+    assert repository.undismissed_alarms() == []
+
+    repository.add_notification({"title" : "notif", "content" : "content"})
+    assert repository.has_notification("notif")
+    assert repository.delete_notification("notif")["title"] == "notif"
+    assert repository.delete_notification("notif") is None
+    assert repository.notifications() == []
+
+    repository.reset()
+    assert repository.upcoming_alarms() == []
+    assert repository.current_alarm_id() == "0"
+
+def check_bulk_ring(repository):
+    """Checks a wave of alarms is taken and put back as one change each
+    """
+    for i in range(5):
+        repository.add_alarm({"title" : "alarm" + str(i), "content" : "content", "id" : str(i),
+                              "time" : "2500-02-20T21:03", "fire_at" : 16725.0})
+
+    version = repository.version
+    popped = repository.pop_upcoming_alarms(["alarm0", "missing", "alarm2", "alarm4"])
+    assert [alarm["title"] for alarm in popped] == ["alarm0", "alarm2", "alarm4"]
+    assert repository.version == version + 1
+    assert repository.pop_upcoming_alarms(["alarm0"]) == []
+    assert repository.version == version + 1
+
+    repository.add_undismissed_alarms(popped)
+    assert repository.version == version + 2
+    assert sorted(alarm["title"] for alarm in repository.undismissed_alarms()) == \
+        ["alarm0", "alarm2", "alarm4"]
+    assert len(repository.upcoming_alarms()) == 2
+
+def check_compact(repository):
+    """Runs the same retention checks against any repository
+    """
+    for i in range(4):
+        repository.add_notification({"title" : "notif" + str(i), "content" : "content"})
+        repository.add_undismissed_alarm({"title" : "alarm" + str(i), "content" : "content",
+                                          "id" : str(i), "time" : "2500-02-20T21:03"})
+        time.sleep(0.01)
+
+    archived = []
+    removed = repository.compact(2, 3, archive = archived.append)
+    assert [notif["title"] for notif in removed["notifications"]] == ["notif0", "notif1"]
+    assert [alarm["title"] for alarm in removed["undismissed_alarms"]] == ["alarm0"]
+    assert archived == [removed]
+    assert sorted(notif["title"] for notif in repository.notifications()) == ["notif2", "notif3"]
+    assert len(repository.undismissed_alarms()) == 3
+
+    #nothing is removed if the archive can't be written
+    def failing_archive(removed):
+        raise OSError("disk full")
+    try:
+        repository.compact(oldest = time.time() + 1, archive = failing_archive)
+        assert False
+    except OSError:
+        pass
+    assert len(repository.notifications()) == 2
+
+    removed = repository.compact(oldest = time.time() + 1)
+    assert len(removed["notifications"]) == 2
+    assert len(removed["undismissed_alarms"]) == 3
+    assert repository.notifications() == [] and repository.undismissed_alarms() == []
+    assert repository.compact(0, 0) == {"notifications" : [], "undismissed_alarms" : []}
+
+def test_json_repository():
+    """Tests JSONRepository
+    """
+    saves = []
+    check_repository(JSONRepository(empty_data(), lambda: saves.append(1)))
+    assert saves
+
+def test_sqlite_repository(tmp_path):
+    """Tests SQLiteRepository
+    """
+    repository = SQLiteRepository(str(tmp_path / "briefing.db"))
+    check_repository(repository)
+    repository.close()
+
+def test_json_repository_bulk_ring():
+    """Tests JSONRepository saves a wave of alarms once per change
+    """
+    saves = []
+    repository = JSONRepository(empty_data(), lambda: saves.append(1))
+    check_bulk_ring(repository)
+    #five alarms added, then one save each to pop and add the wave
+    assert len(saves) == 7
+
+def test_sqlite_repository_bulk_ring(tmp_path):
+    """Tests SQLiteRepository takes a wave of alarms in one transaction
+    """
+    repository = SQLiteRepository(str(tmp_path / "briefing.db"))
+    check_bulk_ring(repository)
+    repository.close()
+
+def test_json_repository_compact():
+    """Tests JSONRepository.compact
+    """
+    check_compact(JSONRepository(empty_data(), lambda: None))
+
+def test_sqlite_repository_compact(tmp_path):
+    """Tests SQLiteRepository.compact
+    """
+    repository = SQLiteRepository(str(tmp_path / "briefing.db"))
+    check_compact(repository)
+    repository.close()
+
+def test_sqlite_repository_import(tmp_path):
+    """Tests that a new database is filled from the config file, and
+    that ringing alarms are put back by requeue_ringing_alarms
+    """
+    data = empty_data()
+    data["ID-value"] = 5
+    data["upcoming_alarms"].append({"title" : "alarm (ID : 4)", "content" : "content",
+                                    "id" : "4", "time" : "2500-02-20T21:03"})
+    data["notifications"].append({"title" : "notif", "content" : "content"})
+    path = str(tmp_path / "briefing.db")
+
+    repository = SQLiteRepository(path, data)
+    assert repository.current_alarm_id() == "5"
+    assert repository.has_notification("notif")
+    assert repository.pop_upcoming_alarm("alarm (ID : 4)") is not None
+    assert repository.upcoming_alarms() == []
+    repository.close()
+
+    #only copied into a new database
+    data["notifications"].append({"title" : "notif2", "content" : "content"})
+    repository = SQLiteRepository(path, data)
+    assert not repository.has_notification("notif2")
+    assert repository.upcoming_alarms() == []
+    assert repository.requeue_ringing_alarms() == 1
+    assert len(repository.upcoming_alarms()) == 1
+    repository.close()
+
+def test_sqlite_repository_shared(tmp_path):
+    """Tests that two connections to one database (as two worker
+    processes would have) see each other's changes, and that an
+    alarm can only be claimed for ringing once
+    """
+    path = str(tmp_path / "briefing.db")
+    first = SQLiteRepository(path)
+    second = SQLiteRepository(path)
+    assert first.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    version = second.version
+    data_version = second.data_version()
+    first.add_alarm({"title" : "alarm (ID : 0)", "content" : "content", "id" : "0",
+                     "time" : "2500-02-20T21:03"})
+    assert second.version > version
+    assert second.data_version() != data_version
+    assert second.current_alarm_id() == "1"
+
+    #a second alarm with a clashing ID is refused rather than replacing the first
+    try:
+        second.add_alarm({"title" : "other (ID : 0)", "content" : "content", "id" : "0",
+                          "time" : "2500-02-20T21:03"})
+        assert False
+    except AlarmExistsError:
+        pass
+
+    assert first.pop_upcoming_alarm("alarm (ID : 0)") is not None
+    assert second.pop_upcoming_alarm("alarm (ID : 0)") is None
+
+    first.close()
+    second.close()
+
+def test_sqlite_repository_uses_indexes(tmp_path):
+    """Tests that alarm lookups use indexes instead of scanning the table
+    """
+    repository = SQLiteRepository(str(tmp_path / "briefing.db"))
+
+    plans = [
+        "SELECT * FROM alarms WHERE title = 'a' AND state = 'upcoming'",
+        "SELECT * FROM alarms WHERE state = 'upcoming' ORDER BY fire_at",
+        "SELECT * FROM alarms WHERE id = 'a'",
+    ]
+    for query in plans:
+        plan = repository.connection.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+        details = " ".join(row["detail"] for row in plan)
+        assert "USING" in details and "SCAN alarms" not in details.replace("USING", "")
+
+    repository.close()
+
+def test_open_repository(tmp_path):
+    """Tests open_repository method
+    """
+    data = empty_data()
+    assert isinstance(open_repository({}, data, None), JSONRepository)
+
+    settings = {"storage-backend" : "sqlite", "database-path" : str(tmp_path / "briefing.db")}
+    repository = open_repository(settings, data, None)
+    assert isinstance(repository, SQLiteRepository)
+    repository.close()
+
+def stress_repository(repository, creators : int = 8, alarms_per_creator : int = 50):
+    """Creates, rings, deletes and reads alarms from many threads at once,
+    then checks every alarm was created once, with its own ID, and ended
+    up either deleted or still stored, never both or neither
+    """
+    created = []
+    deleted = []
+    rung = []
+    duplicates = []
+    results_lock = threading.Lock()
+    creating_done = threading.Event()
+
+    def create():
+        for i in range(alarms_per_creator):
+            while True:
+                alarm_id = repository.current_alarm_id()
+                alarm = {"title" : "alarm (ID : " + alarm_id + ")", "content" : "content",
+                         "id" : alarm_id, "time" : "2500-01-01T08:00", "fire_at" : 1.0}
+                try:
+                    repository.add_alarm(alarm)
+                    break
+                except AlarmExistsError:
+                    continue
+            with results_lock:
+                created.append(alarm["title"])
+
+    def ring_and_delete():
+        while not creating_done.is_set() or repository.upcoming_alarms():
+            for alarm in repository.upcoming_alarms():
+                popped = repository.pop_upcoming_alarm(alarm["title"])
+                if popped is not None:
+                    with results_lock:
+                        rung.append(popped["title"])
+                    repository.add_undismissed_alarm(popped)
+            for alarm in repository.undismissed_alarms()[::2]:
+                titles = [alarm["title"] for alarm in repository.delete_alarm(alarm["title"])]
+                with results_lock:
+                    deleted.extend(titles)
+
+    def read():
+        while not creating_done.is_set():
+            snapshot = repository.snapshot()
+            titles = [alarm["title"] for alarm in
+                      snapshot["upcoming_alarms"] + snapshot["undismissed_alarms"]]
+            if len(set(titles)) != len(titles):
+                duplicates.append(titles)
+
+    threads = [threading.Thread(target = create) for i in range(creators)]
+    threads += [threading.Thread(target = ring_and_delete) for i in range(4)]
+    threads += [threading.Thread(target = read) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads[:creators]:
+        thread.join()
+    creating_done.set()
+    for thread in threads[creators:]:
+        thread.join()
+
+    assert len(created) == creators * alarms_per_creator
+    assert len(set(created)) == len(created)
+    assert len(set(rung)) == len(rung)
+    assert duplicates == []
+
+    remaining = [alarm["title"] for alarm in
+                 repository.upcoming_alarms() + repository.undismissed_alarms()]
+    assert sorted(remaining + deleted) == sorted(created)
+    assert repository.current_alarm_id() == str(len(created))
+
+def test_json_repository_concurrency():
+    """Stress tests JSONRepository, saving the lists as config_writer would
+    """
+    holder = []
+    repository = JSONRepository(empty_data(), lambda: holder[0].sync_to_data())
+    holder.append(repository)
+    stress_repository(repository)
+
+def test_sqlite_repository_concurrency(tmp_path):
+    """Stress tests SQLiteRepository
+    """
+    repository = SQLiteRepository(str(tmp_path / "briefing.db"))
+    stress_repository(repository)
+    repository.close()
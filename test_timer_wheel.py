@@ -0,0 +1,90 @@
+from timer_wheel import TimerWheel
+
+class FakeClock:
+    """Time that only moves when slept through
+    """
+
+    def __init__(self, now : float = 600):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds : float):
+        self.now += seconds
+
+def test_timer_wheel_runs_in_order():
+    """Tests events run in time then priority order, across slots
+    """
+    clock = FakeClock()
+    wheel = TimerWheel(clock.time, clock.sleep)
+    ran = []
+
+    for event_time, priority, name in [(700, 1, "c"), (650, 2, "b"), (650, 1, "a"), (4000, 1, "d")]:
+        wheel.enterabs(event_time, priority, ran.append, (name,))
+
+    assert len(wheel.queue) == 4
+    wheel.run()
+
+    assert ran == ["a", "b", "c", "d"]
+    assert clock.now == 4000
+    assert wheel.empty()
+
+def test_timer_wheel_cancel_and_non_blocking_run():
+    """Tests cancelled events don't run, and a non-blocking run
+    returns the delay until the next event
+    """
+    clock = FakeClock()
+    wheel = TimerWheel(clock.time, clock.sleep)
+    ran = []
+
+    first = wheel.enter(0, 1, ran.append, ("first",))
+    cancelled = wheel.enter(30, 1, ran.append, ("cancelled",))
+    wheel.enter(90, 1, ran.append, ("later",))
+    wheel.cancel(cancelled)
+
+    try:
+        wheel.cancel(cancelled)
+        assert False
+    except ValueError:
+        pass
+
+    assert wheel.run(blocking = False) == 90
+    assert ran == ["first"]
+    try:
+        wheel.cancel(first)
+        assert False
+    except ValueError:
+        pass
+
+    clock.now += 90
+    assert wheel.run(blocking = False) is None
+    assert ran == ["first", "later"]
+
+def test_timer_wheel_events_until():
+    """Tests events due by a time are found from their slots
+    """
+    clock = FakeClock()
+    wheel = TimerWheel(clock.time, clock.sleep)
+    due = [wheel.enterabs(600 + 60 * i, 1, print) for i in range(3)]
+    wheel.enterabs(600 + 3600, 1, print)
+
+    assert sorted(wheel.events_until(720)) == due
+    assert wheel.events_until(599) == []
+
+def test_timer_wheel_slot_churn():
+    """Tests emptying and refilling a slot doesn't grow the heap of slots
+    """
+    clock = FakeClock()
+    wheel = TimerWheel(clock.time, clock.sleep)
+    ran = []
+
+    for i in range(1000):
+        event = wheel.enterabs(600 + 24 * 3600, 1, ran.append, ("cancelled",))
+        wheel.cancel(event)
+    assert len(wheel.slot_heap) == 1
+
+    wheel.enterabs(600 + 24 * 3600, 1, ran.append, ("kept",))
+    wheel.run()
+    assert ran == ["kept"]
+    assert wheel.slot_heap == [] and wheel.heap_numbers == set()
@@ -0,0 +1,105 @@
+import time
+import threading
+from upstream_cache import TTLCache
+
+def test_ttl_cache_expiry():
+    """Tests that values are reused until their time to live runs out
+    """
+    cache = TTLCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_fetch("key", fetch, 0.2) == 1
+    assert cache.get_or_fetch("key", fetch, 0.2) == 1
+    time.sleep(0.3)
+    assert cache.get_or_fetch("key", fetch, 0.2) == 2
+
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 2
+
+def test_ttl_cache_stale():
+    """Tests that the last value is kept for get_stale after it expires
+    """
+    cache = TTLCache()
+
+    cache.put("key", "old", 0)
+    assert cache.get("key") is None
+    assert cache.get_stale("key") == "old"
+    assert cache.get_stale("missing") is None
+
+    try:
+        cache.get_or_fetch("key", lambda: 1 / 0, 10)
+        assert False
+    except ZeroDivisionError:
+        pass
+    assert cache.get_stale("key") == "old"
+
+def test_ttl_cache_eviction():
+    """Tests that the least recently used value is evicted when full
+    """
+    cache = TTLCache(max_entries = 2)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats["evictions"] == 1
+
+def test_ttl_cache_coalescing():
+    """Tests that concurrent callers share one fetch
+    """
+    cache = TTLCache()
+    calls = []
+    results = []
+
+    def slow_fetch():
+        calls.append(1)
+        time.sleep(0.3)
+        return "value"
+
+    def caller():
+        results.append(cache.get_or_fetch("key", slow_fetch, 60))
+
+    threads = [threading.Thread(target = caller) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["value"] * 10
+    assert cache.stats["coalesced"] == 9
+
+def test_ttl_cache_errors_not_cached():
+    """Tests that a failed fetch isn't cached
+    """
+    cache = TTLCache()
+
+    def failing_fetch():
+        raise ValueError("upstream down")
+
+    try:
+        cache.get_or_fetch("key", failing_fetch, 60)
+        assert False
+    except ValueError:
+        pass
+
+    assert cache.get_or_fetch("key", lambda: "value", 60) == "value"
+
+def test_ttl_cache_ttl_function():
+    """Tests that the time to live can depend on the fetched value
+    """
+    cache = TTLCache()
+
+    cache.get_or_fetch("final", lambda: "final", lambda value: None)
+    cache.get_or_fetch("recent", lambda: "recent", lambda value: 0)
+
+    assert cache.get("final") == "final"
+    assert cache.get("recent") is None
@@ -0,0 +1,213 @@
+"""Timer wheel for scheduling very large numbers of alarms.
+
+sched.scheduler keeps one heap of every event, and cancelling an event
+searches the whole heap. TimerWheel has the same interface, but keeps
+events in one slot per minute (the granularity of alarm times), so
+queueing and cancelling an event are O(1) whatever the number of alarms.
+Only the slot being run is sorted, and the slots themselves are ordered
+by a heap of their minutes, which grows with the number of distinct
+minutes rather than the number of alarms.
+
+ECM1400, Programming, CA3
+"""
+
+import time
+import heapq
+import threading
+import itertools
+from sched import Event
+
+
+class Slot:
+    """Events due in one minute. The heap of (time, priority, sequence)
+    is only built once the slot is the next to run
+    """
+
+    __slots__ = ("events", "heap")
+
+    def __init__(self):
+        #sequence -> event
+        self.events = {}
+        self.heap = None
+
+
+class TimerWheel:
+    """Drop-in replacement for sched.scheduler (enter, enterabs, cancel,
+    empty, run and queue), with O(1) enterabs and cancel. Events in the
+    same slot run in (time, priority) order, as with sched
+    """
+
+    def __init__(self, timefunc = time.time, delayfunc = time.sleep, granularity : float = 60):
+        """Keyword Arguments:
+        timefunc -- Returns the current time
+        delayfunc -- Waits the given number of seconds
+        granularity -- Seconds covered by each slot
+        """
+
+        self.timefunc = timefunc
+        self.delayfunc = delayfunc
+        self.granularity = granularity
+        #slot number -> Slot, and a heap of slot numbers, which may hold
+        #numbers of slots that have since emptied. Each number is in the
+        #heap at most once (heap_numbers), however often its slot empties
+        #and fills again
+        self.slots = {}
+        self.slot_heap = []
+        self.heap_numbers = set()
+        self.count = 0
+        self.lock = threading.RLock()
+        self.sequence = itertools.count()
+
+    def slot_number(self, event_time : float) -> int:
+        return int(event_time // self.granularity)
+
+    def enterabs(self, event_time : float, priority, action, argument : tuple = (),
+                 kwargs : dict = None) -> Event:
+        """Queues action(*argument, **kwargs) to run at event_time.
+        Returns the event, which can be passed to cancel
+
+        Keyword Arguments:
+        event_time -- Time to run at, as returned by timefunc
+        priority -- Lower runs first among events at the same time
+        action -- Function to run
+        argument -- Positional arguments of action
+        kwargs -- Keyword arguments of action
+        """
+
+        event = Event(event_time, priority, next(self.sequence), action, argument,
+                      {} if kwargs is None else kwargs)
+        number = self.slot_number(event_time)
+
+        with self.lock:
+            slot = self.slots.get(number)
+            if slot is None:
+                slot = self.slots[number] = Slot()
+                if number not in self.heap_numbers:
+                    heapq.heappush(self.slot_heap, number)
+                    self.heap_numbers.add(number)
+            slot.events[event.sequence] = event
+            if slot.heap is not None:
+                heapq.heappush(slot.heap, (event.time, event.priority, event.sequence))
+            self.count += 1
+
+        return event
+
+    def enter(self, delay : float, priority, action, argument : tuple = (),
+              kwargs : dict = None) -> Event:
+        """Queues action to run delay seconds from now (see enterabs)"""
+
+        return self.enterabs(self.timefunc() + delay, priority, action, argument, kwargs)
+
+    def cancel(self, event : Event):
+        """Removes an event from the queue. Raises ValueError if it
+        isn't queued, as sched.scheduler does
+
+        Keyword Arguments:
+        event -- Event returned by enter or enterabs
+        """
+
+        number = self.slot_number(event.time)
+
+        with self.lock:
+            slot = self.slots.get(number)
+            if slot is None or event.sequence not in slot.events:
+                raise ValueError(event)
+            #left in the slot's heap, if it has one, and skipped when reached
+            del slot.events[event.sequence]
+            self.count -= 1
+            if not slot.events:
+                del self.slots[number]
+
+    def empty(self) -> bool:
+        with self.lock:
+            return self.count == 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def next_event(self) -> tuple:
+        """Returns (slot number, slot, event) of the next event to run,
+        or None if there are none. Must be called with lock held
+
+        No arguments
+        """
+
+        while self.slot_heap:
+            number = self.slot_heap[0]
+            slot = self.slots.get(number)
+            if slot is None:
+                heapq.heappop(self.slot_heap)
+                self.heap_numbers.discard(number)
+                continue
+
+            if slot.heap is None:
+                slot.heap = [(event.time, event.priority, event.sequence)
+                             for event in slot.events.values()]
+                heapq.heapify(slot.heap)
+            while slot.heap[0][2] not in slot.events:
+                heapq.heappop(slot.heap)
+            return number, slot, slot.events[slot.heap[0][2]]
+
+        return None
+
+    def run(self, blocking : bool = True):
+        """Runs events as they become due. If blocking, waits for and runs
+        every event until the queue is empty. Otherwise runs the events
+        that are due and returns the seconds until the next one, or None
+
+        Keyword Arguments:
+        blocking -- Whether to wait for events that aren't due yet
+        """
+
+        while True:
+            with self.lock:
+                found = self.next_event()
+                if found is None:
+                    return None
+                number, slot, event = found
+                delay = event.time - self.timefunc()
+                if delay <= 0:
+                    heapq.heappop(slot.heap)
+                    del slot.events[event.sequence]
+                    self.count -= 1
+                    if not slot.events:
+                        del self.slots[number]
+
+            if delay > 0:
+                if not blocking:
+                    return delay
+                self.delayfunc(delay)
+                continue
+
+            event.action(*event.argument, **event.kwargs)
+            #lets other threads run, as sched.scheduler does
+            self.delayfunc(0)
+
+    def events_until(self, until : float) -> list:
+        """Returns queued events due by until, in no particular order.
+        Only the slots up to until are looked at
+
+        Keyword Arguments:
+        until -- Latest time of events returned
+        """
+
+        last = self.slot_number(until)
+        with self.lock:
+            found = self.next_event()
+            if found is None:
+                return []
+            first = found[0]
+            if last - first < len(self.slots):
+                numbers = [number for number in range(first, last + 1) if number in self.slots]
+            else:
+                numbers = [number for number in self.slots if number <= last]
+            return [event for number in numbers for event in self.slots[number].events.values()
+                    if event.time <= until]
+
+    @property
+    def queue(self) -> list:
+        """Sorted list of upcoming events, as sched.scheduler.queue"""
+
+        with self.lock:
+            events = [event for slot in self.slots.values() for event in slot.events.values()]
+        return sorted(events)
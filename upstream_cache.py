@@ -0,0 +1,141 @@
+"""Cache for responses from the news, weather and COVID-19 APIs,
+so alarms and notifications ringing together share one fetch.
+
+ECM1400, Programming, CA3
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """Size-bounded cache whose entries expire after a time to live.
+
+    Concurrent get_or_fetch calls for the same missing key are coalesced:
+    the first caller fetches, and the others wait for its result instead
+    of fetching again. When full, the least recently used entry is evicted.
+    Expired entries are kept until evicted or replaced, so get_stale can
+    serve the last good value while a source is down.
+    """
+
+    def __init__(self, max_entries : int = 256):
+        """Keyword Arguments:
+        max_entries -- Most entries kept before old ones are evicted
+        """
+
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits" : 0, "misses" : 0, "coalesced" : 0, "evictions" : 0, "stale" : 0}
+
+    def get(self, key):
+        """Returns cached value for key, or None if it is missing or expired
+
+        Keyword Arguments:
+        key -- Key of value
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def get_stale(self, key):
+        """Returns the last value stored for key, even if it has expired,
+        or None if there isn't one
+
+        Keyword Arguments:
+        key -- Key of value
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.stats["stale"] += 1
+            return entry[1]
+
+    def put(self, key, value, ttl : float = None):
+        """Stores value for key
+
+        Keyword Arguments:
+        key -- Key of value
+        value -- Value to be cached
+        ttl -- Seconds the value is kept for. None keeps it until evicted
+        """
+
+        expires_at = None if ttl is None else time.monotonic() + ttl
+
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+                self.stats["evictions"] += 1
+
+    def get_or_fetch(self, key, fetch, ttl : float = None):
+        """Returns cached value for key. If there isn't one, fetch() is called
+        (once, however many threads are asking) and its result is cached.
+        Exceptions raised by fetch are passed on to every waiting caller,
+        and aren't cached
+
+        Keyword Arguments:
+        key -- Key of value
+        fetch -- Function taking no arguments that returns the value
+        ttl -- Seconds the value is kept for. None keeps it until evicted.
+               Can also be a function, called with the fetched value,
+               that returns the number of seconds
+        """
+
+        value = self.get(key)
+        if value is not None:
+            with self.lock:
+                self.stats["hits"] += 1
+            return value
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                is_fetcher = False
+            else:
+                future = Future()
+                self.in_flight[key] = future
+                self.stats["misses"] += 1
+                is_fetcher = True
+
+        if not is_fetcher:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as raised_exception:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(raised_exception)
+            raise
+
+        if callable(ttl):
+            ttl = ttl(value)
+        self.put(key, value, ttl)
+        with self.lock:
+            del self.in_flight[key]
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        """Removes all cached values
+
+        No arguments
+        """
+
+        with self.lock:
+            self.entries.clear()